@@ -0,0 +1,45 @@
+"""Add shift_solution_cache table
+
+Revision ID: a3f1c9d2e7b4
+Revises: 0c43973a8d3f
+Create Date: 2026-10-19 09:12:31.482117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f1c9d2e7b4'
+down_revision: Union[str, None] = '0c43973a8d3f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('shift_solution_cache',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('store_id', sa.Integer(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=False),
+    sa.Column('input_hash', sa.String(length=64), nullable=False),
+    sa.Column('result', sa.Text(), nullable=False),
+    sa.Column('hit_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('last_used_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['store_id'], ['stores.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('input_hash')
+    )
+    op.create_index(op.f('ix_shift_solution_cache_id'), 'shift_solution_cache', ['id'], unique=False)
+    op.create_index('ix_shift_solution_cache_last_used_at', 'shift_solution_cache', ['last_used_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_shift_solution_cache_last_used_at', table_name='shift_solution_cache')
+    op.drop_index(op.f('ix_shift_solution_cache_id'), table_name='shift_solution_cache')
+    op.drop_table('shift_solution_cache')
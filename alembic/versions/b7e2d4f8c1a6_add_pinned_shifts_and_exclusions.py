@@ -0,0 +1,43 @@
+"""Add pinned flag to shift_results and shift_exclusions table
+
+Revision ID: b7e2d4f8c1a6
+Revises: a3f1c9d2e7b4
+Create Date: 2026-10-19 14:05:47.208311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e2d4f8c1a6'
+down_revision: Union[str, None] = 'a3f1c9d2e7b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('shift_results', sa.Column('pinned', sa.Boolean(), server_default='0', nullable=False))
+    op.create_table('shift_exclusions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('staff_id', sa.Integer(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['staff_id'], ['staffs.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_shift_exclusions_id'), 'shift_exclusions', ['id'], unique=False)
+    op.create_index('ix_shift_exclusions_staff_month', 'shift_exclusions', ['staff_id', 'year', 'month', 'day'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_shift_exclusions_staff_month', table_name='shift_exclusions')
+    op.drop_index(op.f('ix_shift_exclusions_id'), table_name='shift_exclusions')
+    op.drop_table('shift_exclusions')
+    op.drop_column('shift_results', 'pinned')
@@ -0,0 +1,44 @@
+"""Add shift_alternatives table
+
+Revision ID: c5a8e3b1d907
+Revises: b7e2d4f8c1a6
+Create Date: 2026-10-19 16:40:12.551873
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5a8e3b1d907'
+down_revision: Union[str, None] = 'b7e2d4f8c1a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('shift_alternatives',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('store_id', sa.Integer(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=False),
+    sa.Column('rank', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Integer(), nullable=False),
+    sa.Column('metrics', sa.Text(), nullable=False),
+    sa.Column('result', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['store_id'], ['stores.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_shift_alternatives_id'), 'shift_alternatives', ['id'], unique=False)
+    op.create_index('ix_shift_alternatives_store_month', 'shift_alternatives', ['store_id', 'year', 'month'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_shift_alternatives_store_month', table_name='shift_alternatives')
+    op.drop_index(op.f('ix_shift_alternatives_id'), table_name='shift_alternatives')
+    op.drop_table('shift_alternatives')
@@ -0,0 +1,55 @@
+"""Add shift_generation_jobs table
+
+Revision ID: d4f1a7c2b9e5
+Revises: c5a8e3b1d907
+Create Date: 2026-10-19 18:05:37.204419
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4f1a7c2b9e5'
+down_revision: Union[str, None] = 'c5a8e3b1d907'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('shift_generation_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('store_id', sa.Integer(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=False),
+    sa.Column('strategy', sa.String(length=32), nullable=False),
+    sa.Column('time_limit', sa.Float(), nullable=False),
+    sa.Column('warm_start', sa.Boolean(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('available_at', sa.DateTime(), nullable=False),
+    sa.Column('worker_id', sa.String(length=255), nullable=True),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('counts', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['store_id'], ['stores.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_shift_generation_jobs_id'), 'shift_generation_jobs', ['id'], unique=False)
+    op.create_index('ix_shift_generation_jobs_status_available', 'shift_generation_jobs', ['status', 'available_at'], unique=False)
+    op.create_index('ix_shift_generation_jobs_store_month', 'shift_generation_jobs', ['store_id', 'year', 'month'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_shift_generation_jobs_store_month', table_name='shift_generation_jobs')
+    op.drop_index('ix_shift_generation_jobs_status_available', table_name='shift_generation_jobs')
+    op.drop_index(op.f('ix_shift_generation_jobs_id'), table_name='shift_generation_jobs')
+    op.drop_table('shift_generation_jobs')
@@ -0,0 +1,40 @@
+"""Add store_labor_rules table
+
+Revision ID: e8b3c6d1f2a4
+Revises: d4f1a7c2b9e5
+Create Date: 2026-10-19 19:12:08.734120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8b3c6d1f2a4'
+down_revision: Union[str, None] = 'd4f1a7c2b9e5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('store_labor_rules',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('store_id', sa.Integer(), nullable=False),
+    sa.Column('rule', sa.String(length=64), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['store_id'], ['stores.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_store_labor_rules_id'), 'store_labor_rules', ['id'], unique=False)
+    op.create_index('ix_store_labor_rules_store_rule', 'store_labor_rules', ['store_id', 'rule'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_store_labor_rules_store_rule', table_name='store_labor_rules')
+    op.drop_index(op.f('ix_store_labor_rules_id'), table_name='store_labor_rules')
+    op.drop_table('store_labor_rules')
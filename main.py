@@ -3,23 +3,40 @@ from fastapi import (
     Form, Query
 )
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
 from sqlalchemy.orm import Session
 from calendar import monthrange
 from datetime import datetime, timedelta, date
+import asyncio
+import json
 import dotenv
 import jpholiday
 from pydantic_models import StaffOut
 from models import (
     Store, Staff, ShiftRequest, Shift, Shiftresult,
     StoreDefaultSkillRequirement, ShiftPattern,
-    StaffRejectionHistory
+    StaffRejectionHistory, ShiftExclusion, ShiftGenerationJob
 )
 from database import SessionLocal, engine
 from utils import get_common_context, get_db, get_current_staff, generate_time_options
-from shift.shift_creator import create_shift, get_holidays
+from shift.shift_alternatives import (
+    MAX_ALTERNATIVES, generate_alternatives, store_alternatives,
+    load_alternatives, load_alternative_results
+)
+from shift.shift_generator import save_shift_results
+from shift.shift_jobs import enqueue_generation_job
+from shift.shift_rules import load_labor_rules, save_labor_rules
+from shift.shift_scenario import MAX_SCENARIOS, run_scenarios
+from shift.shift_snapshot import load_snapshot
+from shift.shift_supervisor import (
+    MAX_TIME_LIMIT, run_cached_generation, run_supervised_generation,
+    cancel_generation, stop_generation, generation_job_key
+)
+from shift.shift_validator import validate_schedule, validate_shift_requests
+from shift.shift_warmstart import count_carry_in
+from starlette.concurrency import run_in_threadpool
 import re
 from typing import Optional, Dict, List
 from urllib.parse import urlencode
@@ -373,6 +390,10 @@ async def shift_request_form(
 
     # カレンダー日付生成
     first_day = date(year, month, 1)
+    time_options = generate_time_options(
+        request, store.open_hours, store.close_hours,
+        load_labor_rules(db, store.id).minor_end_hour
+    )
     dates = []
     d = first_day
     while d.month == month:
@@ -384,7 +405,7 @@ async def shift_request_form(
             "is_saturday": d.weekday() == 5,
             "is_sunday": d.weekday() == 6,
             "editable": True,
-            "time_options": generate_time_options(request, store.open_hours, store.close_hours)
+            "time_options": time_options
         })
         d += timedelta(days=1)
 
@@ -668,7 +689,10 @@ async def shift_request_overview(
         "selected_month": month,
         "staffs": staff_list,
         "staff_shifts": staff_shifts,
-        "time_options": generate_time_options(request, store.open_hours, store.close_hours),
+        "time_options": generate_time_options(
+            request, store.open_hours, store.close_hours,
+            load_labor_rules(db, store.id).minor_end_hour
+        ),
         "message": message
     })
 
@@ -692,68 +716,32 @@ async def save_or_generate_shift_request(
                 year = int(form_data.get("year"))
                 month = int(form_data.get("month"))
                 
-                # 店舗情報を取得
-                store = db.query(Store).filter(Store.id == store_id).first()
-                if not store:
-                    raise ValueError("店舗が見つかりません")
-                
-                # 社員とバイトを取得
-                employees = db.query(Staff).filter(
-                    Staff.store_id == store_id,
-                    Staff.employment_type == "社員"
-                ).all()
-                staffs = db.query(Staff).filter(
-                    Staff.store_id == store_id,
-                    Staff.employment_type != "社員"
-                ).all()
-                
-                # シフト希望を取得
-                shift_requests = db.query(ShiftRequest).filter(
-                    ShiftRequest.staff_id.in_([s.id for s in employees + staffs]),
-                    ShiftRequest.year == year,
-                    ShiftRequest.month == month
-                ).all()
-                
-                # 既存のシフトデータを削除
-                staff_ids = [s.id for s in employees + staffs]
-                print(f"既存のシフトデータを削除します: 店舗ID={store_id}, 年={year}, 月={month}")
-                
-                # シフト結果を削除
-                deleted_results = db.query(Shiftresult).filter(
-                    Shiftresult.staff_id.in_(staff_ids),
-                    Shiftresult.year == year,
-                    Shiftresult.month == month
-                ).delete(synchronize_session=False)
-                print(f"削除されたシフト結果: {deleted_results}件")
-                
-                # シフトを削除
-                deleted_shifts = db.query(Shift).filter(
-                    Shift.staff_id.in_(staff_ids),
-                    Shift.year == year,
-                    Shift.month == month
-                ).delete(synchronize_session=False)
-                print(f"削除されたシフト: {deleted_shifts}件")
-                
-                db.flush()
-                
-                # 祝日を取得
-                holidays = get_holidays(year, month)
+                # 入力を固定し、監視付きの子プロセスで生成する
+                # （失敗・中止・期限切れの場合は既存のシフトに触れない）
+                snapshot = load_snapshot(
+                    db, store_id, year, month,
+                    warm_start=bool(form_data.get("warm_start"))
+                )
+                results = await run_in_threadpool(
+                    run_cached_generation,
+                    db,
+                    snapshot,
+                    generation_job_key(store_id, year, month)
+                )
                 
-                # シフトを生成
-                create_shift(
-                    db=db,
-                    store=store,
-                    employees=employees,
-                    staffs=staffs,
-                    shift_requests=shift_requests,
-                    holidays=holidays,
-                    year=year,
-                    month=month
+                # 保存済みのシフトとの差分だけを書き込む
+                save_shift_results(
+                    db, results, year, month,
+                    [s.id for s in snapshot.employees + snapshot.staffs]
                 )
+                violations = check_saved_schedule(db, store_id, year, month)
+                message = "シフトが生成されました。"
+                if violations:
+                    message += f"（ルール違反 {len(violations)}件）"
                 
                 context.update({
                     "request": request,
-                    "message": "シフトが生成されました。"
+                    "message": message
                 })
             except ValueError as e:
                 db.rollback()
@@ -796,7 +784,10 @@ async def default_skill_settings(request: Request, db: Session = Depends(get_db)
         "settings": settings,
         "shift_patterns": shift_patterns,
         "message": message,
-        "time_options": generate_time_options(request, store.open_hours, store.close_hours),
+        "time_options": generate_time_options(
+            request, store.open_hours, store.close_hours,
+            load_labor_rules(db, store.id).minor_end_hour
+        ),
     })
 
     return templates.TemplateResponse("store_default_settings.html", context)
@@ -922,7 +913,8 @@ async def shift_temp_result(
         # end_timeが閉店時間なら"L"に置き換え
         staff_shifts[r.staff_id][r.day] = {
             "start_time": r.start_time,
-            "end_time": r.end_time
+            "end_time": r.end_time,
+            "pinned": r.pinned
         }
 
     # カレンダー日付生成
@@ -980,12 +972,50 @@ async def shift_temp_result(
         "staffs": staff_list,
         "staff_shifts": staff_shifts,
         "shift_requests": staff_requests,
-        "time_options": generate_time_options(request, store.open_hours, store.close_hours),
+        "alternatives": load_alternatives(db, store_id, year, month),
+        "time_options": generate_time_options(
+            request, store.open_hours, store.close_hours,
+            load_labor_rules(db, store.id).minor_end_hour
+        ),
         "message": message
     })
 
     return templates.TemplateResponse("shift_temp_result.html", context)
 
+
+@app.post("/shift/temp_result/alternative")
+async def adopt_shift_alternative(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """代替案を仮シフトとして採用する（固定したセルは変えない）"""
+    current_staff = get_current_staff(request, db)
+    if current_staff is None or current_staff.employment_type != "社員":
+        raise HTTPException(status_code=403, detail="社員のみアクセスできます。")
+
+    form = await request.form()
+    try:
+        row, results = load_alternative_results(
+            db, int(form.get("alternative_id"))
+        )
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if row.store_id != current_staff.store_id:
+        raise HTTPException(status_code=403, detail="権限がありません")
+
+    staff_ids = [
+        s.id for s in db.query(Staff).filter(Staff.store_id == row.store_id).all()
+    ]
+    save_shift_results(db, results, row.year, row.month, staff_ids)
+    params = {
+        "year": row.year,
+        "month": row.month,
+        "message": f"{row.rank}案を仮シフトに反映しました。"
+    }
+    return RedirectResponse(
+        url=f"/shift/temp_result?{urlencode(params)}", status_code=303
+    )
+
 @app.post("/shift/temp_result/save", response_class=HTMLResponse)
 async def save_shift_temp_result(
     request: Request,
@@ -1018,6 +1048,11 @@ async def save_shift_temp_result(
                     Shiftresult.month == month,
                     Shiftresult.staff_id.in_(store_staff_ids)
                 ).all()
+                # 手動で変更したセルは固定する（変更のないセルは固定状態を引き継ぐ）
+                existing_cells = {
+                    (r.staff_id, r.day): (r.start_time, r.end_time, r.pinned)
+                    for r in existing_results
+                }
 
                 # 既存のシフトを削除（store_id、year、monthでフィルタリング）
                 db.query(Shiftresult).filter(
@@ -1050,6 +1085,7 @@ async def save_shift_temp_result(
                                 continue
 
                 # データベースの更新
+                saved_cells = set()
                 for staff_id, days in new_shifts.items():
                     if staff_id in store_staff_ids:  # 店舗のスタッフのみ処理
                         for day, data in days.items():
@@ -1072,6 +1108,7 @@ async def save_shift_temp_result(
                             db.flush()  # IDを取得するためにflush
 
                             # シフト結果を追加
+                            cell = existing_cells.get((staff_id, day))
                             new_result = Shiftresult(
                                 staff_id=staff_id,
                                 year=year,
@@ -1079,14 +1116,24 @@ async def save_shift_temp_result(
                                 day=day,
                                 start_time=start_time,
                                 end_time=end_time,
-                                shift_id=new_shift.id
+                                shift_id=new_shift.id,
+                                pinned=cell != (start_time, end_time, False)
                             )
                             db.add(new_result)
+                            saved_cells.add((staff_id, day))
+
+                # 仮シフトから消したセルは、再生成しても埋め直さない
+                for staff_id, day in sorted(existing_cells.keys() - saved_cells):
+                    exclude_shift_day(db, staff_id, year, month, day)
 
                 db.commit()
+                violations = check_saved_schedule(db, store_id, year, month)
+                message = "シフト結果が保存されました。"
+                if violations:
+                    message += f"（ルール違反 {len(violations)}件）"
                 context.update({
                     "request": request,
-                    "message": "シフト結果が保存されました。"
+                    "message": message
                 })
                 return templates.TemplateResponse("generated.html", context)
 
@@ -1109,6 +1156,11 @@ async def save_shift_temp_result(
                     Shiftresult.month == month,
                     Shiftresult.staff_id.in_(store_staff_ids)
                 ).all()
+                # 手動で変更したセルは固定する（変更のないセルは固定状態を引き継ぐ）
+                existing_cells = {
+                    (r.staff_id, r.day): (r.start_time, r.end_time, r.pinned)
+                    for r in existing_results
+                }
 
                 # 既存のシフトを削除（store_id、year、monthでフィルタリング）
                 db.query(Shiftresult).filter(
@@ -1141,6 +1193,7 @@ async def save_shift_temp_result(
                                 continue
 
                 # データベースの更新
+                saved_cells = set()
                 for staff_id, days in new_shifts.items():
                     if staff_id in store_staff_ids:  # 店舗のスタッフのみ処理
                         for day, data in days.items():
@@ -1163,6 +1216,7 @@ async def save_shift_temp_result(
                             db.flush()  # IDを取得するためにflush
 
                             # シフト結果を追加
+                            cell = existing_cells.get((staff_id, day))
                             new_result = Shiftresult(
                                 staff_id=staff_id,
                                 year=year,
@@ -1170,9 +1224,15 @@ async def save_shift_temp_result(
                                 day=day,
                                 start_time=start_time,
                                 end_time=end_time,
-                                shift_id=new_shift.id
+                                shift_id=new_shift.id,
+                                pinned=cell != (start_time, end_time, False)
                             )
                             db.add(new_result)
+                            saved_cells.add((staff_id, day))
+
+                # 仮シフトから消したセルは、再生成しても埋め直さない
+                for staff_id, day in sorted(existing_cells.keys() - saved_cells):
+                    exclude_shift_day(db, staff_id, year, month, day)
 
                 # saveの処理が完了したら、ShiftresultからShiftテーブルにコピー
                 # 既存のシフト結果を取得
@@ -1353,7 +1413,10 @@ async def shift_other_store(
         "staffs": staff_list,
         "shift_requests": staff_requests,
         "staff_shifts": staff_shifts,
-        "time_options": generate_time_options(request,selected_store.open_hours, selected_store.close_hours)
+        "time_options": generate_time_options(
+            request, selected_store.open_hours, selected_store.close_hours,
+            load_labor_rules(db, selected_store.id).minor_end_hour
+        )
     })
 
     return templates.TemplateResponse("other_store_shifts.html", context)
@@ -1392,8 +1455,9 @@ async def edit_shift(
         )
         db.add(rejection)
         
-        # シフト結果を削除
+        # シフト結果を削除し、再生成でもこの日は勤務させない
         db.delete(shift_result)
+        exclude_shift_day(db, staff_id, year, month, day)
     
     elif action == "add":
         # 新規シフトを追加
@@ -1415,12 +1479,550 @@ async def edit_shift(
             day=day,
             start_time=start_time,
             end_time=end_time,
-            shift_id=new_shift.id
+            shift_id=new_shift.id,
+            pinned=True
         )
         db.add(new_result)
+        # 手動で追加したシフトは再生成しても上書きしない
+        db.query(ShiftExclusion).filter(
+            ShiftExclusion.staff_id == staff_id,
+            ShiftExclusion.year == year,
+            ShiftExclusion.month == month,
+            ShiftExclusion.day == day
+        ).delete(synchronize_session=False)
+
+    db.commit()
+    staff = db.query(Staff).filter(Staff.id == staff_id).first()
+    violations = check_saved_schedule(
+        db, staff.store_id, year, month
+    ) if staff else []
+    return {"status": "ok", "violations": violations}
+
+
+def check_saved_schedule(
+    db: Session,
+    store_id: int,
+    year: int,
+    month: int
+) -> List[Dict]:
+    """保存済みのシフト結果を必要人数・スキル・労務ルール・希望と突き合わせる"""
+    snapshot = load_snapshot(db, store_id, year, month, warm_start=True)
+    members = list(snapshot.employees + snapshot.staffs)
+    results = db.query(Shiftresult).filter(
+        Shiftresult.year == year,
+        Shiftresult.month == month,
+        Shiftresult.staff_id.in_([s.id for s in members])
+    ).all()
+    valid_requests = validate_shift_requests(
+        snapshot.requests, members, snapshot.store
+    )
+    prev_year, prev_month = (year - 1, 12) if month == 1 else (year, month - 1)
+    carry_in = count_carry_in(
+        snapshot.previous_shifts, monthrange(prev_year, prev_month)[1],
+        snapshot.rules.max_consecutive_days
+    )
+    return validate_schedule(
+        results, snapshot.store, members, valid_requests, snapshot.holidays,
+        year, month, snapshot.last_day, rules=snapshot.rules,
+        carry_in=carry_in
+    )
+
+
+def exclude_shift_day(db: Session, staff_id: int, year: int, month: int, day: int):
+    """スタッフのその日を「勤務させない」日として記録する（重複は作らない）"""
+    exists = db.query(ShiftExclusion).filter(
+        ShiftExclusion.staff_id == staff_id,
+        ShiftExclusion.year == year,
+        ShiftExclusion.month == month,
+        ShiftExclusion.day == day
+    ).first()
+    if not exists:
+        db.add(ShiftExclusion(staff_id=staff_id, year=year, month=month, day=day))
+
+
+@app.post("/api/shift/pin")
+async def pin_shift(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """セルを固定・固定解除する
+
+    シフトがあるセルはそのシフトを固定し、シフトがないセルは
+    「勤務させない」日として固定する。固定解除すると次の生成で作り直される。
+    """
+    current_staff = get_current_staff(request, db)
+    if current_staff.employment_type != "社員":
+        raise HTTPException(status_code=403, detail="権限がありません")
+
+    data = await request.json()
+    try:
+        staff_id = int(data.get("staff_id"))
+        year = int(data.get("year"))
+        month = int(data.get("month"))
+        day = int(data.get("day"))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="必要なパラメータが不足しています。")
+    pinned = bool(data.get("pinned", True))
+
+    staff = db.query(Staff).filter(
+        Staff.id == staff_id, Staff.store_id == current_staff.store_id
+    ).first()
+    if not staff:
+        raise HTTPException(status_code=404, detail="スタッフが見つかりません")
+
+    shift_result = db.query(Shiftresult).filter(
+        Shiftresult.staff_id == staff_id,
+        Shiftresult.year == year,
+        Shiftresult.month == month,
+        Shiftresult.day == day
+    ).first()
+    if shift_result:
+        shift_result.pinned = pinned
+    elif pinned:
+        exclude_shift_day(db, staff_id, year, month, day)
+    if not pinned:
+        db.query(ShiftExclusion).filter(
+            ShiftExclusion.staff_id == staff_id,
+            ShiftExclusion.year == year,
+            ShiftExclusion.month == month,
+            ShiftExclusion.day == day
+        ).delete(synchronize_session=False)
 
     db.commit()
-    return {"status": "ok"}
+    return {"status": "ok", "pinned": pinned}
+
+
+def parse_time_limit(data: Dict, default: float) -> float:
+    """リクエストの探索時間（秒）を読み、サーバー側の上限内か確かめる"""
+    time_limit = float(data.get("time_limit", default))
+    if not 0 < time_limit <= MAX_TIME_LIMIT:
+        raise ValueError(
+            f"探索時間は{MAX_TIME_LIMIT:.0f}秒以内で指定してください"
+        )
+    return time_limit
+
+
+@app.post("/api/shift/scenarios")
+async def compare_shift_scenarios(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """必要人数やスタッフ構成を変えたシナリオでシフトを試算する（DBは変更しない）"""
+    current_staff = get_current_staff(request, db)
+    if current_staff.employment_type != "社員":
+        raise HTTPException(status_code=403, detail="権限がありません")
+
+    data = await request.json()
+    store_id = current_staff.store_id
+    try:
+        year = int(data.get("year"))
+        month = int(data.get("month"))
+        time_limit = parse_time_limit(data, 30.0)
+        scenarios = data.get("scenarios", [])
+        if not isinstance(scenarios, list) or len(scenarios) > MAX_SCENARIOS:
+            raise ValueError(
+                f"シナリオは{MAX_SCENARIOS}件以内のリストで指定してください"
+            )
+        snapshot = load_snapshot(db, store_id, year, month)
+        # 生成は監視付きの子プロセスで行うため、イベントループを塞がないようにする
+        comparisons = await run_in_threadpool(
+            run_scenarios,
+            snapshot,
+            scenarios,
+            data.get("strategy", "greedy"),
+            time_limit,
+            job_key=f"{generation_job_key(store_id, year, month)}.scenarios"
+        )
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "ok", "results": comparisons}
+
+
+@app.post("/api/shift/alternatives")
+async def generate_shift_alternatives(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """互いに異なるシフトの代替案を1回の実行でまとめて求め、保存する
+
+    仮シフトには反映しない。仮シフト画面で案を選んで採用する。
+    """
+    current_staff = get_current_staff(request, db)
+    if current_staff.employment_type != "社員":
+        raise HTTPException(status_code=403, detail="権限がありません")
+
+    data = await request.json()
+    store_id = current_staff.store_id
+    try:
+        year = int(data.get("year"))
+        month = int(data.get("month"))
+        k = int(data.get("k", 3))
+        if not 1 <= k <= MAX_ALTERNATIVES:
+            raise ValueError(
+                f"案の数は1～{MAX_ALTERNATIVES}の範囲で指定してください"
+            )
+        time_limit = parse_time_limit(data, 30.0)
+        snapshot = load_snapshot(db, store_id, year, month)
+        # 生成は監視付きの子プロセスで行うため、イベントループを塞がないようにする
+        alternatives = await run_in_threadpool(
+            generate_alternatives,
+            snapshot,
+            k,
+            data.get("strategy", "greedy"),
+            time_limit,
+            job_key=f"{generation_job_key(store_id, year, month)}.alternatives"
+        )
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    rows = store_alternatives(db, store_id, year, month, alternatives)
+    return {
+        "status": "ok",
+        "alternatives": [
+            {
+                "id": row.id,
+                "rank": a["rank"],
+                "score": a["score"],
+                "distance": a["distance"],
+                "metrics": a["metrics"],
+            }
+            for row, a in zip(rows, alternatives)
+        ],
+    }
+
+
+@app.post("/api/shift/regenerate_range")
+async def regenerate_shift_range(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """指定した日の範囲だけシフトを作り直す（範囲外の保存済みシフトは固定）"""
+    current_staff = get_current_staff(request, db)
+    if current_staff.employment_type != "社員":
+        raise HTTPException(status_code=403, detail="権限がありません")
+
+    data = await request.json()
+    store_id = current_staff.store_id
+    try:
+        year = int(data.get("year"))
+        month = int(data.get("month"))
+        first_day = int(data.get("first_day"))
+        end_day = int(data.get("last_day"))
+        snapshot = load_snapshot(db, store_id, year, month)
+        staff_ids = [s.id for s in snapshot.employees + snapshot.staffs]
+        fixed_results = [
+            (r.staff_id, r.day, r.start_time, r.end_time)
+            for r in db.query(Shiftresult).filter(
+                Shiftresult.year == year,
+                Shiftresult.month == month,
+                Shiftresult.staff_id.in_(staff_ids)
+            ).all()
+        ]
+        results = await run_in_threadpool(
+            run_supervised_generation,
+            snapshot,
+            generation_job_key(store_id, year, month),
+            time_limit=float(data.get("time_limit", 10.0)),
+            day_range=(first_day, end_day),
+            fixed_results=fixed_results
+        )
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    counts = save_shift_results(db, results, year, month, staff_ids)
+    violations = check_saved_schedule(db, store_id, year, month)
+    return {"status": "ok", "counts": counts, "violations": violations}
+
+
+# 進捗がない間もSSEの接続を保つためにコメント行を送る間隔（秒）
+SSE_KEEPALIVE_SECONDS = 15
+
+
+def format_sse(event: str, data: Dict) -> str:
+    """Server-Sent Events の1イベント分の文字列にする"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/api/shift/generate/stream")
+async def stream_shift_generation(
+    request: Request,
+    year: int,
+    month: int,
+    strategy: str = "greedy",
+    time_limit: float = 30.0,
+    warm_start: bool = False,
+    db: Session = Depends(get_db)
+):
+    """シフトを生成し、段階と改善解をServer-Sent Eventsで送る
+
+    event: phase（段階）/ solution（改善解）/ done（保存結果とルール違反）/ error。
+    /api/shift/generation/stop で探索を打ち切るとその時点の最良解を保存する。
+    接続が切れた場合は生成を中止する。
+    """
+    current_staff = get_current_staff(request, db)
+    if current_staff.employment_type != "社員":
+        raise HTTPException(status_code=403, detail="権限がありません")
+
+    store_id = current_staff.store_id
+    try:
+        snapshot = load_snapshot(
+            db, store_id, year, month, warm_start=warm_start
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job_key = generation_job_key(store_id, year, month)
+    staff_ids = [s.id for s in snapshot.employees + snapshot.staffs]
+
+    async def event_stream():
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def on_progress(event: Dict) -> None:
+            # 監視スレッドから呼ばれるため、イベントループに渡して積む
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+        # キャッシュの参照・保存とシフトの保存に使う（リクエストの
+        # セッションはストリームの送信中に閉じられるため別に開く）
+        save_db = SessionLocal()
+        task = asyncio.ensure_future(run_in_threadpool(
+            run_cached_generation,
+            save_db,
+            snapshot,
+            job_key,
+            strategy=strategy,
+            time_limit=time_limit,
+            on_progress=on_progress
+        ))
+        try:
+            yield format_sse("phase", {
+                "type": "phase", "phase": "start",
+                "message": "シフトの生成を開始しました",
+                "strategy": strategy, "time_limit": time_limit
+            })
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait(
+                    {getter, task}, timeout=SSE_KEEPALIVE_SECONDS,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if getter in done:
+                    event = getter.result()
+                    yield format_sse(event["type"], event)
+                    continue
+                getter.cancel()
+                if task.done():
+                    break
+                yield ": keepalive\n\n"
+            while not queue.empty():
+                event = queue.get_nowait()
+                yield format_sse(event["type"], event)
+
+            try:
+                results = task.result()
+            except ValueError as e:
+                yield format_sse("error", {"type": "error", "message": str(e)})
+                return
+
+            yield format_sse("phase", {
+                "type": "phase", "phase": "persistence",
+                "message": "シフトを保存しています"
+            })
+            try:
+                counts = save_shift_results(
+                    save_db, results, year, month, staff_ids
+                )
+                violations = check_saved_schedule(
+                    save_db, store_id, year, month
+                )
+            except Exception as e:
+                save_db.rollback()
+                yield format_sse("error", {
+                    "type": "error", "message": f"シフトの保存に失敗しました: {e}"
+                })
+                return
+            yield format_sse("done", {
+                "type": "done", "shifts": len(results), "counts": counts,
+                "violations": violations
+            })
+        finally:
+            if not task.done():
+                # 接続が切れた場合は生成を続けても結果を届けられない
+                cancel_generation(job_key)
+                # 生成スレッドが終わってからセッションを閉じる
+                task.add_done_callback(lambda _: save_db.close())
+            else:
+                save_db.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/api/shift/generation/stop")
+async def stop_shift_generation(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """実行中のシフト生成の探索を打ち切り、その時点の最良解で完了させる"""
+    current_staff = get_current_staff(request, db)
+    if current_staff.employment_type != "社員":
+        raise HTTPException(status_code=403, detail="権限がありません")
+
+    data = await request.json()
+    try:
+        year = int(data.get("year"))
+        month = int(data.get("month"))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="年月が不正です")
+
+    stopped = stop_generation(
+        generation_job_key(current_staff.store_id, year, month)
+    )
+    if not stopped:
+        raise HTTPException(status_code=404, detail="実行中のシフト生成がありません")
+    return {"status": "ok", "stopped": stopped}
+
+
+@app.post("/api/shift/jobs")
+async def enqueue_shift_generation_job(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """シフト生成をジョブとしてキューに積む（ワーカープロセスが実行する）"""
+    current_staff = get_current_staff(request, db)
+    if current_staff.employment_type != "社員":
+        raise HTTPException(status_code=403, detail="権限がありません")
+
+    data = await request.json()
+    try:
+        year = int(data.get("year"))
+        month = int(data.get("month"))
+        time_limit = float(data.get("time_limit", 30.0))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="年月が不正です")
+
+    job = enqueue_generation_job(
+        db, current_staff.store_id, year, month,
+        strategy=data.get("strategy", "greedy"),
+        time_limit=time_limit,
+        warm_start=bool(data.get("warm_start"))
+    )
+    return {"status": "ok", "job_id": job.id, "job_status": job.status}
+
+
+@app.get("/api/shift/jobs/{job_id}")
+async def get_shift_generation_job(
+    job_id: int,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """シフト生成ジョブの状態を返す"""
+    current_staff = get_current_staff(request, db)
+    if current_staff.employment_type != "社員":
+        raise HTTPException(status_code=403, detail="権限がありません")
+
+    job = db.query(ShiftGenerationJob).filter(
+        ShiftGenerationJob.id == job_id,
+        ShiftGenerationJob.store_id == current_staff.store_id
+    ).first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return {
+        "job_id": job.id,
+        "year": job.year,
+        "month": job.month,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "worker_id": job.worker_id,
+        "error": job.error,
+        "counts": json.loads(job.counts) if job.counts else None,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+
+@app.get("/api/shift/violations")
+async def get_shift_violations(
+    request: Request,
+    year: int,
+    month: int,
+    db: Session = Depends(get_db)
+):
+    """保存済みのシフトのルール違反を一覧にする"""
+    current_staff = get_current_staff(request, db)
+    if current_staff.employment_type != "社員":
+        raise HTTPException(status_code=403, detail="権限がありません")
+
+    try:
+        violations = check_saved_schedule(
+            db, current_staff.store_id, year, month
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "ok", "count": len(violations), "violations": violations}
+
+
+@app.get("/api/store/labor_rules")
+async def get_store_labor_rules(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """店舗の労務ルール（未設定の項目は既定値）を返す"""
+    current_staff = get_current_staff(request, db)
+    if current_staff.employment_type != "社員":
+        raise HTTPException(status_code=403, detail="権限がありません")
+
+    rules = load_labor_rules(db, current_staff.store_id)
+    return {"status": "ok", "rules": rules.as_dict()}
+
+
+@app.post("/api/store/labor_rules")
+async def update_store_labor_rules(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """店舗の労務ルールを更新する（値をnullにした項目は既定値に戻す）"""
+    current_staff = get_current_staff(request, db)
+    if current_staff.employment_type != "社員":
+        raise HTTPException(status_code=403, detail="権限がありません")
+
+    data = await request.json()
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="労務ルールが不正です")
+    try:
+        rules = save_labor_rules(db, current_staff.store_id, data)
+    except (TypeError, ValueError) as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "ok", "rules": rules.as_dict()}
+
+
+@app.post("/api/shift/generation/cancel")
+async def cancel_shift_generation(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """実行中のシフト生成を中止する"""
+    current_staff = get_current_staff(request, db)
+    if current_staff.employment_type != "社員":
+        raise HTTPException(status_code=403, detail="権限がありません")
+
+    data = await request.json()
+    try:
+        year = int(data.get("year"))
+        month = int(data.get("month"))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="年月が不正です")
+
+    cancelled = cancel_generation(
+        generation_job_key(current_staff.store_id, year, month)
+    )
+    if not cancelled:
+        raise HTTPException(status_code=404, detail="実行中のシフト生成がありません")
+    return {"status": "ok", "cancelled": cancelled}
 
 
 if __name__ == "__main__":
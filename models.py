@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Enum, CheckConstraint, Time, Boolean, Date, DateTime, Index
+from sqlalchemy import Column, Integer, String, ForeignKey, Enum, CheckConstraint, Time, Boolean, Date, DateTime, Index, Text, Float
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import validates
@@ -82,6 +82,8 @@ class Shiftresult(Base):
     day = Column(Integer, nullable=False)
     start_time = Column(Integer, nullable=False) 
     end_time = Column(Integer, nullable=False) 
+    # 手動で編集したシフト（再生成しても上書きしない）
+    pinned = Column(Boolean, nullable=False, default=False, server_default="0")
     
     staff = relationship('Staff', back_populates='shift_results')
     shift_id = Column(Integer, ForeignKey("shifts.id"))
@@ -188,4 +190,108 @@ class StaffRejectionHistory(Base):
     # インデックス
     __table_args__ = (
         Index("ix_staff_rejection_history_staff_date", "staff_id", "date"),
-    )
\ No newline at end of file
+    )
+
+class ShiftSolutionCache(Base):
+    """シフト生成結果のキャッシュ（生成入力のハッシュ単位）"""
+    __tablename__ = "shift_solution_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    input_hash = Column(String(64), unique=True, nullable=False)
+    result = Column(Text, nullable=False)  # [[staff_id, day, start, end], ...] のJSON
+    hit_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+    last_used_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    # インデックス（LRUでの削除用）
+    __table_args__ = (
+        Index("ix_shift_solution_cache_last_used_at", "last_used_at"),
+    )
+
+
+class ShiftExclusion(Base):
+    """手動で「勤務させない」と指定した日（再生成してもシフトを入れない）"""
+    __tablename__ = "shift_exclusions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    staff_id = Column(Integer, ForeignKey("staffs.id"), nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    day = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index(
+            "ix_shift_exclusions_staff_month",
+            "staff_id", "year", "month", "day", unique=True
+        ),
+    )
+
+
+class ShiftAlternative(Base):
+    """1回の生成で得たシフトの代替案（仮シフト画面で選んで採用する）"""
+    __tablename__ = "shift_alternatives"
+
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    rank = Column(Integer, nullable=False)  # 1が最良
+    score = Column(Integer, nullable=False)
+    metrics = Column(Text, nullable=False)  # compute_schedule_metrics のJSON
+    result = Column(Text, nullable=False)  # [[staff_id, day, start, end], ...] のJSON
+    created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index("ix_shift_alternatives_store_month", "store_id", "year", "month"),
+    )
+
+
+class ShiftGenerationJob(Base):
+    """シフト生成ジョブのキュー（ワーカープロセスが取り出して実行する）"""
+    __tablename__ = "shift_generation_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    strategy = Column(String(32), nullable=False, default="greedy")
+    time_limit = Column(Float, nullable=False, default=30.0)
+    warm_start = Column(Boolean, nullable=False, default=False)
+    # queued / running / succeeded / failed / cancelled
+    status = Column(String(16), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    available_at = Column(DateTime, default=datetime.now, nullable=False)  # 再試行はこの時刻以降
+    worker_id = Column(String(255), nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    error = Column(Text, nullable=True)
+    counts = Column(Text, nullable=True)  # save_shift_results の件数のJSON
+    created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index("ix_shift_generation_jobs_status_available", "status", "available_at"),
+        Index("ix_shift_generation_jobs_store_month", "store_id", "year", "month"),
+    )
+
+
+class StoreLaborRule(Base):
+    """店舗ごとの労務ルール（ルール名と値。ない項目は既定値を使う）"""
+    __tablename__ = "store_labor_rules"
+
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
+    # max_consecutive_days / min_shift_hours / max_shift_hours /
+    # minor_end_hour / weekly_max_hours / minor_weekly_max_hours
+    rule = Column(String(64), nullable=False)
+    value = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        Index("ix_store_labor_rules_store_rule", "store_id", "rule", unique=True),
+    )
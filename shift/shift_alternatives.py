@@ -0,0 +1,271 @@
+import contextlib
+import dataclasses
+import io
+import json
+import random
+import time
+from typing import Dict, List, Tuple
+from sqlalchemy.orm import Session
+from models import ShiftAlternative, Shiftresult
+from .shift_metrics import compute_schedule_metrics
+from .shift_portfolio import score_results
+from .shift_snapshot import GenerationSnapshot
+from .shift_supervisor import run_supervised_candidates
+from .shift_validator import validate_shift_requests
+
+
+# 代替案の数に対して何倍の候補を解くか
+OVERSAMPLE = 2
+
+# 1回に求められる代替案の数の上限（候補は MAX_ALTERNATIVES × OVERSAMPLE 個）
+MAX_ALTERNATIVES = 5
+
+# 候補ごとに希望を間引く割合（0番目の候補は間引かない）
+DROP_RATE = 0.1
+
+# 採用する代替案どうしで、最良案の勤務数に対して最低限違うべきセルの割合
+MIN_DISTANCE_RATIO = 0.05
+
+
+def perturb_snapshot(
+    snapshot: GenerationSnapshot,
+    seed: int,
+    drop_rate: float = DROP_RATE
+) -> GenerationSnapshot:
+    """バイトの勤務可能な希望を乱数で間引き、別の解に誘導する
+
+    間引いた希望は勤務不可として扱うため、得られる解は元の希望でも
+    そのまま有効。社員の希望と固定したセルは変えない。
+    """
+    if seed == 0 or drop_rate <= 0:
+        return snapshot
+    rng = random.Random(seed)
+    staff_ids = {s.id for s in snapshot.staffs}
+    pinned = {(p.staff_id, p.day) for p in snapshot.pins}
+    requests = tuple(
+        r for r in snapshot.requests
+        if r.staff_id not in staff_ids
+        or r.status not in ("O", "time")
+        or (r.staff_id, r.day) in pinned
+        or rng.random() >= drop_rate
+    )
+    return dataclasses.replace(snapshot, requests=requests)
+
+
+def schedule_distance(
+    a: List[Tuple[int, int, int, int]],
+    b: List[Tuple[int, int, int, int]]
+) -> int:
+    """2つのシフトで勤務の有無か時間が違う (staff_id, 日) の数"""
+    cells_a = {(r[0], r[1]): (r[2], r[3]) for r in a}
+    cells_b = {(r[0], r[1]): (r[2], r[3]) for r in b}
+    return sum(
+        1 for key in set(cells_a) | set(cells_b)
+        if cells_a.get(key) != cells_b.get(key)
+    )
+
+
+def select_diverse(
+    candidates: List[Dict],
+    k: int,
+    min_distance: int
+) -> List[Dict]:
+    """スコアの良い順に、採用済みの案と min_distance 以上違う案を選ぶ
+
+    足りない場合は、既に選んだ案と重複しない残りの案をスコア順に補う。
+    """
+    ranked = sorted(candidates, key=lambda c: (c["score"], c["seed"]))
+    selected = []
+    for candidate in ranked:
+        if len(selected) >= k:
+            break
+        distances = [
+            schedule_distance(candidate["results"], s["results"])
+            for s in selected
+        ]
+        if all(d >= min_distance for d in distances):
+            candidate["distance"] = min(distances, default=0)
+            selected.append(candidate)
+    for candidate in ranked:
+        if len(selected) >= k:
+            break
+        if candidate in selected:
+            continue
+        distances = [
+            schedule_distance(candidate["results"], s["results"])
+            for s in selected
+        ]
+        if all(d > 0 for d in distances):
+            candidate["distance"] = min(distances, default=0)
+            selected.append(candidate)
+    return sorted(selected, key=lambda c: (c["score"], c["seed"]))
+
+
+def generate_alternatives(
+    snapshot: GenerationSnapshot,
+    k: int = 3,
+    strategy: str = "greedy",
+    time_limit: float = 30.0,
+    max_workers: int = None,
+    drop_rate: float = DROP_RATE,
+    job_key: str = "alternatives"
+) -> List[Dict]:
+    """1回の実行でスコアの良い互いに異なるシフトをk案求める
+
+    希望を乱数で間引いた候補（k × OVERSAMPLE 個）をそれぞれ監視付きの
+    子プロセスで並行に生成し、同じ目的関数で評価してから違いの大きい案を選ぶ。
+
+    Args:
+        snapshot: 生成入力のスナップショット
+        k: 返す案の数（1～MAX_ALTERNATIVES）
+        strategy: 生成方式
+        time_limit: 候補1つあたりの探索時間の上限（秒）
+        max_workers: 並行に生成する候補の数（省略時はCPU数）
+        drop_rate: 候補ごとに希望を間引く割合
+        job_key: 中止に使うキー（候補ごとに "job_key.候補番号" で実行する）
+
+    Returns:
+        alternatives: スコア順の案のリスト
+            {"rank", "seed", "score", "distance", "metrics", "elapsed", "results"}
+    """
+    print(f"\n=== 代替案の生成 ({k}案) ===")
+    if not 1 <= k <= MAX_ALTERNATIVES:
+        raise ValueError(
+            f"案の数は1～{MAX_ALTERNATIVES}の範囲で指定してください"
+        )
+    seeds = list(range(k * OVERSAMPLE))
+    started = time.perf_counter()
+    outcomes = run_supervised_candidates(
+        [
+            (str(seed), perturb_snapshot(snapshot, seed, drop_rate))
+            for seed in seeds
+        ],
+        job_key, strategy=strategy, time_limit=time_limit,
+        max_workers=max_workers
+    )
+    candidates = []
+    for seed, outcome in zip(seeds, outcomes):
+        if "error" in outcome:
+            print(f"  候補の生成に失敗しました: {outcome['error']}")
+            continue
+        candidates.append({
+            "seed": seed,
+            "results": sorted(
+                (r.staff_id, r.day, r.start_time, r.end_time)
+                for r in outcome["results"]
+            ),
+            "elapsed": outcome["elapsed"],
+        })
+    if not candidates:
+        raise ValueError("代替案を生成できませんでした")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        valid_requests = validate_shift_requests(
+            snapshot.requests, snapshot.employees + snapshot.staffs,
+            snapshot.store
+        )
+    for candidate in candidates:
+        candidate["score"] = score_results(candidate["results"], snapshot)
+
+    best = min(candidates, key=lambda c: c["score"])
+    min_distance = max(1, int(len(best["results"]) * MIN_DISTANCE_RATIO))
+    alternatives = select_diverse(candidates, k, min_distance)
+    for rank, alternative in enumerate(alternatives, start=1):
+        alternative["rank"] = rank
+        alternative["metrics"] = compute_schedule_metrics(
+            [
+                Shiftresult(
+                    staff_id=staff_id, year=snapshot.year,
+                    month=snapshot.month, day=day,
+                    start_time=start, end_time=end
+                )
+                for staff_id, day, start, end in alternative["results"]
+            ],
+            snapshot.store, list(snapshot.staffs), valid_requests,
+            snapshot.holidays, snapshot.year, snapshot.month,
+            snapshot.last_day
+        )
+        print(f"  {rank}案: スコア {alternative['score']}, "
+              f"最良案との差 {alternative['distance']}セル "
+              f"(候補 {alternative['seed']})")
+    print(f"候補 {len(candidates)}件から{len(alternatives)}案を選びました "
+          f"({time.perf_counter() - started:.1f}秒)")
+    return alternatives
+
+
+def store_alternatives(
+    db: Session,
+    store_id: int,
+    year: int,
+    month: int,
+    alternatives: List[Dict]
+) -> List[ShiftAlternative]:
+    """店舗・年月の代替案を置き換えて保存する"""
+    db.query(ShiftAlternative).filter(
+        ShiftAlternative.store_id == store_id,
+        ShiftAlternative.year == year,
+        ShiftAlternative.month == month
+    ).delete(synchronize_session=False)
+    rows = [
+        ShiftAlternative(
+            store_id=store_id,
+            year=year,
+            month=month,
+            rank=alternative["rank"],
+            score=alternative["score"],
+            metrics=json.dumps(alternative["metrics"]),
+            result=json.dumps([list(r) for r in alternative["results"]])
+        )
+        for alternative in alternatives
+    ]
+    db.add_all(rows)
+    db.commit()
+    return rows
+
+
+def load_alternatives(
+    db: Session,
+    store_id: int,
+    year: int,
+    month: int
+) -> List[Dict]:
+    """保存済みの代替案を案の順に読み込む（シフト本体は含めない）"""
+    rows = db.query(ShiftAlternative).filter(
+        ShiftAlternative.store_id == store_id,
+        ShiftAlternative.year == year,
+        ShiftAlternative.month == month
+    ).order_by(ShiftAlternative.rank).all()
+    return [
+        {
+            "id": row.id,
+            "rank": row.rank,
+            "score": row.score,
+            "metrics": json.loads(row.metrics),
+            "created_at": row.created_at,
+        }
+        for row in rows
+    ]
+
+
+def load_alternative_results(
+    db: Session,
+    alternative_id: int
+) -> Tuple[ShiftAlternative, List[Shiftresult]]:
+    """代替案を1つ読み込み、シフト結果（DB未保存）に戻す"""
+    row = db.query(ShiftAlternative).filter(
+        ShiftAlternative.id == alternative_id
+    ).first()
+    if row is None:
+        raise ValueError("代替案が見つかりません")
+    results = [
+        Shiftresult(
+            staff_id=staff_id,
+            year=row.year,
+            month=row.month,
+            day=day,
+            start_time=start,
+            end_time=end
+        )
+        for staff_id, day, start, end in json.loads(row.result)
+    ]
+    return row, results
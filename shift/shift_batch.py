@@ -0,0 +1,431 @@
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import replace
+from typing import Dict, List, Optional, Tuple
+from models import Shiftresult, Store
+from .shift_cache import (
+    compute_snapshot_hash,
+    load_cached_results,
+    store_cached_results
+)
+from .shift_generator import (
+    generate_shift_results_with_ortools,
+    save_shift_results
+)
+from .shift_pins import merge_pinned_results
+from .shift_snapshot import GenerationSnapshot, load_snapshot
+
+
+def parse_year_month(value: str) -> Tuple[int, int]:
+    """"YYYY-MM" を (年, 月) にする"""
+    try:
+        year, month = (int(part) for part in value.split("-"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"年月はYYYY-MMで指定してください: {value}")
+    if not 1 <= month <= 12:
+        raise argparse.ArgumentTypeError(f"月が不正です: {value}")
+    return year, month
+
+
+def iter_months(
+    start: Tuple[int, int],
+    end: Tuple[int, int]
+) -> List[Tuple[int, int]]:
+    """開始月から終了月まで（両端を含む）の (年, 月) を列挙する"""
+    if end < start:
+        raise ValueError(f"終了月が開始月より前です: {start} > {end}")
+    months = []
+    year, month = start
+    while (year, month) <= end:
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def generate_draft(
+    snapshot: GenerationSnapshot,
+    strategy: str,
+    time_limit: float
+) -> Dict:
+    """1つの店舗・月のシフトを生成する（DBには触れない）
+
+    プロセスプールから呼ばれるため、引数と戻り値はpickle可能な値のみ。
+    """
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = generate_shift_results_with_ortools(
+            snapshot.store, snapshot.employees, snapshot.staffs,
+            snapshot.requests, snapshot.patterns, snapshot.holidays,
+            snapshot.year, snapshot.month, db=None, strategy=strategy,
+            time_limit=time_limit, pins=snapshot.pins,
+            previous_shifts=snapshot.previous_shifts, rules=snapshot.rules
+        )
+    return {
+        "results": [
+            (r.staff_id, r.day, r.start_time, r.end_time, bool(r.pinned))
+            for r in results
+        ],
+        "solve_seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def run_batch(
+    session_factory,
+    store_ids: List[int],
+    months: List[Tuple[int, int]],
+    strategy: str = "greedy",
+    time_limit: float = 30.0,
+    jobs: int = 1,
+    dry_run: bool = False,
+    warm_start: bool = False
+) -> List[Dict]:
+    """店舗×月のシフト下書きをまとめて生成し、保存する
+
+    入力の読み込みと保存は親プロセスで順に行い、生成だけを
+    jobs 個のプロセスで並行に実行する。同一入力の結果がキャッシュに
+    あれば生成せずに再利用する。失敗した組は記録して次へ進む。
+    warm_start の場合は前月の結果を引き継ぐため、店舗ごとに月を順に
+    生成・保存し、前月の保存後に次の月を読み込む（並行は店舗間だけ）。
+
+    Args:
+        session_factory: DBセッションを作る関数
+        store_ids: 対象の店舗IDリスト
+        months: 対象の (年, 月) リスト
+        strategy: 生成方式
+        time_limit: 1組あたりの探索時間の上限（秒）
+        jobs: 並行に生成する組の数
+        dry_run: Trueの場合は生成だけ行いDBに保存しない
+        warm_start: 前月の確定シフトを解のヒントに使うか
+
+    Returns:
+        runs: 組ごとの結果（件数・所要時間・エラー）
+    """
+    runs = []
+    # 店舗ごとの未着手の組（runs の添字、月の順）
+    queues = {}
+    for store_id in store_ids:
+        queue = queues.setdefault(store_id, [])
+        for year, month in months:
+            queue.append(len(runs))
+            runs.append({
+                "store_id": store_id, "year": year, "month": month,
+                "status": "pending",
+            })
+
+    print(f"生成する組: {len(runs)}件 (並行数 {jobs}"
+          f"{', 店舗ごとに月順' if warm_start else ''})", file=sys.stderr)
+    inputs = {}
+    with ProcessPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {}
+
+        def submit_next(store_id: int, previous_shifts=None) -> None:
+            """店舗の次の組を読み込んで生成に回す
+
+            キャッシュにあった組はその場で保存して次の組へ進む。
+            warm_start でなければ店舗の残りの組をすべて投入する。
+            """
+            while queues[store_id]:
+                i = queues[store_id].pop(0)
+                loaded = load_run(
+                    session_factory, runs[i], strategy, time_limit,
+                    warm_start, previous_shifts, dry_run
+                )
+                if loaded is None:
+                    continue
+                snapshot, input_hash, draft = loaded
+                inputs[i] = (snapshot, input_hash)
+                if draft is not None:
+                    runs[i]["cached"] = True
+                    finish_run(
+                        session_factory, runs[i], snapshot, draft, None,
+                        dry_run
+                    )
+                    previous_shifts = draft_shifts(draft, dry_run)
+                    continue
+                future = executor.submit(
+                    generate_draft, snapshot, strategy, time_limit
+                )
+                futures[future] = i
+                if warm_start:
+                    return
+
+        for store_id in queues:
+            submit_next(store_id)
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures.pop(future)
+                run = runs[i]
+                snapshot, input_hash = inputs[i]
+                try:
+                    draft = future.result()
+                except Exception as e:
+                    draft = None
+                    run.update(status="error", error=str(e))
+                    print(f"  店舗{run['store_id']} {run['year']}年"
+                          f"{run['month']}月: 失敗 ({e})", file=sys.stderr)
+                else:
+                    finish_run(
+                        session_factory, run, snapshot, draft, input_hash,
+                        dry_run
+                    )
+                if warm_start:
+                    submit_next(
+                        run["store_id"],
+                        draft_shifts(draft, dry_run) if draft else None
+                    )
+    return runs
+
+
+def load_run(
+    session_factory,
+    run: Dict,
+    strategy: str,
+    time_limit: float,
+    warm_start: bool,
+    previous_shifts: Optional[Tuple[Tuple[int, int, int, int], ...]],
+    dry_run: bool
+) -> Optional[Tuple[GenerationSnapshot, str, Optional[Dict]]]:
+    """組の入力を読み込み、キャッシュにあればその下書きも返す
+
+    生成はDBを持たない子プロセスで行うため、キャッシュはここで引く。
+
+    Args:
+        previous_shifts: 保存しない前月の下書き（dry_run 用）。
+            指定した場合はDBの前月のシフトの代わりに引き継ぐ
+
+    Returns:
+        (スナップショット, 入力ハッシュ, キャッシュの下書き)。
+        読み込みに失敗した場合は run にエラーを記録してNone
+    """
+    started = time.perf_counter()
+    db = session_factory()
+    try:
+        snapshot = load_snapshot(
+            db, run["store_id"], run["year"], run["month"],
+            warm_start=warm_start
+        )
+        if warm_start and previous_shifts is not None:
+            snapshot = replace(snapshot, previous_shifts=previous_shifts)
+        input_hash = compute_snapshot_hash(snapshot, strategy, time_limit)
+        results = load_cached_results(
+            db, input_hash, snapshot.year, snapshot.month
+        )
+        draft = None
+        if results is not None:
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = merge_pinned_results(results, snapshot.pins)
+            draft = {
+                "results": [
+                    (r.staff_id, r.day, r.start_time, r.end_time,
+                     bool(r.pinned))
+                    for r in results
+                ],
+                "solve_seconds": 0.0,
+            }
+            if not dry_run:
+                db.commit()
+    except Exception as e:
+        run.update(status="error", error=str(e))
+        return None
+    finally:
+        db.close()
+    run["load_seconds"] = round(time.perf_counter() - started, 3)
+    return snapshot, input_hash, draft
+
+
+def draft_shifts(
+    draft: Dict,
+    dry_run: bool
+) -> Optional[Tuple[Tuple[int, int, int, int], ...]]:
+    """dry_run で次の月に引き継ぐ下書きのシフトを返す
+
+    保存する場合は次の月がDBから読み込むためNone。
+    """
+    if not dry_run:
+        return None
+    return tuple(
+        (staff_id, day, start, end)
+        for staff_id, day, start, end, _ in draft["results"]
+    )
+
+
+def finish_run(
+    session_factory,
+    run: Dict,
+    snapshot: GenerationSnapshot,
+    draft: Dict,
+    input_hash: Optional[str],
+    dry_run: bool
+) -> None:
+    """生成した下書きを保存し、組の結果を記録する
+
+    input_hash を指定した場合は、結果をキャッシュにも同じ
+    トランザクションで保存する（キャッシュから取得した組ではNone）。
+    """
+    run["shifts"] = len(draft["results"])
+    run["solve_seconds"] = draft["solve_seconds"]
+    if dry_run:
+        run["status"] = "dry_run"
+    else:
+        started = time.perf_counter()
+        db = session_factory()
+        try:
+            results = [
+                Shiftresult(
+                    staff_id=staff_id,
+                    year=snapshot.year,
+                    month=snapshot.month,
+                    day=day,
+                    start_time=start,
+                    end_time=end,
+                    pinned=pinned
+                )
+                for staff_id, day, start, end, pinned in draft["results"]
+            ]
+            with contextlib.redirect_stdout(io.StringIO()):
+                if input_hash:
+                    store_cached_results(
+                        db, snapshot.store.id, input_hash, snapshot.year,
+                        snapshot.month, results
+                    )
+                run["counts"] = save_shift_results(
+                    db, results, snapshot.year, snapshot.month,
+                    [s.id for s in snapshot.employees + snapshot.staffs]
+                )
+            run["status"] = "saved"
+        except Exception as e:
+            db.rollback()
+            run.update(status="error", error=str(e))
+        finally:
+            db.close()
+        run["save_seconds"] = round(time.perf_counter() - started, 3)
+    print(f"  店舗{run['store_id']} {run['year']}年{run['month']}月: "
+          f"{run['status']} ({run['shifts']}件, "
+          f"{run['solve_seconds']}秒)", file=sys.stderr)
+
+
+def format_runs(runs: List[Dict]) -> str:
+    """組ごとの結果を表形式の文字列にする"""
+    header = ["店舗", "年月", "状態", "件数", "読込(秒)", "生成(秒)", "保存(秒)"]
+    lines = ["\t".join(header)]
+    for run in runs:
+        row = [
+            str(run["store_id"]),
+            f"{run['year']}-{run['month']:02d}",
+            run["status"],
+            str(run.get("shifts", "-")),
+            str(run.get("load_seconds", "-")),
+            str(run.get("solve_seconds", "-")),
+            str(run.get("save_seconds", "-")),
+        ]
+        if "error" in run:
+            row.append(run["error"])
+        lines.append("\t".join(row))
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m shift",
+        description="店舗・月を指定してシフトの下書きをまとめて生成する"
+    )
+    stores = parser.add_mutually_exclusive_group(required=True)
+    stores.add_argument("--store-ids", type=int, nargs="+")
+    stores.add_argument(
+        "--all-stores", action="store_true", help="全店舗を対象にする"
+    )
+    parser.add_argument(
+        "--start", type=parse_year_month, required=True,
+        help="開始月（YYYY-MM）"
+    )
+    parser.add_argument(
+        "--end", type=parse_year_month, default=None,
+        help="終了月（YYYY-MM、省略時は開始月のみ）"
+    )
+    parser.add_argument("--strategy", default="greedy")
+    parser.add_argument("--time-limit", type=float, default=30.0)
+    parser.add_argument(
+        "--jobs", type=int, default=1, help="並行に生成する組の数"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="生成だけ行いDBに保存しない"
+    )
+    parser.add_argument(
+        "--warm-start", action="store_true",
+        help="前月の確定シフトを解のヒントに使う"
+    )
+    parser.add_argument(
+        "--enqueue", action="store_true",
+        help="ここでは生成せず、ワーカー用のジョブとしてキューに積む"
+    )
+    parser.add_argument("--json", action="store_true", help="JSONで出力する")
+    args = parser.parse_args(argv)
+
+    from database import SessionLocal
+
+    try:
+        months = iter_months(args.start, args.end or args.start)
+    except ValueError as e:
+        parser.error(str(e))
+
+    store_ids = args.store_ids
+    if args.all_stores:
+        db = SessionLocal()
+        try:
+            store_ids = [s.id for s in db.query(Store).order_by(Store.id)]
+        finally:
+            db.close()
+
+    if args.enqueue:
+        from .shift_jobs import enqueue_generation_job
+        db = SessionLocal()
+        try:
+            jobs = [
+                enqueue_generation_job(
+                    db, store_id, year, month, strategy=args.strategy,
+                    time_limit=args.time_limit, warm_start=args.warm_start
+                )
+                for store_id in store_ids
+                for year, month in months
+            ]
+            queued = [
+                {
+                    "job_id": job.id, "store_id": job.store_id,
+                    "year": job.year, "month": job.month,
+                    "status": job.status,
+                }
+                for job in jobs
+            ]
+        finally:
+            db.close()
+        if args.json:
+            print(json.dumps({"jobs": queued}, ensure_ascii=False, indent=2))
+        else:
+            for job in queued:
+                print(f"ジョブ{job['job_id']}: 店舗{job['store_id']} "
+                      f"{job['year']}-{job['month']:02d} {job['status']}")
+        return 0
+
+    started = time.perf_counter()
+    runs = run_batch(
+        SessionLocal, store_ids, months, strategy=args.strategy,
+        time_limit=args.time_limit, jobs=args.jobs, dry_run=args.dry_run,
+        warm_start=args.warm_start
+    )
+    elapsed = round(time.perf_counter() - started, 3)
+    failed = sum(1 for run in runs if run["status"] == "error")
+    if args.json:
+        print(json.dumps(
+            {"runs": runs, "elapsed": elapsed, "failed": failed},
+            ensure_ascii=False, indent=2
+        ))
+    else:
+        print(format_runs(runs))
+        print(f"合計 {elapsed}秒 (失敗 {failed}件)")
+    return 1 if failed else 0
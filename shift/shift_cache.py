@@ -0,0 +1,209 @@
+import contextlib
+import hashlib
+import io
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from models import (
+    Staff, Store, ShiftRequest, ShiftPattern,
+    Shiftresult, ShiftSolutionCache
+)
+from .shift_pins import apply_pins_to_requests
+from .shift_snapshot import GenerationSnapshot
+from .shift_validator import validate_shift_patterns, validate_shift_requests
+
+
+# 生成ロジックを変更した場合はこの値を上げて既存のキャッシュを無効にする
+CACHE_VERSION = 1
+
+# キャッシュに保持する最大件数（超えた分は最終利用日時の古い順に削除）
+MAX_CACHE_ENTRIES = 200
+
+
+def compute_input_hash(
+    store: Store,
+    staffs: List[Staff],
+    valid_requests: Dict[Tuple[int, int], ShiftRequest],
+    valid_patterns: List[ShiftPattern],
+    holidays: Set[datetime.date],
+    year: int,
+    month: int,
+    strategy: str,
+    parameters: Dict
+) -> str:
+    """シフト生成の全入力からハッシュ値を計算する
+
+    入力を正規化（ソート済みのリスト）したJSONのSHA-256を取るため、
+    設定や希望が1つでも変われば別のハッシュになる。
+
+    Args:
+        store: 店舗情報
+        staffs: 社員とバイトを合わせたスタッフリスト
+        valid_requests: 検証済みのシフト希望
+        valid_patterns: 検証済みのシフトパターン
+        holidays: 祝日セット
+        year: 年
+        month: 月
+        strategy: 生成方式
+        parameters: 生成方式のパラメータ
+
+    Returns:
+        input_hash: 16進数のハッシュ文字列
+    """
+    payload = {
+        "version": CACHE_VERSION,
+        "store": [store.id, store.open_hours, store.close_hours],
+        "year": year,
+        "month": month,
+        "staffs": sorted(
+            [s.id, s.employment_type, s.kitchen_a, s.kitchen_b,
+             s.hall, s.leadership]
+            for s in staffs
+        ),
+        "requests": sorted(
+            [staff_id, day, req.status, req.start_time, req.end_time]
+            for (staff_id, day), req in valid_requests.items()
+        ),
+        "skill_requirements": sorted(
+            [r.day_type, r.peak_start_hour, r.peak_end_hour,
+             r.kitchen_a, r.kitchen_b, r.hall, r.leadership,
+             r.peak_people, r.open_people, r.close_people]
+            for r in store.default_skill_requirements
+        ),
+        "patterns": sorted(
+            [p.id, p.start_time, p.end_time, bool(p.is_fulltime)]
+            for p in valid_patterns
+        ),
+        "holidays": sorted(d.isoformat() for d in holidays),
+        "strategy": strategy,
+        "parameters": parameters,
+    }
+    encoded = json.dumps(
+        payload, ensure_ascii=False, sort_keys=True, default=str
+    ).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def snapshot_parameters(snapshot: GenerationSnapshot, time_limit: float) -> Dict:
+    """ハッシュに含める生成方式以外のパラメータを作る"""
+    return {
+        "time_limit": time_limit,
+        "previous_shifts": sorted(snapshot.previous_shifts),
+        "labor_rules": snapshot.rules.as_dict(),
+        "pins": sorted(
+            (pin.staff_id, pin.day, pin.start_time or -1, pin.end_time or -1)
+            for pin in snapshot.pins
+        ),
+    }
+
+
+def compute_snapshot_hash(
+    snapshot: GenerationSnapshot,
+    strategy: str,
+    time_limit: float
+) -> str:
+    """スナップショットから生成時と同じ入力ハッシュを計算する
+
+    生成を子プロセスで行う呼び出し側が、親プロセスでキャッシュを
+    引くために使う。固定したセルの適用と検証は生成時と同じ手順で行う。
+    """
+    staffs = list(snapshot.employees) + list(snapshot.staffs)
+    requests = apply_pins_to_requests(
+        snapshot.requests, snapshot.pins, snapshot.year, snapshot.month
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        valid_requests = validate_shift_requests(
+            requests, staffs, snapshot.store
+        )
+        valid_patterns = [
+            p for p in validate_shift_patterns(snapshot.patterns, snapshot.store)
+            if snapshot.rules.allows_pattern(p)
+        ]
+    return compute_input_hash(
+        snapshot.store, staffs, valid_requests, valid_patterns,
+        snapshot.holidays, snapshot.year, snapshot.month, strategy,
+        snapshot_parameters(snapshot, time_limit)
+    )
+
+
+def load_cached_results(
+    db: Session,
+    input_hash: str,
+    year: int,
+    month: int
+) -> Optional[List[Shiftresult]]:
+    """キャッシュから生成結果を取得する
+
+    Returns:
+        results: キャッシュされたシフト結果（未登録の場合はNone）
+    """
+    entry = db.query(ShiftSolutionCache).filter(
+        ShiftSolutionCache.input_hash == input_hash
+    ).first()
+    if entry is None:
+        return None
+
+    entry.hit_count += 1
+    entry.last_used_at = datetime.now()
+    return [
+        Shiftresult(
+            staff_id=staff_id,
+            year=year,
+            month=month,
+            day=day,
+            start_time=start_time,
+            end_time=end_time
+        )
+        for staff_id, day, start_time, end_time in json.loads(entry.result)
+    ]
+
+
+def store_cached_results(
+    db: Session,
+    store_id: int,
+    input_hash: str,
+    year: int,
+    month: int,
+    results: List[Shiftresult],
+    max_entries: int = MAX_CACHE_ENTRIES
+) -> None:
+    """生成結果をキャッシュに保存し、上限を超えた古いエントリを削除する
+
+    コミットは呼び出し側のトランザクションに任せる。
+    """
+    payload = json.dumps([
+        [r.staff_id, r.day, r.start_time, r.end_time] for r in results
+    ])
+    now = datetime.now()
+    entry = db.query(ShiftSolutionCache).filter(
+        ShiftSolutionCache.input_hash == input_hash
+    ).first()
+    if entry:
+        entry.result = payload
+        entry.last_used_at = now
+    else:
+        db.add(ShiftSolutionCache(
+            store_id=store_id,
+            year=year,
+            month=month,
+            input_hash=input_hash,
+            result=payload,
+            hit_count=0,
+            created_at=now,
+            last_used_at=now
+        ))
+    db.flush()
+
+    # LRU: 最終利用日時の新しい順に max_entries 件を残す
+    stale_ids = [
+        row.id for row in db.query(ShiftSolutionCache.id).order_by(
+            ShiftSolutionCache.last_used_at.desc(),
+            ShiftSolutionCache.id.desc()
+        ).offset(max_entries).all()
+    ]
+    if stale_ids:
+        db.query(ShiftSolutionCache).filter(
+            ShiftSolutionCache.id.in_(stale_ids)
+        ).delete(synchronize_session=False)
+        print(f"古いキャッシュを削除しました: {len(stale_ids)}件")
@@ -0,0 +1,539 @@
+import contextvars
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Tuple
+from models import Staff, Store, ShiftPattern, ShiftRequest
+from .shift_optimizer import solve_shift_patterns, can_work_pattern
+from .shift_rules import (
+    DEFAULT_LABOR_RULES, LaborRules, WEEK_DAYS, exceeds_weekly_cap
+)
+
+
+def split_into_weeks(
+    year: int,
+    month: int,
+    last_day: int
+) -> List[Tuple[int, int]]:
+    """月を月曜始まりの週に分割する
+
+    Args:
+        year: 年
+        month: 月
+        last_day: 月末日
+
+    Returns:
+        weeks: [(開始日, 終了日)]のリスト
+    """
+    weeks = []
+    start = 1
+    for day in range(1, last_day + 1):
+        is_sunday = datetime(year, month, day).weekday() == 6
+        if is_sunday or day == last_day:
+            weeks.append((start, day))
+            start = day + 1
+    return weeks
+
+
+def count_consecutive_days(
+    work_days: set,
+    day: int,
+    step: int
+) -> int:
+    """指定日から前後方向に連続する勤務日数を数える
+
+    Args:
+        work_days: 勤務日集合
+        day: 起点日（この日自体は含まない）
+        step: -1なら前方向、1なら後方向
+    """
+    count = 0
+    d = day + step
+    while d in work_days:
+        count += 1
+        d += step
+    return count
+
+
+def count_days_before(
+    work_days: set,
+    day: int,
+    carry_in: int = 0
+) -> int:
+    """指定日の前日から遡る連続勤務日数を数える
+
+    連勤が月初まで続いている場合は前月末日までの連勤（carry_in）も足す。
+    """
+    count = count_consecutive_days(work_days, day, -1)
+    if count == day - 1:
+        count += carry_in
+    return count
+
+
+def run_length(
+    work_days: set,
+    day: int,
+    carry_in: int = 0
+) -> int:
+    """day を勤務日に加えた場合の連勤日数（月初まで続けば carry_in も足す）"""
+    return (count_days_before(work_days, day, carry_in) + 1 +
+            count_consecutive_days(work_days, day, 1))
+
+
+def split_target_days(
+    target_days: Dict[int, int],
+    requests: Dict[Tuple[int, int], ShiftRequest],
+    weeks: List[Tuple[int, int]]
+) -> List[Dict[int, int]]:
+    """月間の採用目標日数を週ごとの希望日数に比例して配分する
+
+    Returns:
+        week_targets: 週ごとの {staff_id: 採用目標日数}
+    """
+    week_targets = [dict() for _ in weeks]
+    for staff_id, target in target_days.items():
+        counts = []
+        for start, end in weeks:
+            count = 0
+            for day in range(start, end + 1):
+                req = requests.get((staff_id, day))
+                if req and req.status not in ("X", "", None):
+                    count += 1
+            counts.append(count)
+        total = sum(counts)
+        if total == 0:
+            continue
+        # 最大剰余法で端数を配分する
+        raw = [target * c / total for c in counts]
+        shares = [int(r) for r in raw]
+        remainder = target - sum(shares)
+        order = sorted(
+            range(len(weeks)), key=lambda i: raw[i] - shares[i],
+            reverse=True
+        )
+        for i in order[:remainder]:
+            shares[i] += 1
+        for i, share in enumerate(shares):
+            week_targets[i][staff_id] = min(share, counts[i])
+    return week_targets
+
+
+def solve_month_by_weeks(
+    store: Store,
+    staffs: List[Staff],
+    patterns: List[ShiftPattern],
+    requests: Dict[Tuple[int, int], ShiftRequest],
+    required_staff: Dict[Tuple[int, int], int],
+    year: int,
+    month: int,
+    last_day: int,
+    target_days: Dict[int, int] = None,
+    time_limit: float = 30.0,
+    max_workers: int = None,
+    carry_in: Dict[int, int] = None,
+    rules: LaborRules = DEFAULT_LABOR_RULES,
+    fixed: Dict[Tuple[int, int], Tuple[int, int]] = None
+) -> Dict[Tuple[int, int], ShiftPattern]:
+    """月を週単位の部分問題に分割して並列に解き、週境界を修復する
+
+    週の勤務時間の上限は各週の部分問題の中で課し、週をまたぐ連続7日間の
+    超過は最後に入れ替えか勤務の取り消しで修復する。
+
+    Args:
+        store: 店舗情報
+        staffs: バイトスタッフリスト
+        patterns: シフトパターンリスト
+        requests: (staff_id, day) → ShiftRequest
+        required_staff: (day, hour) → 必要なバイトの人数
+        year: 年
+        month: 月
+        last_day: 月末日
+        target_days: staff_id → 月間の採用目標日数
+        time_limit: 全体の探索時間の上限（秒）
+        max_workers: 並列に解く週の数（省略時はCPUコア数）
+        carry_in: staff_id → 前月末日までの連続勤務日数（第1週に与える）
+        rules: 労務ルール
+        fixed: (staff_id, day) → (開始時間, 終了時間) 固定したシフト。
+            requests と required_staff からは除いておき、どの修復でも
+            動かさない勤務として数える
+
+    Returns:
+        assignments: (staff_id, day) → ShiftPattern（固定したシフトは含まない）
+    """
+    print("\n=== 週単位分割による最適化 ===")
+    fixed = fixed or {}
+    weeks = split_into_weeks(year, month, last_day)
+    week_targets = split_target_days(target_days or {}, requests, weeks)
+    cpu_count = os.cpu_count() or 1
+    if max_workers is None:
+        max_workers = min(len(weeks), cpu_count)
+    # CP-SATはSolve中にGILを解放するためスレッドで並列化できる
+    solver_workers = max(1, cpu_count // max_workers)
+    # 週の求解と境界修復で時間予算を分け合う
+    week_time_limit = time_limit * 0.7
+    repair_time_limit = time_limit * 0.3 / max(1, len(weeks) - 1)
+    print(f"週の数: {len(weeks)}, 並列数: {max_workers}, "
+          f"ソルバースレッド数: {solver_workers}")
+
+    assignments = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            # 進捗の通知先と打ち切りの要求を各スレッドに引き継ぐ
+            executor.submit(
+                contextvars.copy_context().run, solve_shift_patterns,
+                store, staffs, patterns, requests, required_staff,
+                end, first_day=start, target_days=week_targets[i],
+                carry_in=carry_in if start == 1 else None,
+                time_limit=week_time_limit, num_workers=solver_workers,
+                rules=rules, fixed=fixed
+            )
+            for i, (start, end) in enumerate(weeks)
+        ]
+        for (start, end), future in zip(weeks, futures):
+            week_assignments = future.result()
+            if week_assignments is None:
+                raise ValueError(f"{start}日～{end}日のシフトを求解できません")
+            assignments.update(week_assignments)
+
+    assignments = repair_week_boundaries(
+        store, staffs, patterns, requests, required_staff, weeks,
+        assignments, time_limit=repair_time_limit,
+        num_workers=cpu_count, rules=rules, fixed=fixed, carry_in=carry_in
+    )
+    assignments = repair_weekly_caps(
+        store, staffs, requests, last_day, assignments, rules, fixed=fixed,
+        carry_in=carry_in
+    )
+    if target_days:
+        assignments = rebalance_monthly_fairness(
+            store, staffs, requests, target_days, last_day, assignments,
+            rules=rules, fixed=fixed, carry_in=carry_in
+        )
+    return assignments
+
+
+def repair_week_boundaries(
+    store: Store,
+    staffs: List[Staff],
+    patterns: List[ShiftPattern],
+    requests: Dict[Tuple[int, int], ShiftRequest],
+    required_staff: Dict[Tuple[int, int], int],
+    weeks: List[Tuple[int, int]],
+    assignments: Dict[Tuple[int, int], ShiftPattern],
+    time_limit: float = 10.0,
+    num_workers: int = 8,
+    rules: LaborRules = DEFAULT_LABOR_RULES,
+    fixed: Dict[Tuple[int, int], Tuple[int, int]] = None,
+    carry_in: Dict[int, int] = None
+) -> Dict[Tuple[int, int], ShiftPattern]:
+    """週境界をまたぐ連勤違反を、境界周辺の再最適化で修復する
+
+    境界の前後の連勤上限日数を窓として、窓外の勤務を
+    連勤の境界条件に固定したうえで窓内だけを解き直す。
+    固定したシフト（fixed）は窓内でも確定済みの勤務として数える。
+    月初まで続く連勤には前月末日までの連勤（carry_in）を足す。
+
+    Returns:
+        assignments: 修復後の (staff_id, day) → ShiftPattern
+    """
+    print("\n=== 週境界の修復 ===")
+    assignments = dict(assignments)
+    month_last_day = weeks[-1][1]
+    max_days = rules.max_consecutive_days
+    fixed = fixed or {}
+    month_carry_in = carry_in or {}
+
+    for start, _ in weeks[1:]:
+        work_days = defaultdict(set)
+        for staff_id, day in list(assignments) + list(fixed):
+            work_days[staff_id].add(day)
+
+        # 境界をまたいで上限を超える連勤があるスタッフを探す
+        violators = [
+            s.id for s in staffs
+            if (count_days_before(
+                    work_days[s.id], start, month_carry_in.get(s.id, 0)
+                ) + count_consecutive_days(work_days[s.id], start - 1, 1)
+                > max_days)
+        ]
+        if not violators:
+            continue
+        print(f"{start}日の境界で連勤違反: スタッフID {violators}")
+
+        window_start = max(1, start - max_days)
+        window_end = min(month_last_day, start + max_days - 1)
+        window_carry_in = {
+            s.id: count_days_before(
+                work_days[s.id], window_start, month_carry_in.get(s.id, 0)
+            )
+            for s in staffs
+        }
+        carry_out = {
+            s.id: count_consecutive_days(work_days[s.id], window_end, 1)
+            for s in staffs
+        }
+        # 窓内の採用日数は現状を目標とし、公平性を崩さない
+        window_targets = {
+            s.id: sum(
+                1 for d in range(window_start, window_end + 1)
+                if (s.id, d) in assignments
+            )
+            for s in staffs
+        }
+        repaired = solve_shift_patterns(
+            store, staffs, patterns, requests, required_staff,
+            window_end, first_day=window_start,
+            target_days=window_targets, carry_in=window_carry_in,
+            carry_out=carry_out, time_limit=time_limit,
+            num_workers=num_workers, rules=rules, fixed=fixed
+        )
+        if repaired is None:
+            print(f"{start}日の境界の再最適化に失敗しました。勤務を取り消して修復します")
+            assignments = drop_boundary_days(
+                staffs, required_staff, assignments, start, violators,
+                max_days, fixed=fixed, carry_in=month_carry_in
+            )
+            continue
+        assignments = {
+            key: p for key, p in assignments.items()
+            if not window_start <= key[1] <= window_end
+        }
+        assignments.update(repaired)
+
+    return assignments
+
+
+def drop_boundary_days(
+    staffs: List[Staff],
+    required_staff: Dict[Tuple[int, int], int],
+    assignments: Dict[Tuple[int, int], ShiftPattern],
+    boundary: int,
+    violators: List[int],
+    max_consecutive_days: int,
+    fixed: Dict[Tuple[int, int], Tuple[int, int]] = None,
+    carry_in: Dict[int, int] = None
+) -> Dict[Tuple[int, int], ShiftPattern]:
+    """境界をまたぐ連勤を、勤務を取り消して上限以内に収める
+
+    境界の再最適化が解を返さなかった場合の修復。連勤の中の勤務のうち、
+    取り消しても人数不足が増える時間の最も少ない日（同じなら連勤の
+    中央に近い日）から順に取り消す。固定したシフトは取り消さない。
+
+    Returns:
+        assignments: 修復後の (staff_id, day) → ShiftPattern
+    """
+    assignments = dict(assignments)
+    fixed = fixed or {}
+    carry_in = carry_in or {}
+    staffed = defaultdict(int)
+    for key, p in assignments.items():
+        for hour in range(p.start_time, p.end_time):
+            staffed[(key[1], hour)] += 1
+    for (_, day), (start_time, end_time) in fixed.items():
+        for hour in range(start_time, end_time):
+            staffed[(day, hour)] += 1
+
+    def shortage_increase(day: int, p: ShiftPattern) -> int:
+        return sum(
+            1 for hour in range(p.start_time, p.end_time)
+            if staffed[(day, hour)] <= required_staff.get((day, hour), 0)
+        )
+
+    drops = 0
+    for staff_id in violators:
+        work_days = {
+            day for s_id, day in list(assignments) + list(fixed)
+            if s_id == staff_id
+        }
+        while boundary - 1 in work_days:
+            run = run_length(
+                work_days - {boundary - 1}, boundary - 1,
+                carry_in.get(staff_id, 0)
+            )
+            if run <= max_consecutive_days:
+                break
+            first = boundary - 1 - count_consecutive_days(
+                work_days, boundary - 1, -1
+            )
+            last = boundary - 1 + count_consecutive_days(
+                work_days, boundary - 1, 1
+            )
+            middle = (first + last) / 2
+            movable = [
+                day for day in range(max(1, first), last + 1)
+                if (staff_id, day) in assignments
+            ]
+            if not movable:
+                print(f"スタッフID {staff_id}: 固定したシフトだけで"
+                      f"連勤上限を超えています")
+                break
+            day = min(movable, key=lambda d: (
+                shortage_increase(d, assignments[(staff_id, d)]),
+                abs(d - middle), d
+            ))
+            p = assignments.pop((staff_id, day))
+            for hour in range(p.start_time, p.end_time):
+                staffed[(day, hour)] -= 1
+            work_days.discard(day)
+            drops += 1
+    print(f"{boundary}日の境界: 勤務を{drops}件取り消しました")
+    return assignments
+
+
+def rebalance_monthly_fairness(
+    store: Store,
+    staffs: List[Staff],
+    requests: Dict[Tuple[int, int], ShiftRequest],
+    target_days: Dict[int, int],
+    last_day: int,
+    assignments: Dict[Tuple[int, int], ShiftPattern],
+    rules: LaborRules = DEFAULT_LABOR_RULES,
+    fixed: Dict[Tuple[int, int], Tuple[int, int]] = None,
+    carry_in: Dict[int, int] = None
+) -> Dict[Tuple[int, int], ShiftPattern]:
+    """月間の採用日数が目標から外れたスタッフ間で勤務日を入れ替える
+
+    目標を超えたスタッフの勤務を、同じ日に同じパターンで勤務可能かつ
+    目標に満たないスタッフへ移す。人数は変わらないため充足率は維持される。
+    移す先の連勤・終業時刻・週の勤務時間の上限は守る。固定したシフトは
+    移さず、連勤と週の勤務時間にだけ数える。
+
+    Returns:
+        assignments: 調整後の (staff_id, day) → ShiftPattern
+    """
+    print("\n=== 月間公平性の調整 ===")
+    assignments = dict(assignments)
+    work_days = defaultdict(set)
+    work_hours = defaultdict(dict)
+    for (staff_id, day), pattern in assignments.items():
+        work_days[staff_id].add(day)
+        work_hours[staff_id][day] = pattern.end_time - pattern.start_time
+    pinned_days = defaultdict(set)
+    for (staff_id, day), (start, end) in (fixed or {}).items():
+        pinned_days[staff_id].add(day)
+        work_hours[staff_id][day] = end - start
+
+    def surplus(staff_id):
+        return len(work_days[staff_id]) - target_days.get(staff_id, 0)
+
+    swaps = 0
+    for day in range(1, last_day + 1):
+        for giver in staffs:
+            pattern = assignments.get((giver.id, day))
+            if pattern is None or surplus(giver.id) <= 0:
+                continue
+            for taker in staffs:
+                taker_days = work_days[taker.id] | pinned_days[taker.id]
+                if (taker.id == giver.id or surplus(taker.id) >= 0 or
+                        day in taker_days):
+                    continue
+                req = requests.get((taker.id, day))
+                if not can_work_pattern(
+                    req, pattern, store, rules.end_hour_limit(taker)
+                ):
+                    continue
+                run = (count_days_before(
+                           taker_days, day, (carry_in or {}).get(taker.id, 0)
+                       ) + count_consecutive_days(taker_days, day, 1) + 1)
+                if run > rules.max_consecutive_days:
+                    continue
+                hours = pattern.end_time - pattern.start_time
+                if exceeds_weekly_cap(
+                    work_hours[taker.id], day, hours, rules.weekly_cap(taker)
+                ):
+                    continue
+
+                del assignments[(giver.id, day)]
+                work_days[giver.id].discard(day)
+                work_hours[giver.id].pop(day, None)
+                assignments[(taker.id, day)] = pattern
+                work_days[taker.id].add(day)
+                work_hours[taker.id][day] = hours
+                swaps += 1
+                break
+
+    print(f"入れ替え件数: {swaps}件")
+    return assignments
+
+
+def repair_weekly_caps(
+    store: Store,
+    staffs: List[Staff],
+    requests: Dict[Tuple[int, int], ShiftRequest],
+    last_day: int,
+    assignments: Dict[Tuple[int, int], ShiftPattern],
+    rules: LaborRules = DEFAULT_LABOR_RULES,
+    fixed: Dict[Tuple[int, int], Tuple[int, int]] = None,
+    carry_in: Dict[int, int] = None
+) -> Dict[Tuple[int, int], ShiftPattern]:
+    """週をまたぐ連続7日間の勤務時間の上限超過を修復する
+
+    超過した窓の中で最も長い勤務を、同じ日に同じパターンで勤務可能な
+    スタッフ（連勤・週の上限に収まる）へ移し、いなければ取り消す。
+    固定したシフトは移さず、勤務時間にだけ数える。
+
+    Returns:
+        assignments: 修復後の (staff_id, day) → ShiftPattern
+    """
+    caps = {s.id: rules.weekly_cap(s) for s in staffs}
+    if all(cap is None for cap in caps.values()):
+        return assignments
+    assignments = dict(assignments)
+    work_days = defaultdict(set)
+    work_hours = defaultdict(dict)
+    for (staff_id, day), pattern in assignments.items():
+        work_days[staff_id].add(day)
+        work_hours[staff_id][day] = pattern.end_time - pattern.start_time
+    fixed = fixed or {}
+    for (staff_id, day), (start, end) in fixed.items():
+        work_days[staff_id].add(day)
+        work_hours[staff_id][day] = end - start
+
+    swaps = 0
+    drops = 0
+    for s in staffs:
+        if caps[s.id] is None:
+            continue
+        for start in range(1, last_day - WEEK_DAYS + 2):
+            window = range(start, start + WEEK_DAYS)
+            while sum(work_hours[s.id].get(d, 0) for d in window) > caps[s.id]:
+                movable = [
+                    d for d in window if (s.id, d) in assignments
+                ]
+                if not movable:
+                    break
+                day = max(
+                    movable, key=lambda d: (work_hours[s.id][d], d)
+                )
+                pattern = assignments.pop((s.id, day))
+                work_days[s.id].discard(day)
+                hours = work_hours[s.id].pop(day)
+                for taker in staffs:
+                    if taker.id == s.id or day in work_days[taker.id]:
+                        continue
+                    if not can_work_pattern(
+                        requests.get((taker.id, day)), pattern, store,
+                        rules.end_hour_limit(taker)
+                    ):
+                        continue
+                    run = (count_days_before(
+                               work_days[taker.id], day,
+                               (carry_in or {}).get(taker.id, 0)
+                           ) + count_consecutive_days(work_days[taker.id], day, 1)
+                           + 1)
+                    if run > rules.max_consecutive_days or exceeds_weekly_cap(
+                        work_hours[taker.id], day, hours, caps[taker.id]
+                    ):
+                        continue
+                    assignments[(taker.id, day)] = pattern
+                    work_days[taker.id].add(day)
+                    work_hours[taker.id][day] = hours
+                    swaps += 1
+                    break
+                else:
+                    drops += 1
+
+    if swaps or drops:
+        print(f"週の勤務時間の修復: 入れ替え {swaps}件, 取り消し {drops}件")
+    return assignments
@@ -1,22 +1,110 @@
-from datetime import datetime, timedelta
-from ortools.sat.python import cp_model
+import time
+from datetime import datetime
+from ortools.graph.python import min_cost_flow
 from .shift_validator import (
     validate_shift_requests,
     validate_shift_patterns,
-    validate_staffing_requirements
+    validate_staffing_requirements,
+    validate_schedule,
+    check_staffing_capacity
 )
-from .shift_optimizer import optimize_required_staff
+from .shift_optimizer import (
+    optimize_required_staff as calculate_hourly_required_staff,
+    get_request_window,
+    solve_shift_intervals
+)
+from .shift_decomposition import run_length, solve_month_by_weeks
 from .shift_creator import get_day_type
+from .shift_snapshot import build_snapshot, load_pins
+from .shift_pins import (
+    apply_pins_to_requests,
+    count_pinned_staff,
+    merge_pinned_results,
+    pinned_shifts,
+    subtract_pinned_coverage
+)
+from .shift_warmstart import build_warm_start
+from .shift_progress import report_phase
+from .shift_presolve import presolve_trivial_days, count_peak_employees
+from .shift_lns import improve_with_lns
+from .shift_trimming import trim_staff_shifts
+from .shift_template import solve_shift_patterns_from_template
+from .shift_rules import (
+    DEFAULT_LABOR_RULES,
+    WEEK_DAYS,
+    exceeds_weekly_cap,
+    load_labor_rules
+)
+from .shift_cache import (
+    compute_input_hash,
+    load_cached_results,
+    snapshot_parameters,
+    store_cached_results
+)
 from models import Shiftresult, Shift
 from collections import defaultdict
 import math  # mathモジュールをインポート
 
+# 最小費用流による採用選択の費用（公平性をピークのカバー率より優先する）
+FAIRNESS_STEP_COST = 20
+PEAK_COVERAGE_COST = 10
+
 
 def generate_shift_results_with_ortools(
     store, employees, staffs, requests, patterns,
-    holidays, year, month, db=None
+    holidays, year, month, db=None, strategy="greedy", time_limit=30.0,
+    use_cache=True, capacity_check="warn", pins=None, previous_shifts=(),
+    rules=None
 ):
-    """OR-Toolsを使用してシフトを生成する"""
+    """OR-Toolsを使用してシフトを生成する
+    
+    Args:
+        strategy: バイトの割り当て方式
+            "greedy": 日ごとの優先順位による採用と時間調整
+            "cpsat": 月全体をCP-SATで一括して解く
+            "weekly": 週単位に分割して並列に解き、週境界を修復する
+            "interval": 勤務区間を区間変数と累積制約で解く
+            "flow": 採用スタッフを最小費用流で月全体から一括して選ぶ
+            "lns": 貪欲法の解を大近傍探索で改善する（大規模店舗向け）
+            "portfolio": 上記を別プロセスで競わせ、期限までの最良解を使う
+        time_limit: CP-SATの探索時間の上限（秒）
+        use_cache: 同一入力の生成結果をキャッシュから再利用するか
+        capacity_check: 必要人数を満たせない日があった場合の扱い
+            "warn": 警告を表示して生成を続ける
+            "error": ソルバーを動かす前にValueErrorを送出する
+            "off": チェックしない
+        pins: 手動で固定したセル（PinSnapshot）。省略時はDBから読み込む
+        previous_shifts: 前月の確定シフト (staff_id, 日, 開始時間, 終了時間)。
+            指定した場合は曜日を合わせて解のヒントにし、月初の連勤も引き継ぐ
+        rules: 労務ルール（LaborRules）。省略時はDBの店舗設定、
+            DBもなければ既定値を使う
+    """
+    employees = list(employees)
+    staffs = list(staffs)
+    if rules is None:
+        rules = load_labor_rules(db, store.id) if db else DEFAULT_LABOR_RULES
+    if pins is None:
+        pins = load_pins(
+            db, [s.id for s in employees + staffs], year, month
+        ) if db else ()
+    
+    # 以降はDBセッションに依存しない固定データで処理する
+    snapshot = build_snapshot(
+        store, employees, staffs, requests, patterns, holidays, year, month,
+        pins=pins, previous_shifts=previous_shifts, rules=rules
+    )
+    store = snapshot.store
+    employees = list(snapshot.employees)
+    staffs = list(snapshot.staffs)
+    # 固定したセルは希望を置き換え、バイトの固定したシフトは確定済みの
+    # 勤務として生成方式に渡す
+    requests = apply_pins_to_requests(
+        snapshot.requests, snapshot.pins, year, month
+    )
+    fixed = pinned_shifts(snapshot.pins, [s.id for s in staffs])
+    patterns = list(snapshot.patterns)
+    holidays = snapshot.holidays
+    
     print("\n=== シフト生成開始 ===")
     print(f"店舗: {store.name}")
     print(f"対象年月: {year}年{month}月")
@@ -26,29 +114,12 @@ def generate_shift_results_with_ortools(
           f"(内訳: バイト {sum(1 for s in staffs if s.employment_type == 'バイト')}名, "
           f"未成年バイト {sum(1 for s in staffs if s.employment_type == '未成年バイト')}名)")
     print(f"シフト希望数: {len(requests)}件")
+    print(f"固定したセル: {len(snapshot.pins)}件")
     print(f"休業日数: {len(holidays)}日")
     
-    if db:
-        print("\n既存のシフトデータを削除中...")
-        # 既存のシフト結果を削除
-        deleted_results = db.query(Shiftresult).filter(
-            Shiftresult.year == year,
-            Shiftresult.month == month,
-            Shiftresult.staff_id.in_([s.id for s in employees + staffs])
-        ).delete(synchronize_session=False)
-        print(f"削除されたシフト結果: {deleted_results}件")
-        
-        # 既存のシフトを削除
-        deleted_shifts = db.query(Shift).filter(
-            Shift.year == year,
-            Shift.month == month,
-            Shift.staff_id.in_([s.id for s in employees + staffs])
-        ).delete(synchronize_session=False)
-        print(f"削除されたシフト: {deleted_shifts}件")
-        db.flush()
-    
     # 1. 入力の検証
     print("\n1. 入力の検証")
+    report_phase("validation", "入力を検証しています")
     print("シフト希望の検証中...")
     valid_requests = validate_shift_requests(
         requests, employees + staffs, store
@@ -57,10 +128,16 @@ def generate_shift_results_with_ortools(
     
     print("\nシフトパターンの検証中...")
     valid_patterns = validate_shift_patterns(patterns, store)
+    allowed_patterns = [p for p in valid_patterns if rules.allows_pattern(p)]
+    if len(allowed_patterns) < len(valid_patterns):
+        print(f"勤務時間が{rules.min_shift_hours}～{rules.max_shift_hours}時間の"
+              f"範囲外のパターンを除外: "
+              f"{len(valid_patterns) - len(allowed_patterns)}件")
+    valid_patterns = allowed_patterns
     print(f"有効なシフトパターン: {len(valid_patterns)}件")
     
     print("\n必要人数の検証中...")
-    last_day = (datetime(year, month + 1, 1) - timedelta(days=1)).day
+    last_day = snapshot.last_day
     validate_staffing_requirements(
         store=store,
         employees=employees,
@@ -71,20 +148,332 @@ def generate_shift_results_with_ortools(
         last_day=last_day
     )
     
-    # 2. モデルの構築
-    print("\n2. モデルの構築")
-    model = cp_model.CpModel()
-    print("制約モデルの初期化完了")
+    if capacity_check != "off":
+        # 勤務時間の上限は生成方式ごとの1日の最長勤務に合わせる
+        if strategy == "interval":
+            max_shift_hours = rules.shift_length_range()[1]
+        elif strategy in ("cpsat", "weekly") and valid_patterns:
+            max_shift_hours = max(
+                p.end_time - p.start_time for p in valid_patterns
+            )
+        else:
+            max_shift_hours = None
+        capacity = check_staffing_capacity(
+            store, employees, staffs, valid_requests, holidays,
+            year, month, last_day, max_shift_hours=max_shift_hours,
+            minor_end_hour=rules.minor_end_hour
+        )
+        if not capacity["feasible"] and capacity_check == "error":
+            days = [day for day, _, _, _ in capacity["short_days"]]
+            raise ValueError(
+                f"必要人数を満たせない日があります: {days}日"
+            )
     
-    # 3. 社員のシフトを確定
-    print("\n3. 社員のシフト確定")
-    employee_shifts = []
-    results = []
+    warm_start = build_warm_start(
+        snapshot.previous_shifts, [s.id for s in staffs], year, month, holidays,
+        max_consecutive_days=rules.max_consecutive_days
+    )
+    
+    # 同一入力の生成結果があれば再利用する
+    input_hash = None
+    results = None
+    if db and use_cache:
+        input_hash = compute_input_hash(
+            store, employees + staffs, valid_requests, valid_patterns,
+            holidays, year, month, strategy,
+            snapshot_parameters(snapshot, time_limit)
+        )
+        results = load_cached_results(db, input_hash, year, month)
+        if results is not None:
+            print("\n同一入力の生成結果をキャッシュから取得しました")
+            report_phase("cache", "同一入力の生成結果を再利用します")
+    
+    if results is None:
+        if strategy == "portfolio":
+            # shift_portfolio は子プロセスでこのモジュールを使うため遅延インポート
+            from .shift_portfolio import run_portfolio
+            results, _ = run_portfolio(snapshot, time_limit=time_limit)
+        else:
+            results = build_shift_results(
+                store, employees, staffs, valid_requests, valid_patterns,
+                holidays, year, month, last_day, strategy, time_limit,
+                warm_start=warm_start, rules=rules, fixed=fixed
+            )
+        if input_hash:
+            store_cached_results(
+                db, store.id, input_hash, year, month, results
+            )
+    
+    results = merge_pinned_results(results, snapshot.pins)
+    print(f"\n生成されたシフト数: {len(results)}件")
+    
+    # 生成したシフトを必要人数・スキル・労務ルール・希望と突き合わせる
+    violations = validate_schedule(
+        results, store, employees + staffs, valid_requests, holidays,
+        year, month, last_day, rules=rules, carry_in=warm_start.carry_in
+    )
+    if violations:
+        print(f"ルール違反: {len(violations)}件")
+        for violation in violations[:10]:
+            print(f"  {violation}")
+    report_phase(
+        "verification",
+        f"ルール違反 {len(violations)}件" if violations
+        else "ルール違反はありません",
+        violations=violations
+    )
+    
+    if db:
+        report_phase("persistence", "シフトを保存しています")
+        save_shift_results(
+            db, results, year, month, [s.id for s in employees + staffs]
+        )
     
+    report_phase("generated", "シフトを生成しました", shifts=len(results))
+    print("=== シフト生成完了 ===\n")
+    return results
+
+
+def save_shift_results(db, results, year, month, staff_ids):
+    """生成したシフトを保存済みのシフトと比較し、差分だけを書き込む
+    
+    (staff_id, 日) ごとに Shiftresult と Shift を突き合わせ、
+    時間が変わったものは更新、新しいものは追加、なくなったものは削除する。
+    変わらない行には触れないため、行のIDと Shiftresult.shift_id が保たれる。
+    固定された行（pinned）とそのシフトは、生成結果によらず変更・削除しない。
+    1つのトランザクションで処理し、最後にコミットする。
+    
+    Args:
+        db: DBセッション
+        results: 保存するシフト結果（Shiftresult）のリスト
+        year: 年
+        month: 月
+        staff_ids: 対象スタッフIDのリスト（この範囲の既存行だけを比較する）
+    
+    Returns:
+        counts: {"inserted", "updated", "deleted", "unchanged", "pinned"} の件数
+    """
+    print("\nシフトデータをDBに保存中...")
+    counts = {
+        "inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0,
+        "pinned": 0
+    }
+    try:
+        existing_results = db.query(Shiftresult).filter(
+            Shiftresult.year == year,
+            Shiftresult.month == month,
+            Shiftresult.staff_id.in_(staff_ids)
+        ).order_by(Shiftresult.id).all()
+        existing_shifts = db.query(Shift).filter(
+            Shift.year == year,
+            Shift.month == month,
+            Shift.staff_id.in_(staff_ids)
+        ).order_by(Shift.id).all()
+        
+        # 同じ (staff_id, 日) に複数行ある場合はIDの小さい行を残す
+        result_by_key = {}
+        stale_result_ids = []
+        for row in existing_results:
+            key = (row.staff_id, row.day)
+            if key in result_by_key:
+                stale_result_ids.append(row.id)
+            else:
+                result_by_key[key] = row
+        shift_by_key = {}
+        stale_shift_ids = []
+        for row in existing_shifts:
+            key = (row.staff_id, row.date)
+            if key in shift_by_key:
+                stale_shift_ids.append(row.id)
+            else:
+                shift_by_key[key] = row
+        
+        # 固定された行は生成結果にあってもなくてもそのまま残す
+        new_keys = {key for key, row in result_by_key.items() if row.pinned}
+        counts["pinned"] = len(new_keys)
+        for result in results:
+            key = (result.staff_id, result.day)
+            if key in new_keys:
+                continue
+            new_keys.add(key)
+            
+            shift = shift_by_key.get(key)
+            if shift is None:
+                shift = Shift(
+                    staff_id=result.staff_id,
+                    year=year,
+                    month=month,
+                    date=result.day,
+                    start_time=result.start_time,
+                    end_time=result.end_time
+                )
+                db.add(shift)
+                db.flush()  # IDを取得するためにflush
+                shift_by_key[key] = shift
+            elif (shift.start_time, shift.end_time) != (
+                result.start_time, result.end_time
+            ):
+                shift.start_time = result.start_time
+                shift.end_time = result.end_time
+            
+            row = result_by_key.get(key)
+            if row is None:
+                result.shift_id = shift.id
+                db.add(result)
+                counts["inserted"] += 1
+            elif (row.start_time, row.end_time, row.shift_id, row.pinned) != (
+                result.start_time, result.end_time, shift.id,
+                bool(result.pinned)
+            ):
+                row.start_time = result.start_time
+                row.end_time = result.end_time
+                row.shift_id = shift.id
+                row.pinned = bool(result.pinned)
+                counts["updated"] += 1
+            else:
+                counts["unchanged"] += 1
+        
+        # 新しいシフトにない行を削除（Shiftresult → Shift の順）
+        removed_keys = [key for key in result_by_key if key not in new_keys]
+        stale_result_ids.extend(result_by_key[key].id for key in removed_keys)
+        counts["deleted"] = len(removed_keys)
+        stale_shift_ids.extend(
+            shift_by_key[key].id for key in shift_by_key
+            if key not in new_keys and shift_by_key[key].id is not None
+        )
+        if stale_result_ids:
+            db.query(Shiftresult).filter(
+                Shiftresult.id.in_(stale_result_ids)
+            ).delete(synchronize_session=False)
+        if stale_shift_ids:
+            # 削除するシフトを参照する行が残らないようにする
+            db.query(Shiftresult).filter(
+                Shiftresult.shift_id.in_(stale_shift_ids)
+            ).update({Shiftresult.shift_id: None}, synchronize_session=False)
+            db.query(Shift).filter(
+                Shift.id.in_(stale_shift_ids)
+            ).delete(synchronize_session=False)
+        
+        db.commit()
+        print(f"シフトデータの保存が完了しました "
+              f"(追加 {counts['inserted']}件, 更新 {counts['updated']}件, "
+              f"削除 {counts['deleted']}件, 変更なし {counts['unchanged']}件, "
+              f"固定 {counts['pinned']}件)")
+    except Exception as e:
+        db.rollback()
+        print(f"シフトデータの保存に失敗しました: {str(e)}")
+        raise
+    return counts
+
+def build_shift_results(
+    store, employees, staffs, valid_requests, valid_patterns,
+    holidays, year, month, last_day, strategy, time_limit, warm_start=None,
+    rules=DEFAULT_LABOR_RULES, fixed=None
+):
+    """検証済みの入力から社員とバイトのシフト結果を組み立てる
+    
+    Args:
+        warm_start: 前月のシフトから作った解のヒントと月初の連勤状態
+            （WarmStart）。ヒントはCP-SATの方式だけが使う
+        rules: 労務ルール（LaborRules）
+        fixed: バイトの固定したシフト (staff_id, day) → (開始時間, 終了時間)。
+            どの方式でも採用の候補から外し、必要人数・連勤・週の勤務時間に
+            確定済みの勤務として数えて、そのままの時間で結果に含める
+    
+    Returns:
+        results: 社員のシフト + バイトスタッフのシフト
+    """
+    fixed = fixed or {}
+    open_requests = {
+        key: req for key, req in valid_requests.items() if key not in fixed
+    }
+    
+    # 2. 社員のシフトを確定
+    print("\n2. 社員のシフト確定")
     # 社員のシフトを希望通りに設定
+    results, employee_shifts = build_employee_results(
+        store, employees, valid_requests, year, month,
+        range(1, last_day + 1)
+    )
+    
+    print(f"\n社員シフトの総時間数: {len(employee_shifts)}時間")
+    
+    if strategy in ("cpsat", "weekly", "interval"):
+        print(f"\n3. バイトスタッフのシフト割り当て (CP-SAT: {strategy})")
+        report_phase("solve", "CP-SATでシフトを割り当てています",
+                     strategy=strategy, time_limit=time_limit)
+        adjusted_shifts = generate_staff_shifts_with_cpsat(
+            store, employees, staffs, open_requests, valid_patterns,
+            employee_shifts, holidays, year, month, last_day,
+            strategy, time_limit, warm_start=warm_start, rules=rules,
+            fixed=fixed
+        )
+    elif strategy in ("greedy", "flow", "lns"):
+        carry_in = warm_start.carry_in if warm_start else None
+        # 3. バイトスタッフの採用/不採用を決定
+        print("\n3. バイトスタッフの採用/不採用決定")
+        report_phase("selection", "採用するスタッフを決めています",
+                     strategy=strategy)
+        print("時間帯ごとの必要人数を計算中...")
+        if strategy == "flow":
+            required_staff, selected_staff_by_day = (
+                select_staff_by_min_cost_flow(
+                    store, employees, staffs, holidays,
+                    year, month, last_day, employee_shifts, open_requests,
+                    carry_in=carry_in, rules=rules, fixed=fixed
+                )
+            )
+        else:
+            required_staff, selected_staff_by_day = optimize_required_staff(
+                store, employees, staffs, holidays,
+                year, month, last_day, employee_shifts, open_requests,
+                carry_in=carry_in, rules=rules, fixed=fixed
+            )
+        
+        # バイトスタッフのシフト時間を決定
+        print("\n4. バイトスタッフのシフト時間調整")
+        report_phase("trimming", "勤務時間を調整しています")
+        adjusted_shifts, rejection_times = trim_staff_shifts(
+            store, selected_staff_by_day, open_requests,
+            employee_shifts, year, month, last_day, holidays, staffs,
+            rules=rules, fixed=fixed
+        )
+        
+        if strategy == "lns":
+            print("\n5. 大近傍探索によるシフト改善")
+            report_phase("lns", "大近傍探索で改善しています",
+                         time_limit=time_limit)
+            adjusted_shifts = generate_staff_shifts_with_lns(
+                store, staffs, open_requests, employee_shifts,
+                required_staff, adjusted_shifts, holidays, year, month,
+                last_day, time_limit, carry_in=carry_in, rules=rules,
+                fixed=fixed
+            )
+    else:
+        raise ValueError(f"不明な生成方式です: {strategy}")
+    
+    # 結果を結合（社員のシフト + 調整後のバイトスタッフのシフト + 固定したシフト）
+    results.extend(adjusted_shifts)
+    results.extend(intervals_to_results(fixed, year, month))
+    
+    return results
+
+
+def build_employee_results(store, employees, valid_requests, year, month, days):
+    """社員のシフトを希望通りに確定する
+    
+    Args:
+        days: 対象日の範囲
+    
+    Returns:
+        results: 社員のシフト結果のリスト
+        employee_shifts: 社員のシフトリスト (e_id, day, 開始時間)
+    """
+    employee_shifts = []
+    results = []
     for employee in employees:
         print(f"\n社員 {employee.name} のシフト確定:")
-        for day in range(1, last_day + 1):
+        for day in days:
             req = valid_requests.get((employee.id, day))
             if not req:
                 continue
@@ -124,59 +513,166 @@ def generate_shift_results_with_ortools(
                         end_time=end_time
                     )
                 )
+    return results, employee_shifts
+
+
+def generate_staff_shifts_with_cpsat(
+    store, employees, staffs, valid_requests, patterns, employee_shifts,
+    holidays, year, month, last_day, strategy, time_limit, warm_start=None,
+    rules=DEFAULT_LABOR_RULES, fixed=None
+):
+    """CP-SATでバイトスタッフのシフトパターンを割り当てる
     
-    print(f"\n社員シフトの総時間数: {len(employee_shifts)}時間")
+    Args:
+        store: 店舗情報
+        employees: 社員リスト
+        staffs: バイトスタッフリスト
+        valid_requests: 有効なシフト希望
+        patterns: 有効なシフトパターンリスト
+        employee_shifts: 社員のシフトリスト (e_id, day, hour)
+        holidays: 休業日リスト
+        year: 年
+        month: 月
+        last_day: 月末日
+        strategy: "cpsat"（月一括）、"weekly"（週単位分割）、
+            "interval"（区間変数）
+        time_limit: 探索時間の上限（秒）
+        warm_start: 前月のシフトから作った解のヒントと月初の連勤状態
+        rules: 労務ルール
+        fixed: 固定したシフト (staff_id, day) → (開始時間, 終了時間)。
+            valid_requests からは除いておく
     
-    # 4. バイトスタッフの採用/不採用を決定
-    print("\n4. バイトスタッフの採用/不採用決定")
-    print("時間帯ごとの必要人数を計算中...")
-    required_staff, selected_staff_by_day = optimize_required_staff(
-        model, store, employees, staffs, holidays,
-        year, month, last_day, employee_shifts, valid_requests
+    Returns:
+        shifts: バイトスタッフのシフトリスト（固定したシフトは含まない）
+    """
+    fixed = fixed or {}
+    # 固定したシフトで満たされる分は、解く前に必要人数から差し引く
+    required_staff = subtract_pinned_coverage(
+        calculate_hourly_required_staff(
+            store, employees, staffs, holidays,
+            year, month, last_day, employee_shifts
+        ),
+        fixed
     )
     
-    # バイトスタッフのシフト時間を調整
-    print("\n5. バイトスタッフのシフト時間調整")
-    adjusted_shifts, rejection_times = adjust_staff_shifts(
-        store, selected_staff_by_day, valid_requests,
-        employee_shifts, year, month, last_day, holidays, staffs
+    target_days = calculate_target_days(
+        store, staffs, valid_requests, year, month, last_day, holidays,
+        employee_shifts
     )
     
-    # 結果を結合（社員のシフト + 調整後のバイトスタッフのシフト）
-    results.extend(adjusted_shifts)
+    hints = warm_start.hints if warm_start else None
+    carry_in = warm_start.carry_in if warm_start else None
+    if strategy == "interval":
+        intervals = solve_shift_intervals(
+            store, staffs, valid_requests, required_staff, last_day,
+            target_days=target_days, carry_in=carry_in, hints=hints,
+            time_limit=time_limit, rules=rules, fixed=fixed
+        )
+        if intervals is None:
+            raise ValueError("シフトを求解できませんでした")
+    else:
+        if strategy == "weekly":
+            assignments = solve_month_by_weeks(
+                store, staffs, patterns, valid_requests, required_staff,
+                year, month, last_day, target_days=target_days,
+                carry_in=carry_in, time_limit=time_limit, rules=rules,
+                fixed=fixed
+            )
+        else:
+            # 店舗構成が同じなら前回コンパイルしたモデルを再利用する
+            assignments = solve_shift_patterns_from_template(
+                store, staffs, patterns, valid_requests, required_staff,
+                last_day, target_days=target_days, carry_in=carry_in,
+                hints=hints, time_limit=time_limit, rules=rules, fixed=fixed
+            )
+            if assignments is None:
+                raise ValueError("シフトを求解できませんでした")
+        intervals = {
+            key: (p.start_time, p.end_time)
+            for key, p in assignments.items()
+        }
     
-    print(f"\n生成されたシフト数: {len(results)}件")
+    shifts = intervals_to_results(intervals, year, month)
+    print(f"CP-SATによる割り当て: {len(shifts)}件")
+    return shifts
+
+
+def calculate_target_days(
+    store, staffs, valid_requests, year, month, last_day, holidays,
+    employee_shifts
+):
+    """不採用目安から月間の採用目標日数を求める
     
-    if db:
-        print("\nシフトデータをDBに保存中...")
-        try:
-            # シフトを保存
-            for result in results:
-                # 新しいシフトを作成
-                new_shift = Shift(
-                    staff_id=result.staff_id,
-                    year=year,
-                    month=month,
-                    date=result.day,
-                    start_time=result.start_time,
-                    end_time=result.end_time
-                )
-                db.add(new_shift)
-                db.flush()  # IDを取得するためにflush
+    Returns:
+        target_days: {staff_id: 採用目標日数}
+    """
+    rejection_targets, _ = calculate_rejection_targets(
+        store, staffs, valid_requests, year, month, last_day, holidays,
+        employee_shifts
+    )
+    target_days = {}
+    for staff in staffs:
+        requested = sum(
+            1 for day in range(1, last_day + 1)
+            if valid_requests.get((staff.id, day)) and
+            valid_requests[(staff.id, day)].status not in ("X", "")
+        )
+        target_days[staff.id] = max(
+            0, requested - rejection_targets.get(staff.id, 0)
+        )
+    return target_days
 
-                # シフト結果を更新
-                result.shift_id = new_shift.id
-                db.add(result)
-            
-            db.commit()
-            print("シフトデータの保存が完了しました")
-        except Exception as e:
-            db.rollback()
-            print(f"シフトデータの保存に失敗しました: {str(e)}")
-            raise
+
+def intervals_to_results(intervals, year, month):
+    """(staff_id, day) → (開始, 終了) をシフト結果のリストにする"""
+    return [
+        Shiftresult(
+            staff_id=staff_id,
+            year=year,
+            month=month,
+            day=day,
+            start_time=start_time,
+            end_time=end_time
+        )
+        for (staff_id, day), (start_time, end_time) in sorted(intervals.items())
+    ]
+
+
+def generate_staff_shifts_with_lns(
+    store, staffs, valid_requests, employee_shifts, required_staff,
+    greedy_shifts, holidays, year, month, last_day, time_limit,
+    carry_in=None, rules=DEFAULT_LABOR_RULES, fixed=None
+):
+    """貪欲法の解を初期解として、大近傍探索でバイトのシフトを改善する
     
-    print("=== シフト生成完了 ===\n")
-    return results
+    Args:
+        carry_in: staff_id → 前月末日までの連続勤務日数
+        rules: 労務ルール
+        fixed: 固定したシフト (staff_id, day) → (開始時間, 終了時間)。
+            初期解に含めて動かさない勤務として扱う
+    
+    Returns:
+        shifts: バイトスタッフのシフトリスト（固定したシフトは含まない）
+    """
+    fixed = fixed or {}
+    target_days = calculate_target_days(
+        store, staffs, valid_requests, year, month, last_day, holidays,
+        employee_shifts
+    )
+    initial = {
+        (r.staff_id, r.day): (r.start_time, r.end_time)
+        for r in greedy_shifts
+    }
+    initial.update(fixed)
+    intervals, _ = improve_with_lns(
+        store, staffs, valid_requests, required_staff, initial,
+        target_days, last_day, time_limit=time_limit, carry_in=carry_in,
+        rules=rules, fixed=set(fixed)
+    )
+    return intervals_to_results(
+        {key: value for key, value in intervals.items() if key not in fixed},
+        year, month
+    )
 
 
 def calculate_rejection_targets(
@@ -213,11 +709,7 @@ def calculate_rejection_targets(
     # バイトの希望日数を集計
     for day in range(1, last_day + 1):
         day_type = get_day_type(year, month, day, holidays)
-        skill_req = next(
-            (r for r in store.default_skill_requirements 
-             if r.day_type == day_type),
-            None
-        )
+        skill_req = store.get_skill_requirement(day_type)
         if not skill_req:
             continue
             
@@ -239,11 +731,7 @@ def calculate_rejection_targets(
     total_employee_days = 0
     for day in range(1, last_day + 1):
         day_type = get_day_type(year, month, day, holidays)
-        skill_req = next(
-            (r for r in store.default_skill_requirements 
-             if r.day_type == day_type),
-            None
-        )
+        skill_req = store.get_skill_requirement(day_type)
         if skill_req:
             total_required += skill_req.peak_people
             # その日の社員の勤務数をカウント
@@ -280,15 +768,16 @@ def calculate_rejection_targets(
     high_request_staff = sorted_staff[:mid_point]  # 希望日数の多いグループ
     low_request_staff = sorted_staff[mid_point:]   # 希望日数の少ないグループ
     
+    staff_by_id = {s.id: s for s in staffs}
     print("\nスタッフの希望日数による分類:")
     print("希望日数の多いグループ:")
     for staff_id, request_count in high_request_staff:
-        staff = next(s for s in staffs if s.id == staff_id)
+        staff = staff_by_id[staff_id]
         print(f"  スタッフID {staff_id} ({staff.employment_type}): "
               f"{request_count}日")
     print("希望日数の少ないグループ:")
     for staff_id, request_count in low_request_staff:
-        staff = next(s for s in staffs if s.id == staff_id)
+        staff = staff_by_id[staff_id]
         print(f"  スタッフID {staff_id} ({staff.employment_type}): "
               f"{request_count}日")
     
@@ -347,14 +836,38 @@ def calculate_peak_coverage(req, store, skill_req):
     # カバー率を計算
     return overlap_duration / peak_duration if peak_duration > 0 else 0.0
 
+def get_hourly_required_staff(store, skill_req, employee_shifts, day):
+    """その日の時間帯ごとのバイト必要人数を求める
+    
+    Returns:
+        required_staff: (day, hour) → 必要人数（社員の勤務分を除く）
+    """
+    required_staff = {}
+    for hour in range(store.open_hours, store.close_hours):
+        if hour < skill_req.peak_start_hour:
+            required = skill_req.open_people
+        elif hour < skill_req.peak_end_hour:
+            required = skill_req.peak_people
+        else:
+            required = skill_req.close_people
+        
+        # 社員の勤務を考慮
+        employee_count = sum(
+            1 for e_id, d, h in employee_shifts
+            if d == day and h == hour
+        )
+        required_staff[(day, hour)] = max(0, required - employee_count)
+    return required_staff
+
+
 def optimize_required_staff(
-    model, store, employees, staffs, holidays,
-    year, month, last_day, employee_shifts, valid_requests
+    store, employees, staffs, holidays,
+    year, month, last_day, employee_shifts, valid_requests, carry_in=None,
+    rules=DEFAULT_LABOR_RULES, fixed=None
 ):
     """必要人数を最適化する
     
     Args:
-        model: OR-Toolsのモデル
         store: 店舗情報
         employees: 社員リスト（employment_type="社員"）
         staffs: バイトスタッフリスト（employment_type="バイト"または"未成年バイト"）
@@ -364,12 +877,18 @@ def optimize_required_staff(
         last_day: 月末日
         employee_shifts: 社員のシフトリスト (e_id, day, hour)
         valid_requests: 有効なシフト希望
+        carry_in: staff_id → 前月末日までの連続勤務日数
+        rules: 労務ルール（連勤上限・週の勤務時間の上限）
+        fixed: 固定したシフト (staff_id, day) → (開始時間, 終了時間)。
+            先に採用済みとして必要人数・連勤・週の勤務時間に数える
     
     Returns:
         required_staff: (day, hour) → 必要人数
         selected_staff_by_day: day → 採用されたスタッフIDのリスト
+            （固定したシフトは含まない）
     """
     print("\n=== 必要人数の最適化 ===")
+    fixed = fixed or {}
     print(f"社員数: {len(employees)}名")
     
     # スタッフの分類を確認
@@ -387,8 +906,19 @@ def optimize_required_staff(
     required_staff = {}  # (day, hour) → 必要人数
     selected_staff_by_day = defaultdict(list)  # day → 採用されたスタッフIDのリスト
     staff_work_days = defaultdict(set)  # staff_id → 勤務日集合
+    # 前月末から続く連勤は0日以前の勤務日として数える
+    for staff_id, run in (carry_in or {}).items():
+        staff_work_days[staff_id].update(range(1 - run, 1))
+    staff_by_id = {s.id: s for s in staffs}
     staff_rejections = defaultdict(int)  # staff_id → 不採用回数
     total_requests = defaultdict(int)  # staff_id → 希望回数
+    # 週の勤務時間の上限があるスタッフの day → 見込みの勤務時間
+    weekly_caps = {s.id: rules.weekly_cap(s) for s in staffs}
+    staff_hours = defaultdict(dict)
+    # 固定したシフトは採用済みとして扱う
+    for (staff_id, day), (start, end) in fixed.items():
+        staff_work_days[staff_id].add(day)
+        staff_hours[staff_id][day] = end - start
     
     # 不採用目安日数を計算
     rejection_targets, _ = calculate_rejection_targets(
@@ -396,6 +926,12 @@ def optimize_required_staff(
         last_day, holidays, employee_shifts
     )
     
+    # 希望者が必要人数以下の日・希望者がいない日は先に確定する
+    decided_days, _, _ = presolve_trivial_days(
+        store, staffs, valid_requests, employee_shifts, holidays,
+        year, month, last_day, fixed=fixed
+    )
+    
     # 日付をソート（土日祝日を優先）
     sorted_days = []
     for day in range(1, last_day + 1):
@@ -409,24 +945,45 @@ def optimize_required_staff(
     
     for day in sorted_days:
         day_type = get_day_type(year, month, day, holidays)
-        skill_req = next(
-            (r for r in store.default_skill_requirements 
-             if r.day_type == day_type),
-            None
-        )
+        skill_req = store.get_skill_requirement(day_type)
         if not skill_req:
             continue
         
         # その日の社員の勤務数をカウント
-        employee_count = sum(
-            1 for e_id, d, h in employee_shifts
-            if d == day and h == skill_req.peak_start_hour
+        employee_count = count_peak_employees(
+            employee_shifts, day, skill_req.peak_start_hour
+        )
+        
+        pinned_count = count_pinned_staff(
+            fixed, day, skill_req.peak_start_hour
         )
         
-        # バイトの必要人数を計算（社員数を引く）
-        required_count = max(0, skill_req.peak_people - employee_count)
+        # バイトの必要人数を計算（社員数と固定したシフトの人数を引く）
+        required_count = max(
+            0, skill_req.peak_people - employee_count - pinned_count
+        )
         print(f"\n{day}日: 必要人数 {skill_req.peak_people}人 "
-              f"(社員 {employee_count}人, バイト必要 {required_count}人)")
+              f"(社員 {employee_count}人, 固定 {pinned_count}人, "
+              f"バイト必要 {required_count}人)")
+        
+        # 時間帯ごとの必要人数を設定
+        required_staff.update(get_hourly_required_staff(
+            store, skill_req, employee_shifts, day
+        ))
+        
+        # 前処理で確定した日は希望者全員を採用する
+        if day in decided_days:
+            for staff_id in decided_days[day]:
+                selected_staff_by_day[day].append(staff_id)
+                staff_work_days[staff_id].add(day)
+                staff_hours[staff_id][day] = estimate_shift_hours(
+                    valid_requests.get((staff_id, day)), store,
+                    staff_by_id[staff_id], rules
+                )
+                total_requests[staff_id] += 1
+            print(f"  {day}日: 希望者 {len(decided_days[day])}人を全員採用 "
+                  f"(前処理で確定)")
+            continue
         
         # その日の希望者を取得
         available_staff = []
@@ -435,6 +992,15 @@ def optimize_required_staff(
             if not req or req.status == "X":
                 continue
             
+            # 採用すると週の勤務時間の上限を超えるスタッフは候補にしない
+            hours = estimate_shift_hours(req, store, s, rules)
+            if exceeds_weekly_cap(
+                staff_hours[s.id], day, hours, weekly_caps[s.id]
+            ):
+                print(f"  {day}日: スタッフID {s.id} は週の勤務時間の上限"
+                      f"（{weekly_caps[s.id]}時間）のため候補外")
+                continue
+            
             # 不採用目安との誤差を計算
             target_rejections = rejection_targets.get(s.id, 0)
             current_rejections = staff_rejections[s.id]
@@ -462,7 +1028,7 @@ def optimize_required_staff(
             
             # 連勤日数を計算
             consecutive_days = 0
-            for d in range(day - 1, 0, -1):
+            for d in range(day - 1, -rules.max_consecutive_days, -1):
                 if d in staff_work_days[s.id]:
                     consecutive_days += 1
                 else:
@@ -470,7 +1036,7 @@ def optimize_required_staff(
             
             # 連勤制約違反を計算
             consecutive_violation = 0
-            if consecutive_days >= 5:  # 5日連勤は制約違反
+            if consecutive_days >= rules.max_consecutive_days:  # 上限に達した連勤は制約違反
                 consecutive_violation = 1
             
             available_staff.append({
@@ -480,6 +1046,7 @@ def optimize_required_staff(
                 'peak_coverage': peak_coverage,
                 'consecutive_days': consecutive_days,
                 'consecutive_violation': consecutive_violation,
+                'hours': hours,
                 'current_rejections': current_rejections,  # 現在の不採用回数
                 'target_rejections': target_rejections  # 目標不採用回数
             })
@@ -500,6 +1067,7 @@ def optimize_required_staff(
             staff_id = staff_info['id']
             selected_staff_by_day[day].append(staff_id)
             staff_work_days[staff_id].add(day)
+            staff_hours[staff_id][day] = staff_info['hours']
             print(f"  {day}日: スタッフID {staff_id} "
                   f"({staff_info['employment_type']}) を採用 "
                   f"(不採用目安: {staff_info['target_rejections']}日, "
@@ -521,24 +1089,6 @@ def optimize_required_staff(
                   f"ピークカバー率: {staff_info['peak_coverage']:.2f}, "
                   f"連勤日数: {staff_info['consecutive_days']}, "
                   f"連勤違反: {staff_info['consecutive_violation']}日)")
-        
-        # 時間帯ごとの必要人数を設定
-        for hour in range(store.open_hours, store.close_hours):
-            if hour < skill_req.peak_start_hour:
-                required = skill_req.open_people
-            elif hour < skill_req.peak_end_hour:
-                required = skill_req.peak_people
-            else:
-                required = skill_req.close_people
-            
-            # 社員の勤務を考慮
-            employee_count = sum(
-                1 for e_id, d, h in employee_shifts
-                if d == day and h == hour
-            )
-            required = max(0, required - employee_count)
-            
-            required_staff[(day, hour)] = required
     
     # 最終的な不採用率と目安との誤差を表示
     print("\n=== 不採用率の集計 ===")
@@ -556,242 +1106,337 @@ def optimize_required_staff(
     
     return required_staff, selected_staff_by_day 
 
-def adjust_staff_shifts(
-    store, selected_staff_by_day, valid_requests, employee_shifts,
-    year, month, last_day, holidays, staffs
+def select_staff_by_min_cost_flow(
+    store, employees, staffs, holidays,
+    year, month, last_day, employee_shifts, valid_requests, carry_in=None,
+    rules=DEFAULT_LABOR_RULES, fixed=None
 ):
-    """バイトスタッフのシフト時間を調整する
+    """最小費用流で月全体の採用スタッフを一括して選ぶ
+    
+    「始点→スタッフ→希望日→終点」のネットワークを作り、まず各日の
+    バイト必要人数（ピーク人数 - 社員数）をできるだけ満たし、その中で
+    費用が最小になる採用を選ぶ。
+    
+    - 始点→スタッフ: 採用日数ごとに容量1の辺を並べ、不採用目安から
+      求めた採用目標日数までは報酬、超えた分は増えていく費用とする
+      （凸な費用のため、採用日数がスタッフ間で均等に近づく）
+    - スタッフ→希望日: ピーク時間帯のカバー率が低いほど高い費用
+    - 希望日→終点: その日のバイト必要人数
     
     Args:
         store: 店舗情報
-        selected_staff_by_day: {day: [staff_id]} 採用されたスタッフ
-        valid_requests: 有効なシフト希望
-        employee_shifts: 社員のシフトリスト
+        employees: 社員リスト
+        staffs: バイトスタッフリスト
+        holidays: 休業日リスト
         year: 年
         month: 月
         last_day: 月末日
-        holidays: 休業日リスト
-        staffs: スタッフリスト（未成年バイトの判定用）
+        employee_shifts: 社員のシフトリスト (e_id, day, hour)
+        valid_requests: 有効なシフト希望
+        carry_in: staff_id → 前月末日までの連続勤務日数
+        rules: 労務ルール（連勤上限・週の勤務時間の上限）
+        fixed: 固定したシフト (staff_id, day) → (開始時間, 終了時間)。
+            先に採用済みとして必要人数・連勤・週の勤務時間に数える
     
     Returns:
-        adjusted_shifts: 調整後のシフトリスト
-        rejection_times: {staff_id: (早出時間, 早退時間)} 不採用時間
+        required_staff: (day, hour) → 必要人数
+        selected_staff_by_day: day → 採用されたスタッフIDのリスト
+            （固定したシフトは含まない）
     """
-    print("\n=== バイトスタッフのシフト時間調整 ===")
-    adjusted_shifts = []
-    rejection_times = defaultdict(lambda: [0, 0])  # (早出時間, 早退時間)
-    
-    # スタッフIDから未成年バイトかどうかを判定する辞書を作成
-    is_minor = {staff.id: staff.employment_type == '未成年バイト' 
-                for staff in staffs}
+    print("\n=== 最小費用流による採用スタッフの選択 ===")
+    fixed = fixed or {}
+    started = time.perf_counter()
+    rejection_targets, _ = calculate_rejection_targets(
+        store, staffs, valid_requests, year, month,
+        last_day, holidays, employee_shifts
+    )
     
+    required_staff = {}
+    required_count = {}
+    skill_reqs = {}
     for day in range(1, last_day + 1):
-        staff_list = selected_staff_by_day.get(day, [])
-        if not staff_list:
-            continue
-        
-        # その日の日種を取得
-        day_type = get_day_type(year, month, day, holidays)
-        skill_req = next(
-            (r for r in store.default_skill_requirements 
-             if r.day_type == day_type),
-            None
+        skill_req = store.get_skill_requirement(
+            get_day_type(year, month, day, holidays)
         )
         if not skill_req:
             continue
-            
-        # その日の社員の勤務を確認
-        employee_open = sum(
-            1 for e_id, d, h in employee_shifts
-            if d == day and h == store.open_hours
-        )
-        employee_close = sum(
-            1 for e_id, d, h in employee_shifts
-            if d == day and h == store.close_hours - 1
+        skill_reqs[day] = skill_req
+        required_count[day] = max(
+            0,
+            skill_req.peak_people - count_peak_employees(
+                employee_shifts, day, skill_req.peak_start_hour
+            ) - count_pinned_staff(fixed, day, skill_req.peak_start_hour)
         )
-        
-        # バイトの必要人数を計算
-        open_staff_needed = max(0, skill_req.open_people - employee_open)
-        close_staff_needed = max(0, skill_req.close_people - employee_close)
-        
-        print(f"\n{day}日 ({day_type}):")
-        print(f"オープン必要人数: {open_staff_needed}人 "
-              f"(社員 {employee_open}人, 必要 {skill_req.open_people}人)")
-        print(f"クローズ必要人数: {close_staff_needed}人 "
-              f"(社員 {employee_close}人, 必要 {skill_req.close_people}人)")
-        
-        # スタッフを時間帯ごとに分類
-        open_staff = []  # オープン時間帯のスタッフ
-        close_staff = []  # クローズ時間帯のスタッフ
-        middle_staff = []  # 中間時間帯のスタッフ
-        
-        for staff_id in staff_list:
-            req = valid_requests.get((staff_id, day))
+        required_staff.update(get_hourly_required_staff(
+            store, skill_req, employee_shifts, day
+        ))
+    
+    # ノード番号: 0=始点, 1=終点, 2..=スタッフ, その後に日
+    source, sink = 0, 1
+    staff_node = {s.id: 2 + i for i, s in enumerate(staffs)}
+    day_node = {
+        day: 2 + len(staffs) + i for i, day in enumerate(sorted(skill_reqs))
+    }
+    flow = min_cost_flow.SimpleMinCostFlow()
+    
+    # 連勤上限: スタッフごとに (上限+1) 日単位のブロックを挟み、各ブロックの
+    # 採用日数を上限以下にする（ブロックをまたぐ連勤は後で修復する）。
+    # ブロック内の固定したシフトの日数はその容量から差し引く
+    max_days = rules.max_consecutive_days
+    block_size = max_days + 1
+    next_node = 2 + len(staffs) + len(day_node)
+    request_arcs = {}
+    for s in staffs:
+        requested_days = []
+        block_node = {}
+        for day in skill_reqs:
+            req = valid_requests.get((s.id, day))
             if not req or req.status == "X":
                 continue
-                
-            if req.status == "O":
-                # 終日勤務の場合は希望時間を店舗の営業時間に設定
-                req_start = store.open_hours
-                req_end = store.close_hours
-            else:  # time
-                req_start = req.start_time
-                req_end = req.end_time
-            
-            # 未成年バイトの場合は終了時間を10時までに制限
-            if is_minor[staff_id]:
-                req_end = min(req_end, 10)
-            
-            staff_info = {
-                'id': staff_id,
-                'is_minor': is_minor[staff_id],
-                'req_start': req_start,
-                'req_end': req_end,
-                'rejection_time': [0, 0]  # [早出時間, 早退時間]
-            }
-            
-            # 時間帯ごとに分類（オープンとクローズを優先）
-            if req_start <= store.open_hours + 1:
-                open_staff.append(staff_info)
-            elif req_end >= store.close_hours - 1 and not is_minor[staff_id]:
-                close_staff.append(staff_info)
-            else:
-                middle_staff.append(staff_info)
-        
-        # オープン時間帯の調整（最優先）
-        open_staff.sort(
-            key=lambda x: (
-                x['req_start'] == store.open_hours,  # オープン時間開始を優先
-                -x['req_end']  # 終了時間が遅い順
-            ),
-            reverse=True
-        )
-        
-        for staff_info in open_staff[:open_staff_needed]:
-            # オープン時間帯のシフトを設定
-            if staff_info['req_end'] >= store.open_hours + 4:
-                # 4時間以上確保できる場合
-                staff_info['start_time'] = store.open_hours
-                staff_info['end_time'] = min(
-                    staff_info['req_end'],
-                    staff_info['start_time'] + 5
+            block = (day - 1) // block_size
+            if block not in block_node:
+                block_node[block] = next_node
+                next_node += 1
+                pinned_days = sum(
+                    1 for d in range(
+                        block * block_size + 1, (block + 1) * block_size + 1
+                    )
+                    if (s.id, d) in fixed
                 )
-            else:
-                # 4時間確保できない場合は、希望時間内で最長のシフトを設定
-                staff_info['start_time'] = staff_info['req_start']
-                staff_info['end_time'] = staff_info['req_end']
-            
-            # 不採用時間を記録
-            if staff_info['end_time'] < staff_info['req_end']:
-                staff_info['rejection_time'][1] = (
-                    staff_info['req_end'] - staff_info['end_time']
+                flow.add_arc_with_capacity_and_unit_cost(
+                    staff_node[s.id], block_node[block],
+                    max(0, max_days - pinned_days), 0
                 )
+            coverage = calculate_peak_coverage(req, store, skill_reqs[day])
+            request_arcs[(s.id, day)] = flow.add_arc_with_capacity_and_unit_cost(
+                block_node[block], day_node[day], 1,
+                int(round((1 - coverage) * PEAK_COVERAGE_COST))
+            )
+            requested_days.append(day)
         
-        # クローズ時間帯の調整（最優先）
-        close_staff.sort(
-            key=lambda x: (
-                x['req_end'] == store.close_hours,  # クローズ時間終了を優先
-                x['req_start']  # 開始時間が早い順
-            ),
-            reverse=True
+        target = max(
+            0, len(requested_days) - rejection_targets.get(s.id, 0)
         )
-        
-        for staff_info in close_staff[:close_staff_needed]:
-            # クローズ時間帯のシフトを設定
-            if staff_info['req_end'] - staff_info['req_start'] >= 4:
-                # 4時間以上確保できる場合
-                staff_info['end_time'] = store.close_hours
-                staff_info['start_time'] = max(
-                    staff_info['req_start'],
-                    staff_info['end_time'] - 5
-                )
+        for k in range(1, len(requested_days) + 1):
+            if k <= target:
+                cost = -FAIRNESS_STEP_COST * (target - k + 1)
             else:
-                # 4時間確保できない場合は、希望時間内で最長のシフトを設定
-                staff_info['start_time'] = staff_info['req_start']
-                staff_info['end_time'] = staff_info['req_end']
-            
-            # 不採用時間を記録
-            if staff_info['start_time'] > staff_info['req_start']:
-                staff_info['rejection_time'][0] = (
-                    staff_info['start_time'] - staff_info['req_start']
-                )
-        
-        # 中間時間帯の調整
-        remaining_staff = (
-            open_staff[open_staff_needed:] +
-            close_staff[close_staff_needed:] +
-            middle_staff
+                cost = FAIRNESS_STEP_COST * (k - target)
+            flow.add_arc_with_capacity_and_unit_cost(
+                source, staff_node[s.id], 1, cost
+            )
+    
+    for day, node in day_node.items():
+        flow.add_arc_with_capacity_and_unit_cost(
+            node, sink, required_count[day], 0
         )
-        
-        for staff_info in remaining_staff:
-            # 希望時間内で最長のシフトを設定
-            available_hours = staff_info['req_end'] - staff_info['req_start']
-            if available_hours >= 5:
-                # 5時間以上確保できる場合は中央に配置
-                center = (staff_info['req_start'] + staff_info['req_end']) // 2
-                staff_info['start_time'] = max(
-                    staff_info['req_start'],
-                    center - 2
-                )
-                staff_info['end_time'] = min(
-                    staff_info['req_end'],
-                    staff_info['start_time'] + 5
-                )
-            elif available_hours >= 4:
-                # 4時間以上確保できる場合は希望時間をそのまま使用
-                staff_info['start_time'] = staff_info['req_start']
-                staff_info['end_time'] = staff_info['req_end']
-            else:
-                # 4時間未満の場合は希望時間をそのまま使用
-                staff_info['start_time'] = staff_info['req_start']
-                staff_info['end_time'] = staff_info['req_end']
-            
-            # 未成年バイトの場合は終了時間を10時までに制限
-            if staff_info['is_minor']:
-                staff_info['end_time'] = min(staff_info['end_time'], 10)
-                # 4時間確保できない場合は開始時間を調整
-                if staff_info['end_time'] - staff_info['start_time'] < 4:
-                    staff_info['start_time'] = staff_info['end_time'] - 4
-        
-        # シフトを記録
-        for staff_info in open_staff + close_staff + remaining_staff:
-            if 'start_time' not in staff_info:
+    
+    # 供給は希望の総数を上限とし、実際の流量は最大流として決まる
+    flow.set_node_supply(source, len(request_arcs))
+    flow.set_node_supply(sink, -len(request_arcs))
+    status = flow.solve_max_flow_with_min_cost()
+    if status != flow.OPTIMAL:
+        raise ValueError("最小費用流を解けませんでした")
+    
+    selected_staff_by_day = defaultdict(list)
+    for (staff_id, day), arc in request_arcs.items():
+        if flow.flow(arc):
+            selected_staff_by_day[day].append(staff_id)
+    selected_staff_by_day = repair_consecutive_days(
+        selected_staff_by_day, staffs, valid_requests, last_day,
+        rules=rules, carry_in=carry_in, fixed=fixed
+    )
+    selected_staff_by_day = repair_weekly_hours(
+        selected_staff_by_day, store, staffs, valid_requests, last_day,
+        rules, carry_in=carry_in, fixed=fixed
+    )
+    
+    elapsed = (time.perf_counter() - started) * 1000
+    total_required = sum(required_count.values())
+    print(f"採用: {flow.maximum_flow()}人日 / バイト必要: {total_required}人日 "
+          f"(希望: {len(request_arcs)}件, {elapsed:.1f}ms)")
+    for s in staffs:
+        accepted = sum(
+            1 for day in selected_staff_by_day
+            if s.id in selected_staff_by_day[day]
+        )
+        requested = sum(1 for staff_id, _ in request_arcs if staff_id == s.id)
+        if requested:
+            print(f"スタッフID {s.id} ({s.employment_type}): "
+                  f"希望 {requested}日, 採用 {accepted}日, "
+                  f"不採用目安 {rejection_targets.get(s.id, 0)}日")
+    
+    return required_staff, selected_staff_by_day
+
+
+def repair_consecutive_days(
+    selected_staff_by_day, staffs, valid_requests, last_day,
+    rules=DEFAULT_LABOR_RULES, carry_in=None, fixed=None
+):
+    """連勤上限を超えたスタッフの勤務日を、同じ日の希望者と入れ替える
+    
+    入れ替え相手がいない場合はその日の採用を取り消す。
+    前月末から続く連勤（carry_in）は0日以前の勤務日として数える。
+    固定したシフト（fixed）の日は勤務日に数えるが、入れ替えも取り消しもしない。
+    
+    Returns:
+        selected_staff_by_day: 修復後の day → 採用されたスタッフIDのリスト
+    """
+    fixed = fixed or {}
+    max_consecutive_days = rules.max_consecutive_days
+    work_days = defaultdict(set)
+    for day, staff_ids in selected_staff_by_day.items():
+        for staff_id in staff_ids:
+            work_days[staff_id].add(day)
+    for staff_id, run in (carry_in or {}).items():
+        work_days[staff_id].update(range(1 - run, 1))
+    for staff_id, day in fixed:
+        work_days[staff_id].add(day)
+    
+    swaps = 0
+    drops = 0
+    for s in staffs:
+        start_day = 1 - (carry_in or {}).get(s.id, 0)
+        while start_day <= last_day - max_consecutive_days:
+            window = range(start_day, start_day + max_consecutive_days + 1)
+            if not all(d in work_days[s.id] for d in window):
+                start_day += 1
                 continue
-                
-            adjusted_shifts.append(
-                Shiftresult(
-                    staff_id=staff_info['id'],
-                    year=year,
-                    month=month,
-                    day=day,
-                    start_time=staff_info['start_time'],
-                    end_time=staff_info['end_time']
-                )
-            )
             
-            # 不採用時間を集計
-            staff_id = staff_info['id']
-            rejection_times[staff_id][0] += staff_info['rejection_time'][0]
-            rejection_times[staff_id][1] += staff_info['rejection_time'][1]
+            movable = [
+                d for d in window if d >= 1 and (s.id, d) not in fixed
+            ]
+            if not movable:
+                start_day += 1
+                continue
             
-            print(f"  スタッフID {staff_id} "
-                  f"({'未成年' if staff_info['is_minor'] else '一般'}): "
-                  f"{staff_info['start_time']}時～{staff_info['end_time']}時 "
-                  f"(希望: {staff_info['req_start']}時～{staff_info['req_end']}時, "
-                  f"不採用: 早出{staff_info['rejection_time'][0]}時間, "
-                  f"早退{staff_info['rejection_time'][1]}時間)")
-    
-    # 不採用時間の均等化
-    total_rejection = sum(sum(times) for times in rejection_times.values())
-    if total_rejection > 0 and len(rejection_times) > 0:
-        avg_rejection = total_rejection / len(rejection_times)
-        print(f"\n不採用時間の均等化:")
-        print(f"総不採用時間: {total_rejection}時間")
-        print(f"平均不採用時間: {avg_rejection:.1f}時間/人")
-        
-        for staff_id, times in rejection_times.items():
-            print(f"  スタッフID {staff_id}: "
-                  f"早出{times[0]}時間, 早退{times[1]}時間 "
-                  f"(合計: {sum(times)}時間)")
+            # 窓の中で入れ替え可能な日を探す（中央の日から順に）
+            middle = start_day + max_consecutive_days // 2
+            replaced = False
+            for day in sorted(movable, key=lambda d: abs(d - middle)):
+                for other in staffs:
+                    req = valid_requests.get((other.id, day))
+                    if (other.id == s.id or not req or req.status == "X" or
+                            day in work_days[other.id] or
+                            run_length(work_days[other.id], day)
+                            > max_consecutive_days):
+                        continue
+                    selected_staff_by_day[day].remove(s.id)
+                    selected_staff_by_day[day].append(other.id)
+                    work_days[s.id].discard(day)
+                    work_days[other.id].add(day)
+                    swaps += 1
+                    replaced = True
+                    break
+                if replaced:
+                    break
+            if not replaced:
+                day = movable[-1]
+                selected_staff_by_day[day].remove(s.id)
+                work_days[s.id].discard(day)
+                drops += 1
+    
+    if swaps or drops:
+        print(f"連勤の修復: 入れ替え {swaps}件, 採用取り消し {drops}件")
+    return selected_staff_by_day
+
+
+def estimate_shift_hours(req, store, staff, rules):
+    """採用した場合の勤務時間の見込み（時間調整後の最長）"""
+    window = get_request_window(
+        req, store, rules.end_hour_limit(staff) is not None,
+        rules.minor_end_hour
+    )
+    if not window:
+        return 0
+    return min(window[1] - window[0], rules.shift_length_range()[1])
+
+
+def repair_weekly_hours(
+    selected_staff_by_day, store, staffs, valid_requests, last_day, rules,
+    carry_in=None, fixed=None
+):
+    """連続7日間の勤務時間の上限を超えたスタッフの勤務日を入れ替える
+    
+    勤務時間は時間調整後の最長の見込みで数える。入れ替え相手は同じ日の
+    希望者のうち、連勤上限と自分の週の上限に収まるスタッフから選び、
+    いなければその日の採用を取り消す。固定したシフト（fixed）は
+    その時間で数え、入れ替えも取り消しもしない。
+    
+    Returns:
+        selected_staff_by_day: 修復後の day → 採用されたスタッフIDのリスト
+    """
+    caps = {s.id: rules.weekly_cap(s) for s in staffs}
+    if all(cap is None for cap in caps.values()):
+        return selected_staff_by_day
+    
+    hours = defaultdict(dict)
+    work_days = defaultdict(set)
+    for day, staff_ids in selected_staff_by_day.items():
+        for staff_id in staff_ids:
+            work_days[staff_id].add(day)
+    for staff_id, run in (carry_in or {}).items():
+        work_days[staff_id].update(range(1 - run, 1))
+    staff_by_id = {s.id: s for s in staffs}
+    for staff_id, days in work_days.items():
+        if staff_id not in staff_by_id:
+            continue
+        for day in days:
+            if day >= 1:
+                hours[staff_id][day] = estimate_shift_hours(
+                    valid_requests.get((staff_id, day)), store,
+                    staff_by_id[staff_id], rules
+                )
+    fixed = fixed or {}
+    for (staff_id, day), (start, end) in fixed.items():
+        work_days[staff_id].add(day)
+        hours[staff_id][day] = end - start
+    
+    swaps = 0
+    drops = 0
+    for s in staffs:
+        cap = caps[s.id]
+        if cap is None:
+            continue
+        for start_day in range(1, last_day - WEEK_DAYS + 2):
+            window = range(start_day, start_day + WEEK_DAYS)
+            while sum(hours[s.id].get(d, 0) for d in window) > cap:
+                movable = [
+                    d for d in window
+                    if d in hours[s.id] and (s.id, d) not in fixed
+                ]
+                if not movable:
+                    break
+                # 勤務時間の長い日から手放す
+                day = max(movable, key=lambda d: (hours[s.id][d], d))
+                selected_staff_by_day[day].remove(s.id)
+                work_days[s.id].discard(day)
+                del hours[s.id][day]
+                replaced = False
+                for other in staffs:
+                    req = valid_requests.get((other.id, day))
+                    if (other.id == s.id or not req or req.status == "X" or
+                            day in work_days[other.id] or
+                            run_length(work_days[other.id], day)
+                            > rules.max_consecutive_days):
+                        continue
+                    other_hours = estimate_shift_hours(
+                        req, store, other, rules
+                    )
+                    if exceeds_weekly_cap(
+                        hours[other.id], day, other_hours, caps[other.id]
+                    ):
+                        continue
+                    selected_staff_by_day[day].append(other.id)
+                    work_days[other.id].add(day)
+                    hours[other.id][day] = other_hours
+                    replaced = True
+                    break
+                if replaced:
+                    swaps += 1
+                else:
+                    drops += 1
     
-    return adjusted_shifts, rejection_times 
\ No newline at end of file
+    if swaps or drops:
+        print(f"週の勤務時間の修復: 入れ替え {swaps}件, 採用取り消し {drops}件")
+    return selected_staff_by_day
@@ -0,0 +1,422 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from sqlalchemy.orm import Session
+from models import ShiftGenerationJob
+from .shift_generator import save_shift_results
+from .shift_snapshot import load_snapshot
+from .shift_supervisor import (
+    cancel_generation,
+    generation_job_key,
+    run_cached_generation
+)
+
+
+# 実行中のジョブが生存を知らせる間隔（秒）
+HEARTBEAT_INTERVAL = float(os.getenv("SHIFT_JOB_HEARTBEAT_SECONDS", "10"))
+
+# この時間ハートビートがなければワーカーが落ちたとみなす（秒）
+STALE_AFTER = float(os.getenv("SHIFT_JOB_STALE_SECONDS", "60"))
+
+# 1ジョブあたりの既定の実行回数の上限
+MAX_ATTEMPTS = 3
+
+# 再試行までの待ち時間の基準（秒）。失敗するたびに倍にする
+RETRY_BACKOFF = 30.0
+
+# キューが空のときに次を確かめるまでの待ち時間（秒）
+POLL_INTERVAL = float(os.getenv("SHIFT_JOB_POLL_SECONDS", "5"))
+
+# 行ロックが使えないDBで、他のワーカーに取られた場合に試す候補の数
+CLAIM_CANDIDATES = 5
+
+# SELECT ... FOR UPDATE SKIP LOCKED が使えるDB
+SKIP_LOCKED_DIALECTS = ("mysql", "mariadb", "postgresql")
+
+
+def supports_skip_locked(db: Session) -> bool:
+    """DBが SELECT ... FOR UPDATE SKIP LOCKED を使えるか"""
+    return db.get_bind().dialect.name in SKIP_LOCKED_DIALECTS
+
+
+def enqueue_generation_job(
+    db: Session,
+    store_id: int,
+    year: int,
+    month: int,
+    strategy: str = "greedy",
+    time_limit: float = 30.0,
+    warm_start: bool = False,
+    max_attempts: int = MAX_ATTEMPTS
+) -> ShiftGenerationJob:
+    """シフト生成ジョブをキューに積む
+
+    同じ店舗・年月のジョブが待機中か実行中なら、新しく積まずにそれを返す。
+    """
+    job = db.query(ShiftGenerationJob).filter(
+        ShiftGenerationJob.store_id == store_id,
+        ShiftGenerationJob.year == year,
+        ShiftGenerationJob.month == month,
+        ShiftGenerationJob.status.in_(("queued", "running"))
+    ).first()
+    if job:
+        return job
+    job = ShiftGenerationJob(
+        store_id=store_id,
+        year=year,
+        month=month,
+        strategy=strategy,
+        time_limit=time_limit,
+        warm_start=warm_start,
+        status="queued",
+        attempts=0,
+        max_attempts=max_attempts,
+        available_at=datetime.now()
+    )
+    db.add(job)
+    db.commit()
+    return job
+
+
+def claim_job(db: Session, worker_id: str) -> Optional[ShiftGenerationJob]:
+    """実行可能なジョブを1つ取り出し、このワーカーの実行中にする
+
+    MySQL等では SELECT ... FOR UPDATE SKIP LOCKED で他のワーカーが
+    ロック中の行を飛ばす。SQLiteなど行ロックのないDBでは、状態が
+    queued のままの場合だけ更新する条件付きUPDATEで取り合いを防ぐ。
+
+    Returns:
+        job: 取り出したジョブ（なければNone）
+    """
+    now = datetime.now()
+    locking = supports_skip_locked(db)
+    query = db.query(ShiftGenerationJob.id).filter(
+        ShiftGenerationJob.status == "queued",
+        ShiftGenerationJob.available_at <= now
+    ).order_by(ShiftGenerationJob.available_at, ShiftGenerationJob.id)
+    if locking:
+        query = query.with_for_update(skip_locked=True)
+    candidate_ids = [
+        row.id for row in query.limit(1 if locking else CLAIM_CANDIDATES)
+    ]
+
+    for job_id in candidate_ids:
+        claimed = db.query(ShiftGenerationJob).filter(
+            ShiftGenerationJob.id == job_id,
+            ShiftGenerationJob.status == "queued"
+        ).update({
+            ShiftGenerationJob.status: "running",
+            ShiftGenerationJob.worker_id: worker_id,
+            ShiftGenerationJob.attempts: ShiftGenerationJob.attempts + 1,
+            ShiftGenerationJob.started_at: now,
+            ShiftGenerationJob.heartbeat_at: now,
+            ShiftGenerationJob.error: None
+        }, synchronize_session=False)
+        if claimed:
+            db.commit()
+            return db.query(ShiftGenerationJob).filter(
+                ShiftGenerationJob.id == job_id
+            ).first()
+    # 候補がない場合もロックを解放する
+    db.commit()
+    return None
+
+
+def touch_heartbeat(db: Session, job_id: int, worker_id: str) -> bool:
+    """実行中のジョブのハートビートを更新する
+
+    Returns:
+        まだこのワーカーのジョブならTrue（再割り当てされていればFalse）
+    """
+    updated = db.query(ShiftGenerationJob).filter(
+        ShiftGenerationJob.id == job_id,
+        ShiftGenerationJob.worker_id == worker_id,
+        ShiftGenerationJob.status == "running"
+    ).update(
+        {ShiftGenerationJob.heartbeat_at: datetime.now()},
+        synchronize_session=False
+    )
+    db.commit()
+    return bool(updated)
+
+
+def start_heartbeat(
+    session_factory,
+    job_id: int,
+    worker_id: str,
+    job_key: str,
+    interval: float = HEARTBEAT_INTERVAL
+) -> threading.Event:
+    """ジョブの実行中、別スレッドで定期的にハートビートを送る
+
+    ジョブが他のワーカーに再割り当てされていたら生成を中止する。
+
+    Returns:
+        stop: セットするとハートビートを止めるイベント
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            db = session_factory()
+            try:
+                if not touch_heartbeat(db, job_id, worker_id):
+                    print(f"ジョブ{job_id}は他のワーカーに再割り当てされました")
+                    cancel_generation(job_key)
+                    return
+            except Exception as e:
+                db.rollback()
+                print(f"ジョブ{job_id}のハートビートに失敗しました: {e}")
+            finally:
+                db.close()
+
+    threading.Thread(target=beat, daemon=True).start()
+    return stop
+
+
+def fail_job(
+    db: Session,
+    job_id: int,
+    worker_id: str,
+    error: str,
+    retry: bool = True
+) -> Optional[str]:
+    """失敗したジョブを再試行待ちに戻すか、失敗として終える
+
+    実行回数が上限に達していなければ、RETRY_BACKOFF × 2^(回数-1) 秒後に
+    再び取り出せるようにする。
+
+    Returns:
+        status: 更新後の状態（このワーカーのジョブでなければNone）
+    """
+    job = db.query(ShiftGenerationJob).filter(
+        ShiftGenerationJob.id == job_id,
+        ShiftGenerationJob.worker_id == worker_id,
+        ShiftGenerationJob.status == "running"
+    ).first()
+    if job is None:
+        return None
+    now = datetime.now()
+    job.error = error
+    if retry and job.attempts < job.max_attempts:
+        job.status = "queued"
+        job.worker_id = None
+        job.available_at = now + timedelta(
+            seconds=RETRY_BACKOFF * 2 ** (job.attempts - 1)
+        )
+    else:
+        job.status = "failed"
+        job.finished_at = now
+    db.commit()
+    return job.status
+
+
+def requeue_stale_jobs(db: Session, stale_after: float = STALE_AFTER) -> int:
+    """ハートビートが途絶えた実行中のジョブを待機中に戻す
+
+    実行回数が上限に達したジョブは失敗として終える。
+
+    Returns:
+        count: 待機中に戻すか失敗にしたジョブの数
+    """
+    now = datetime.now()
+    stale = (
+        (ShiftGenerationJob.status == "running")
+        & (ShiftGenerationJob.heartbeat_at < now - timedelta(seconds=stale_after))
+    )
+    requeued = db.query(ShiftGenerationJob).filter(
+        stale, ShiftGenerationJob.attempts < ShiftGenerationJob.max_attempts
+    ).update({
+        ShiftGenerationJob.status: "queued",
+        ShiftGenerationJob.worker_id: None,
+        ShiftGenerationJob.available_at: now,
+        ShiftGenerationJob.error: "ワーカーの応答が途絶えたため再実行します"
+    }, synchronize_session=False)
+    failed = db.query(ShiftGenerationJob).filter(
+        stale, ShiftGenerationJob.attempts >= ShiftGenerationJob.max_attempts
+    ).update({
+        ShiftGenerationJob.status: "failed",
+        ShiftGenerationJob.finished_at: now,
+        ShiftGenerationJob.error: "ワーカーの応答が途絶えました"
+    }, synchronize_session=False)
+    db.commit()
+    if requeued or failed:
+        print(f"応答のないジョブ: 再実行 {requeued}件, 失敗 {failed}件")
+    return requeued + failed
+
+
+def run_job(session_factory, job_id: int, worker_id: str) -> Optional[str]:
+    """取り出したジョブを監視付きの子プロセスで実行し、結果を書き戻す
+
+    書き戻しはジョブがまだこのワーカーのものである場合だけ行い、
+    シフトの保存とジョブの完了を1つのトランザクションでコミットする。
+
+    Returns:
+        status: ジョブの最終的な状態（他のワーカーに移っていればNone）
+    """
+    db = session_factory()
+    try:
+        job = db.query(ShiftGenerationJob).filter(
+            ShiftGenerationJob.id == job_id
+        ).first()
+        store_id, year, month = job.store_id, job.year, job.month
+        strategy, time_limit = job.strategy, job.time_limit
+        try:
+            snapshot = load_snapshot(
+                db, store_id, year, month, warm_start=job.warm_start
+            )
+        except ValueError as e:
+            # 入力の誤りは再試行しても変わらない
+            return fail_job(db, job_id, worker_id, str(e), retry=False)
+    finally:
+        db.close()
+
+    job_key = generation_job_key(store_id, year, month)
+    cache_db = session_factory()
+    print(f"ジョブ{job_id}を開始しました: 店舗{store_id} {year}年{month}月 "
+          f"({strategy}, {time_limit}秒)")
+    heartbeat = start_heartbeat(session_factory, job_id, worker_id, job_key)
+    try:
+        results = run_cached_generation(
+            cache_db, snapshot, job_key, strategy=strategy,
+            time_limit=time_limit
+        )
+    except ValueError as e:
+        heartbeat.set()
+        cache_db.close()
+        db = session_factory()
+        try:
+            status = fail_job(db, job_id, worker_id, str(e))
+        finally:
+            db.close()
+        print(f"ジョブ{job_id}が失敗しました: {e} ({status})")
+        return status
+    except BaseException:
+        cache_db.close()
+        raise
+    finally:
+        heartbeat.set()
+
+    # キャッシュへの保存は結果の保存と同じトランザクションでコミットする
+    db = cache_db
+    try:
+        query = db.query(ShiftGenerationJob).filter(
+            ShiftGenerationJob.id == job_id,
+            ShiftGenerationJob.worker_id == worker_id,
+            ShiftGenerationJob.status == "running"
+        )
+        if supports_skip_locked(db):
+            query = query.with_for_update()
+        job = query.first()
+        if job is None:
+            print(f"ジョブ{job_id}は他のワーカーに移ったため結果を破棄します")
+            return None
+        job.status = "succeeded"
+        job.finished_at = datetime.now()
+        job.error = None
+        counts = save_shift_results(
+            db, results, year, month,
+            [s.id for s in snapshot.employees + snapshot.staffs]
+        )
+        job.counts = json.dumps(counts)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        status = fail_job(db, job_id, worker_id, f"結果の保存に失敗しました: {e}")
+        print(f"ジョブ{job_id}の結果の保存に失敗しました: {e} ({status})")
+        return status
+    finally:
+        db.close()
+    print(f"ジョブ{job_id}が完了しました: {len(results)}件")
+    return "succeeded"
+
+
+def run_worker(
+    session_factory,
+    worker_id: str = None,
+    poll_interval: float = POLL_INTERVAL,
+    stop_event: threading.Event = None,
+    drain: bool = False,
+    max_jobs: int = None
+) -> Dict[str, int]:
+    """キューからジョブを取り出して順に実行する
+
+    ワーカーはいくつ起動してもよい。取り出す前に、応答の途絶えた
+    ワーカーのジョブを待機中に戻す。
+
+    Args:
+        session_factory: DBセッションを作る関数
+        worker_id: ワーカーの識別子（省略時は ホスト名:pid）
+        poll_interval: キューが空のときの待ち時間（秒）
+        stop_event: セットされたら実行中のジョブの後で終了する
+        drain: Trueの場合はキューが空になったら終了する
+        max_jobs: 実行するジョブの数の上限
+
+    Returns:
+        counts: 最終的な状態ごとのジョブ数
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    stop_event = stop_event or threading.Event()
+    counts = {}
+    processed = 0
+    print(f"ワーカーを開始しました: {worker_id}")
+    while not stop_event.is_set():
+        if max_jobs is not None and processed >= max_jobs:
+            break
+        db = session_factory()
+        try:
+            requeue_stale_jobs(db)
+            job = claim_job(db, worker_id)
+            job_id = job.id if job else None
+        finally:
+            db.close()
+        if job_id is None:
+            if drain:
+                break
+            stop_event.wait(poll_interval)
+            continue
+        status = run_job(session_factory, job_id, worker_id) or "lost"
+        counts[status] = counts.get(status, 0) + 1
+        processed += 1
+    print(f"ワーカーを終了しました: {worker_id} {counts}")
+    return counts
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m shift.shift_jobs",
+        description="シフト生成ジョブのキューを処理するワーカー"
+    )
+    parser.add_argument("--worker-id", default=None)
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL)
+    parser.add_argument(
+        "--drain", action="store_true", help="キューが空になったら終了する"
+    )
+    parser.add_argument("--max-jobs", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from database import SessionLocal
+
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        print("終了要求を受け取りました。実行中のジョブの後で終了します")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    run_worker(
+        SessionLocal, worker_id=args.worker_id,
+        poll_interval=args.poll_interval, stop_event=stop_event,
+        drain=args.drain, max_jobs=args.max_jobs
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
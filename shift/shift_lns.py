@@ -0,0 +1,356 @@
+import contextlib
+import io
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+from ortools.sat.python import cp_model
+from models import Staff, Store, ShiftRequest
+from .shift_optimizer import (
+    assign_shift_intervals,
+    add_fairness_penalties,
+    run_solver
+)
+from .shift_progress import report_solution, stop_requested, suppress_solutions
+from .shift_rules import (
+    DEFAULT_LABOR_RULES, LaborRules, WEEK_DAYS, check_labor_rules
+)
+
+# 目的関数の重み（区間変数モデルと同じ）
+SHORTAGE_WEIGHT = 20
+EXCESS_WEIGHT = 5
+FAIRNESS_WEIGHT = 10
+# 労務ルール違反1件あたりの重み（CP-SATでは制約だが、貪欲法の解では起こり得る）
+LABOR_RULE_WEIGHT = 100
+
+
+def score_schedule(
+    intervals: Dict[Tuple[int, int], Tuple[int, int]],
+    required_staff: Dict[Tuple[int, int], int],
+    target_days: Dict[int, int],
+    last_day: int,
+    staffs: List[Staff],
+    rules: LaborRules = DEFAULT_LABOR_RULES,
+    carry_in: Dict[int, int] = None,
+    fixed: Set[Tuple[int, int]] = None
+) -> int:
+    """バイトのシフトをCP-SATと同じ重みで評価する（小さいほど良い）
+
+    労務ルールは solve_neighbourhood が制約として課すもの（前月からの
+    連勤を含む連勤上限・週の勤務時間・1日の勤務時間・未成年の終業時刻）を
+    check_labor_rules で数え、違反1件ごとにペナルティを加える。
+
+    Args:
+        intervals: (staff_id, day) → (開始時間, 終了時間)
+        required_staff: (day, hour) → バイトの必要人数
+        target_days: staff_id → 採用目標日数
+        last_day: 月末日
+        staffs: 労務ルールを調べるバイトスタッフ
+        rules: 労務ルール
+        carry_in: staff_id → 前月末日までの連続勤務日数
+        fixed: 固定したセルの (staff_id, day)。採用日数の公平性には数えない
+
+    Returns:
+        score: 過不足・公平性・労務ルール違反のペナルティの合計
+    """
+    headcount = defaultdict(int)
+    work_days = defaultdict(set)
+    for (staff_id, day), (start, end) in intervals.items():
+        work_days[staff_id].add(day)
+        for hour in range(start, end):
+            headcount[(day, hour)] += 1
+
+    score = 0
+    for key, required in required_staff.items():
+        score += SHORTAGE_WEIGHT * max(0, required - headcount[key])
+        score += EXCESS_WEIGHT * max(0, headcount[key] - required)
+    fixed = fixed or set()
+    for staff_id, target in (target_days or {}).items():
+        accepted = sum(
+            1 for day in work_days[staff_id] if (staff_id, day) not in fixed
+        )
+        score += FAIRNESS_WEIGHT * abs(accepted - target)
+    violations = check_labor_rules(
+        intervals, staffs, rules, last_day, carry_in=carry_in
+    )
+    score += LABOR_RULE_WEIGHT * len(violations)
+    return score
+
+
+def count_shortage_hours(
+    intervals: Dict[Tuple[int, int], Tuple[int, int]],
+    required_staff: Dict[Tuple[int, int], int]
+) -> int:
+    """必要人数に対して不足している延べ時間"""
+    headcount = defaultdict(int)
+    for (_, day), (start, end) in intervals.items():
+        for hour in range(start, end):
+            headcount[(day, hour)] += 1
+    return sum(
+        max(0, required - headcount[key])
+        for key, required in required_staff.items()
+    )
+
+
+def count_run(days: set, day: int, step: int) -> int:
+    """day の隣から step 方向に連続する勤務日数を数える"""
+    count = 0
+    d = day + step
+    while d in days:
+        count += 1
+        d += step
+    return count
+
+
+def select_neighbourhood(
+    rng: random.Random,
+    staffs: List[Staff],
+    last_day: int,
+    iteration: int,
+    day_window: int = 3,
+    cluster_size: int = 8
+) -> Tuple[str, List[Staff], int, int]:
+    """解き直す近傍（スタッフの集合と日の範囲）を選ぶ
+
+    数日間の全スタッフ・数人の1か月・同じスキルのスタッフの1週間を
+    順番に使う。
+
+    Returns:
+        (近傍の種類, 対象スタッフ, 開始日, 終了日)
+    """
+    kind = ("days", "staff", "skill")[iteration % 3]
+    if kind == "days":
+        window = min(day_window, last_day)
+        first_day = rng.randint(1, last_day - window + 1)
+        return kind, list(staffs), first_day, first_day + window - 1
+    if kind == "staff":
+        cluster = rng.sample(list(staffs), min(cluster_size, len(staffs)))
+        return kind, cluster, 1, last_day
+
+    skill_groups = defaultdict(list)
+    for s in staffs:
+        skill_groups[(s.kitchen_a, s.kitchen_b)].append(s)
+    group = skill_groups[rng.choice(sorted(skill_groups))]
+    cluster = rng.sample(group, min(cluster_size * 2, len(group)))
+    window = min(7, last_day)
+    first_day = rng.randint(1, last_day - window + 1)
+    return kind, cluster, first_day, first_day + window - 1
+
+
+def solve_neighbourhood(
+    store: Store,
+    free_staffs: List[Staff],
+    requests: Dict[Tuple[int, int], ShiftRequest],
+    required_staff: Dict[Tuple[int, int], int],
+    intervals: Dict[Tuple[int, int], Tuple[int, int]],
+    target_days: Dict[int, int],
+    first_day: int,
+    last_day: int,
+    time_limit: float,
+    num_workers: int = 8,
+    month_carry_in: Dict[int, int] = None,
+    rules: LaborRules = DEFAULT_LABOR_RULES,
+    fixed: Set[Tuple[int, int]] = None
+) -> Optional[Dict[Tuple[int, int], Tuple[int, int]]]:
+    """近傍内のシフトだけをCP-SATで解き直す
+
+    近傍外の勤務は固定し、必要人数からその分を差し引いた残りと、
+    近傍の前後の連勤・週の勤務時間・期間外の勤務日数を境界条件として与える。
+    month_carry_in（前月末日までの連続勤務日数）は0日以前の勤務として数える。
+    fixed（固定したセル）の intervals の勤務は近傍内でも近傍外と同じく動かさない。
+
+    Returns:
+        近傍を解き直した後の intervals（解なしの場合はNone）
+    """
+    free_ids = {s.id for s in free_staffs}
+    in_window = range(first_day, last_day + 1)
+    fixed = fixed or set()
+
+    def is_free(key):
+        return (key[0] in free_ids and first_day <= key[1] <= last_day and
+                key not in fixed)
+
+    # 近傍外の勤務で満たされている分を差し引いた必要人数
+    residual = {
+        key: required for key, required in required_staff.items()
+        if first_day <= key[0] <= last_day
+    }
+    for (staff_id, day), (start, end) in intervals.items():
+        if is_free((staff_id, day)) or not first_day <= day <= last_day:
+            continue
+        for hour in range(start, end):
+            if (day, hour) in residual:
+                residual[(day, hour)] -= 1
+    residual = {key: max(0, value) for key, value in residual.items()}
+
+    work_days = defaultdict(set)
+    for staff_id, day in intervals:
+        work_days[staff_id].add(day)
+    for staff_id, run in (month_carry_in or {}).items():
+        work_days[staff_id].update(range(1 - run, 1))
+    max_days = rules.max_consecutive_days
+    carry_in = {
+        s.id: min(max_days, count_run(work_days[s.id], first_day, -1))
+        for s in free_staffs
+    }
+    carry_out = {
+        s.id: min(max_days, count_run(work_days[s.id], last_day, 1))
+        for s in free_staffs
+    }
+    # 近傍の前後1週間の確定済みの勤務時間（週の勤務時間の境界条件）
+    fixed_hours = {
+        (staff_id, day): end - start
+        for (staff_id, day), (start, end) in intervals.items()
+        if staff_id in free_ids and (
+            first_day - WEEK_DAYS < day < first_day
+            or last_day < day < last_day + WEEK_DAYS
+            or (staff_id, day) in fixed
+        )
+    }
+    pinned_days = {
+        key for key in intervals
+        if key in fixed and key[0] in free_ids and key[1] in in_window
+    }
+    window_targets = {}
+    for s in free_staffs:
+        if s.id not in (target_days or {}):
+            continue
+        outside = sum(
+            1 for d in work_days[s.id]
+            if d >= 1 and d not in in_window and (s.id, d) not in fixed
+        )
+        window_targets[s.id] = max(0, target_days[s.id] - outside)
+
+    model = cp_model.CpModel()
+    objective_terms = []
+    shortage_terms = []
+    works, starts, ends = assign_shift_intervals(
+        model, free_staffs,
+        {key: req for key, req in requests.items() if key not in fixed},
+        residual, store, last_day,
+        first_day=first_day, objective_terms=objective_terms,
+        carry_in=carry_in, carry_out=carry_out, rules=rules,
+        fixed_hours=fixed_hours, fixed_days=pinned_days,
+        shortage_terms=shortage_terms
+    )
+    staff_vars = defaultdict(list)
+    for (staff_id, _), var in works.items():
+        staff_vars[staff_id].append(var)
+    add_fairness_penalties(model, staff_vars, window_targets, objective_terms)
+
+    # 現在の解をヒントとして与える
+    for key, work in works.items():
+        current = intervals.get(key)
+        model.AddHint(work, 1 if current else 0)
+        if current:
+            model.AddHint(starts[key], current[0])
+            model.AddHint(ends[key], current[1])
+
+    solver = cp_model.CpSolver()
+    status = run_solver(
+        model, solver, objective_terms, time_limit, num_workers,
+        f"近傍 {first_day}日～{last_day}日",
+        shortage_terms=shortage_terms
+    )
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return None
+
+    updated = {
+        key: value for key, value in intervals.items() if not is_free(key)
+    }
+    for key, work in works.items():
+        if solver.Value(work):
+            updated[key] = (solver.Value(starts[key]), solver.Value(ends[key]))
+    return updated
+
+
+def improve_with_lns(
+    store: Store,
+    staffs: List[Staff],
+    requests: Dict[Tuple[int, int], ShiftRequest],
+    required_staff: Dict[Tuple[int, int], int],
+    initial: Dict[Tuple[int, int], Tuple[int, int]],
+    target_days: Dict[int, int],
+    last_day: int,
+    time_limit: float = 30.0,
+    sub_time_limit: float = 2.0,
+    seed: int = 0,
+    num_workers: int = 8,
+    carry_in: Dict[int, int] = None,
+    rules: LaborRules = DEFAULT_LABOR_RULES,
+    fixed: Set[Tuple[int, int]] = None
+) -> Tuple[Dict[Tuple[int, int], Tuple[int, int]], List[Tuple[float, int, str]]]:
+    """初期解から近傍の解き直しを繰り返して改善する（大規模店舗向け）
+
+    Args:
+        store: 店舗情報
+        staffs: バイトスタッフリスト
+        requests: (staff_id, day) → ShiftRequest
+        required_staff: (day, hour) → バイトの必要人数
+        initial: 初期解 (staff_id, day) → (開始時間, 終了時間)
+        target_days: staff_id → 採用目標日数
+        last_day: 月末日
+        time_limit: 全体の探索時間の上限（秒）
+        sub_time_limit: 近傍1回あたりの探索時間の上限（秒）
+        seed: 近傍選択の乱数シード
+        num_workers: CP-SATの探索スレッド数
+        carry_in: staff_id → 前月末日までの連続勤務日数
+        rules: 労務ルール
+        fixed: 固定したセルの (staff_id, day)。initial に含め、どの近傍でも
+            動かさない
+
+    Returns:
+        best: 改善後の解
+        curve: 改善の推移 [(経過秒, スコア, 近傍)]
+    """
+    print("\n=== 大近傍探索 (LNS) ===")
+    started = time.perf_counter()
+    deadline = started + time_limit
+    rng = random.Random(seed)
+
+    best = dict(initial)
+    best_score = score_schedule(
+        best, required_staff, target_days, last_day, staffs, rules,
+        carry_in=carry_in, fixed=fixed
+    )
+    curve = [(0.0, best_score, "初期解")]
+    print(f"初期解のスコア: {best_score}")
+
+    iteration = 0
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0.1 or stop_requested():
+            break
+        kind, free_staffs, first_day, end_day = select_neighbourhood(
+            rng, staffs, last_day, iteration
+        )
+        iteration += 1
+        # 近傍ごとのソルバーログと改善解の通知は量が多いため捨てる
+        with contextlib.redirect_stdout(io.StringIO()), suppress_solutions():
+            candidate = solve_neighbourhood(
+                store, free_staffs, requests, required_staff, best,
+                target_days, first_day, end_day,
+                time_limit=min(sub_time_limit, remaining),
+                num_workers=num_workers, month_carry_in=carry_in,
+                rules=rules, fixed=fixed
+            )
+        if candidate is None:
+            continue
+        score = score_schedule(
+            candidate, required_staff, target_days, last_day, staffs, rules,
+            carry_in=carry_in, fixed=fixed
+        )
+        if score < best_score:
+            best, best_score = candidate, score
+            elapsed = time.perf_counter() - started
+            label = f"{kind} {len(free_staffs)}人 {first_day}日～{end_day}日"
+            curve.append((round(elapsed, 2), score, label))
+            print(f"  {elapsed:6.2f}秒: スコア {score} ({label})")
+            report_solution(
+                "LNS", score, elapsed=round(elapsed, 2),
+                shortage_hours=count_shortage_hours(best, required_staff)
+            )
+
+    print(f"反復回数: {iteration}回, 最終スコア: {best_score} "
+          f"(初期解から {curve[0][1] - best_score} 改善)")
+    return best, curve
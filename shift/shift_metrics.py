@@ -0,0 +1,91 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Set, Tuple
+from models import Staff, Store, ShiftRequest, Shiftresult
+from .shift_validator import get_hourly_demand
+
+
+def compute_schedule_metrics(
+    results: List[Shiftresult],
+    store: Store,
+    staffs: List[Staff],
+    valid_requests: Dict[Tuple[int, int], ShiftRequest],
+    holidays: Set[datetime.date],
+    year: int,
+    month: int,
+    last_day: int
+) -> Dict:
+    """生成されたシフトの充足・不採用・勤務時間の指標を計算する
+
+    Args:
+        results: シフト結果（社員を含む）
+        store: 店舗情報
+        staffs: バイトスタッフリスト（不採用の集計対象）
+        valid_requests: 有効なシフト希望
+        holidays: 祝日セット
+        year: 年
+        month: 月
+        last_day: 月末日
+
+    Returns:
+        metrics: 指標の辞書
+    """
+    demand = get_hourly_demand(store, holidays, year, month, last_day)
+    headcount = defaultdict(int)
+    staff_hours = defaultdict(int)
+    for r in results:
+        staff_hours[r.staff_id] += r.end_time - r.start_time
+        for hour in range(r.start_time, r.end_time):
+            headcount[(r.day, hour)] += 1
+
+    total_demand = sum(demand.values())
+    shortage_hours = sum(
+        max(0, required - headcount[key])
+        for key, required in demand.items()
+    )
+    excess_hours = sum(
+        max(0, headcount[key] - required)
+        for key, required in demand.items()
+    )
+    short_slots = sum(
+        1 for key, required in demand.items()
+        if headcount[key] < required
+    )
+
+    worked = {(r.staff_id, r.day) for r in results}
+    requested_days = 0
+    rejected_days = 0
+    for s in staffs:
+        for day in range(1, last_day + 1):
+            req = valid_requests.get((s.id, day))
+            if not req or req.status in ("X", ""):
+                continue
+            requested_days += 1
+            if (s.id, day) not in worked:
+                rejected_days += 1
+
+    part_time_ids = {s.id for s in staffs}
+    part_time_hours = [staff_hours[s.id] for s in staffs]
+    return {
+        "shift_count": len(results),
+        "total_hours": sum(staff_hours.values()),
+        "part_time_hours": sum(part_time_hours),
+        "employee_hours": sum(
+            h for staff_id, h in staff_hours.items()
+            if staff_id not in part_time_ids
+        ),
+        "max_part_time_hours": max(part_time_hours, default=0),
+        "min_part_time_hours": min(part_time_hours, default=0),
+        "demand_hours": total_demand,
+        "shortage_hours": shortage_hours,
+        "excess_hours": excess_hours,
+        "short_slots": short_slots,
+        "coverage_rate": (
+            1 - shortage_hours / total_demand if total_demand else 1.0
+        ),
+        "requested_days": requested_days,
+        "rejected_days": rejected_days,
+        "rejection_rate": (
+            rejected_days / requested_days if requested_days else 0.0
+        ),
+    }
@@ -1,109 +1,248 @@
 from typing import Dict, List, Tuple, Set
+from collections import defaultdict
 from datetime import datetime
 from ortools.sat.python import cp_model
 from models import Staff, Store, ShiftPattern, ShiftRequest
+from .shift_progress import solve_with_progress
+from .shift_rules import DEFAULT_LABOR_RULES, WEEK_DAYS, LaborRules
 from .shift_validator import get_day_type
 
 
-def optimize_time_allocation(
+def can_work_pattern(
+    req: ShiftRequest,
+    pattern: ShiftPattern,
+    store: Store,
+    end_hour_limit: int = None
+) -> bool:
+    """シフト希望に対してパターンが割り当て可能か判定する
+
+    時間指定の希望には、希望時間帯の中に収まるパターンだけを割り当てる。
+    end_hour_limit を指定した場合（未成年バイト）、それより遅く終わる
+    パターンは割り当てない。
+    """
+    if req is None or req.status in ("X", "", None):
+        return False
+    if end_hour_limit is not None and pattern.end_time > end_hour_limit:
+        return False
+    if req.status == "O":
+        return (pattern.start_time >= store.open_hours and
+                pattern.end_time <= store.close_hours)
+    if req.status == "time":
+        return (req.start_time <= pattern.start_time and
+                pattern.end_time <= req.end_time)
+    return False
+
+
+def create_pattern_variables(
     model: cp_model.CpModel,
     staffs: List[Staff],
     patterns: List[ShiftPattern],
     requests: Dict[Tuple[int, int], ShiftRequest],
     store: Store,
-    last_day: int
-) -> Tuple[Dict, Dict]:
-    """時間配分の最適化を行う
+    days: range,
+    rules: LaborRules = DEFAULT_LABOR_RULES
+) -> Tuple[Dict, Dict, Dict]:
+    """勤務可能な組み合わせに限ってパターン・時間帯・勤務日の変数を作成する
+    
+    希望のない日や"X"の日、希望時間帯に収まらないパターン、
+    未成年バイトの終業時刻の上限を超えるパターンには変数自体を
+    作らないため、== 0 の制約も不要になる。
     
     Returns:
-        x: (staff_id, day, pattern_id) → BoolVar
-        y: (staff_id, day, hour) → BoolVar
+        x: (staff_id, day, pattern_id) → BoolVar（勤務可能な組のみ）
+        y: (staff_id, day, hour) → BoolVar（いずれかのパターンが覆う時間のみ）
+        works: (staff_id, day) → 勤務有無（1日1パターンなのでxの和）
     """
-    print("\n=== 時間配分の最適化 ===")
-    
-    # 変数定義
-    x = {}  # (staff_id, day, pattern_id) → BoolVar
+    x = {}
+    y = {}
+    works = {}
+    hours = range(store.open_hours, store.close_hours)
     for s in staffs:
-        for day in range(1, last_day + 1):
-            for p in patterns:
+        end_hour_limit = rules.end_hour_limit(s)
+        for day in days:
+            req = requests.get((s.id, day))
+            feasible = [
+                p for p in patterns
+                if can_work_pattern(req, p, store, end_hour_limit)
+            ]
+            if not feasible:
+                continue
+
+            for p in feasible:
                 x[(s.id, day, p.id)] = model.NewBoolVar(
                     f"x_s{s.id}_d{day}_p{p.id}"
                 )
 
-    y = {}  # (staff_id, day, hour) → BoolVar
-    for s in staffs:
-        for day in range(1, last_day + 1):
-            for hour in range(store.open_hours, store.close_hours):
+            # 1日1パターン制約
+            pattern_vars = [x[(s.id, day, p.id)] for p in feasible]
+            model.Add(sum(pattern_vars) <= 1)
+            works[(s.id, day)] = sum(pattern_vars)
+
+            # 時間帯制約
+            for hour in hours:
+                covering = [
+                    x[(s.id, day, p.id)] for p in feasible
+                    if p.start_time <= hour < p.end_time
+                ]
+                if not covering:
+                    continue
                 y[(s.id, day, hour)] = model.NewBoolVar(
                     f"y_s{s.id}_d{day}_h{hour}"
                 )
+                model.AddMaxEquality(y[(s.id, day, hour)], covering)
 
-    # 1. 連勤制約
-    print("連勤制約の設定中...")
-    max_consecutive_days = 5
-    for s in staffs:
-        for start_day in range(1, last_day - max_consecutive_days + 2):
-            work_vars = []
-            for day in range(start_day, start_day + max_consecutive_days):
-                work_var = model.NewBoolVar(f"work_s{s.id}_d{day}")
-                pattern_vars = [x[(s.id, day, p.id)] for p in patterns]
-                if pattern_vars:
-                    model.AddMaxEquality(work_var, pattern_vars)
-                work_vars.append(work_var)
-            if work_vars:
-                model.Add(sum(work_vars) <= max_consecutive_days)
-
-    # 2. 時間帯制約
-    print("時間帯制約の設定中...")
+    print(
+        f"変数数: x={len(x)} / {len(staffs) * len(days) * len(patterns)}, "
+        f"y={len(y)} / {len(staffs) * len(days) * len(hours)}"
+    )
+    return x, y, works
+
+
+def add_consecutive_days_constraint(
+    model: cp_model.CpModel,
+    works: Dict,
+    staffs: List[Staff],
+    first_day: int,
+    last_day: int,
+    carry_in: Dict[int, int] = None,
+    carry_out: Dict[int, int] = None,
+    max_consecutive_days: int = DEFAULT_LABOR_RULES.max_consecutive_days,
+    fixed_days: Set[Tuple[int, int]] = None
+) -> None:
+    """連勤制約を追加する（期間外の確定済み勤務も境界条件として考慮）
+    
+    Args:
+        works: (staff_id, day) → 勤務有無
+        carry_in: staff_id → first_day直前までの連続勤務日数
+        carry_out: staff_id → last_day直後からの連続勤務日数
+        fixed_days: 期間内で勤務が確定している (staff_id, day)（固定したセル）
+    """
+    if carry_in is None:
+        carry_in = {}
+    if carry_out is None:
+        carry_out = {}
+    fixed_days = fixed_days or set()
     for s in staffs:
-        for day in range(1, last_day + 1):
-            for hour in range(store.open_hours, store.close_hours):
-                covering = [
-                    p for p in patterns 
-                    if p.start_time <= hour < p.end_time
-                ]
-                if covering:
-                    pattern_vars = [x[(s.id, day, p.id)] for p in covering]
-                    if pattern_vars:
-                        model.AddMaxEquality(
-                            y[(s.id, day, hour)],
-                            pattern_vars
-                        )
-                else:
-                    model.Add(y[(s.id, day, hour)] == 0)
+        before = carry_in.get(s.id, 0)
+        after = carry_out.get(s.id, 0)
+        # max_consecutive_days + 1 日の窓で勤務日数を上限以下に抑える
+        for start_day in range(
+            first_day - before,
+            last_day + after - max_consecutive_days + 1
+        ):
+            window = range(start_day, start_day + max_consecutive_days + 1)
+            fixed = sum(
+                1 for day in window
+                if day < first_day or day > last_day or
+                (s.id, day) in fixed_days
+            )
+            work_vars = [
+                works[(s.id, day)] for day in window
+                if (s.id, day) in works
+            ]
+            if work_vars and len(work_vars) + fixed > max_consecutive_days:
+                model.Add(
+                    sum(work_vars) <= max(0, max_consecutive_days - fixed)
+                )
+
+
+def find_forced_off_days(
+    staffs: List[Staff],
+    first_day: int,
+    last_day: int,
+    carry_in: Dict[int, int] = None,
+    carry_out: Dict[int, int] = None,
+    max_consecutive_days: int = DEFAULT_LABOR_RULES.max_consecutive_days,
+    fixed_days: Set[Tuple[int, int]] = None
+) -> Set[Tuple[int, int]]:
+    """確定済みの勤務だけで連勤の上限に達し、勤務できない (staff_id, 日) を求める
 
-    # 3. 希望勤務時間帯制約
-    print("希望勤務時間帯制約の設定中...")
+    期間外の連勤（carry_in / carry_out）と固定したセルを確定済みの勤務とし、
+    その日に勤務すると上限を超える日を返す。
+    """
+    carry_in = carry_in or {}
+    carry_out = carry_out or {}
+    fixed_days = fixed_days or set()
+    forced_off = set()
     for s in staffs:
-        for day in range(1, last_day + 1):
-            req = requests.get((s.id, day))
-            for p in patterns:
-                if req is None:
-                    model.Add(x[(s.id, day, p.id)] == 0)
-                    continue
+        known = {day for staff_id, day in fixed_days if staff_id == s.id}
+        known.update(range(first_day - carry_in.get(s.id, 0), first_day))
+        known.update(
+            range(last_day + 1, last_day + 1 + carry_out.get(s.id, 0))
+        )
+        for day in range(first_day, last_day + 1):
+            if day in known:
+                continue
+            before = 0
+            while day - before - 1 in known:
+                before += 1
+            after = 0
+            while day + after + 1 in known:
+                after += 1
+            if before + after + 1 > max_consecutive_days:
+                forced_off.add((s.id, day))
+    return forced_off
+
 
-                can_work = True
-                if req.status == "O":
-                    if (p.start_time < store.open_hours or 
-                            p.end_time > store.close_hours):
-                        can_work = False
-                elif req.status == "time":
-                    if (p.end_time <= req.start_time or 
-                            p.start_time >= req.end_time):
-                        can_work = False
-                elif req.status in ("X", ""):
-                    can_work = False
-
-                if not can_work:
-                    model.Add(x[(s.id, day, p.id)] == 0)
-
-    # 4. 1日1パターン制約
-    print("1日1パターン制約の設定中...")
+def add_weekly_hours_constraint(
+    model: cp_model.CpModel,
+    hours: Dict,
+    staffs: List[Staff],
+    first_day: int,
+    last_day: int,
+    rules: LaborRules,
+    fixed_hours: Dict[Tuple[int, int], int] = None
+) -> None:
+    """任意の連続7日間の勤務時間を上限以下に抑える
+
+    Args:
+        hours: (staff_id, day) → 勤務時間（変数または式）
+        fixed_hours: (staff_id, day) → 確定済みの勤務時間（期間外の勤務や
+            固定したセル。hours に変数がある組は数えない）
+    """
+    fixed_hours = fixed_hours or {}
     for s in staffs:
-        for day in range(1, last_day + 1):
-            pattern_vars = [x[(s.id, day, p.id)] for p in patterns]
-            if pattern_vars:
-                model.Add(sum(pattern_vars) <= 1)
+        cap = rules.weekly_cap(s)
+        if cap is None:
+            continue
+        for start_day in range(
+            first_day - WEEK_DAYS + 1, last_day + 1
+        ):
+            window = range(start_day, start_day + WEEK_DAYS)
+            fixed = sum(
+                fixed_hours.get((s.id, day), 0) for day in window
+                if (s.id, day) not in hours
+            )
+            terms = [hours[(s.id, day)] for day in window if (s.id, day) in hours]
+            if terms:
+                model.Add(sum(terms) <= max(0, cap - fixed))
+
+
+def optimize_time_allocation(
+    model: cp_model.CpModel,
+    staffs: List[Staff],
+    patterns: List[ShiftPattern],
+    requests: Dict[Tuple[int, int], ShiftRequest],
+    store: Store,
+    last_day: int
+) -> Tuple[Dict, Dict]:
+    """時間配分の最適化を行う
+    
+    Returns:
+        x: (staff_id, day, pattern_id) → BoolVar（勤務可能な組のみ）
+        y: (staff_id, day, hour) → BoolVar（勤務可能な時間のみ）
+    """
+    print("\n=== 時間配分の最適化 ===")
+    
+    # 変数定義（希望勤務時間帯・1日1パターン・時間帯制約を含む）
+    print("勤務可能な組み合わせの変数を作成中...")
+    x, y, works = create_pattern_variables(
+        model, staffs, patterns, requests, store, range(1, last_day + 1)
+    )
+
+    # 連勤制約
+    print("連勤制約の設定中...")
+    add_consecutive_days_constraint(model, works, staffs, 1, last_day)
 
     return x, y
 
@@ -131,11 +270,7 @@ def optimize_staffing_levels(
     
     for day in range(1, last_day + 1):
         day_type = get_day_type(year, month, day, holidays)
-        skill_req = next(
-            (r for r in store.default_skill_requirements 
-             if r.day_type == day_type),
-            None
-        )
+        skill_req = store.get_skill_requirement(day_type)
         if not skill_req:
             print(f"エラー: {day_type}のスキル設定が見つかりません")
             raise ValueError(f"Day type '{day_type}' skill setting not found")
@@ -170,8 +305,11 @@ def optimize_staffing_levels(
                 1 for (_, d, h) in employee_work_hours if h == hour
             )
             
-            # バイトの勤務変数を集計
-            staff_vars = [y[(s.id, day, hour)] for s in staffs]
+            # バイトの勤務変数を集計（勤務可能な時間のみ変数がある）
+            staff_vars = [
+                y[(s.id, day, hour)] for s in staffs
+                if (s.id, day, hour) in y
+            ]
             
             if staff_vars:
                 if is_peak:
@@ -254,7 +392,6 @@ def optimize_staffing_levels(
 
 
 def optimize_required_staff(
-    model: cp_model.CpModel,
     store: Store,
     employees: List[Staff],
     staffs: List[Staff],
@@ -277,11 +414,7 @@ def optimize_required_staff(
     
     for day in range(1, last_day + 1):
         day_type = get_day_type(year, month, day, holidays)
-        skill_req = next(
-            (r for r in store.default_skill_requirements 
-             if r.day_type == day_type),
-            None
-        )
+        skill_req = store.get_skill_requirement(day_type)
         if not skill_req:
             raise ValueError(f"{day_type}のスキル設定が見つかりません")
 
@@ -329,102 +462,678 @@ def assign_shift_patterns(
     requests: Dict[Tuple[int, int], ShiftRequest],
     required_staff: Dict[Tuple[int, int], int],
     store: Store,
-    last_day: int
+    last_day: int,
+    first_day: int = 1,
+    objective_terms: List = None,
+    carry_in: Dict[int, int] = None,
+    carry_out: Dict[int, int] = None,
+    rules: LaborRules = DEFAULT_LABOR_RULES,
+    fixed: Dict[Tuple[int, int], Tuple[int, int]] = None,
+    shortage_terms: List = None
 ) -> Tuple[Dict, Dict]:
     """決定された必要人数に基づいてシフトパターンを割り当てる
     
+    Args:
+        first_day: 対象期間の開始日（週単位の部分問題用）
+        objective_terms: 指定された場合、必要人数を過不足ペナルティとして扱う
+        shortage_terms: 指定された場合、(不足人数の変数, 時間数) を追加する
+        carry_in: staff_id → first_day直前までの連続勤務日数
+        carry_out: staff_id → last_day直後からの連続勤務日数
+        rules: 労務ルール（連勤・終業時刻・週の勤務時間）
+        fixed: (staff_id, day) → (開始時間, 終了時間) 固定したシフト。
+            requests と required_staff からは除いておき、連勤と週の勤務時間
+            には確定済みの勤務として数える
+    
     Returns:
-        x: (staff_id, day, pattern_id) → BoolVar
-        y: (staff_id, day, hour) → BoolVar
+        x: (staff_id, day, pattern_id) → BoolVar（勤務可能な組のみ）
+        y: (staff_id, day, hour) → BoolVar（勤務可能な時間のみ）
     """
     print("\n=== シフトパターンの割り当て ===")
     
-    # 変数定義
-    x = {}  # (staff_id, day, pattern_id) → BoolVar
-    for s in staffs:
-        for day in range(1, last_day + 1):
-            for p in patterns:
-                x[(s.id, day, p.id)] = model.NewBoolVar(
-                    f"x_s{s.id}_d{day}_p{p.id}"
-                )
-
-    y = {}  # (staff_id, day, hour) → BoolVar
-    for s in staffs:
-        for day in range(1, last_day + 1):
-            for hour in range(store.open_hours, store.close_hours):
-                y[(s.id, day, hour)] = model.NewBoolVar(
-                    f"y_s{s.id}_d{day}_h{hour}"
-                )
+    days = range(first_day, last_day + 1)
+    
+    # 変数定義（希望勤務時間帯・1日1パターン・時間帯制約を含む）
+    print("勤務可能な組み合わせの変数を作成中...")
+    x, y, works = create_pattern_variables(
+        model, staffs, patterns, requests, store, days, rules
+    )
 
-    # 1. 必要人数の制約
+    # 必要人数の制約
     print("必要人数の制約を設定中...")
-    for day in range(1, last_day + 1):
+    for day in days:
         for hour in range(store.open_hours, store.close_hours):
             required = required_staff.get((day, hour), 0)
-            staff_vars = [y[(s.id, day, hour)] for s in staffs]
-            if staff_vars:
-                model.Add(sum(staff_vars) == required)
+            staff_vars = [
+                y[(s.id, day, hour)] for s in staffs
+                if (s.id, day, hour) in y
+            ]
+            if objective_terms is None:
+                if staff_vars or required > 0:
+                    model.Add(sum(staff_vars) == required)
+                continue
 
-    # 2. 時間帯制約
-    print("時間帯制約を設定中...")
-    for s in staffs:
-        for day in range(1, last_day + 1):
-            for hour in range(store.open_hours, store.close_hours):
-                covering = [
-                    p for p in patterns 
-                    if p.start_time <= hour < p.end_time
-                ]
-                if covering:
-                    pattern_vars = [x[(s.id, day, p.id)] for p in covering]
-                    if pattern_vars:
-                        model.AddMaxEquality(
-                            y[(s.id, day, hour)],
-                            pattern_vars
-                        )
-                else:
-                    model.Add(y[(s.id, day, hour)] == 0)
+            # 過不足をペナルティとして目的関数に加える
+            shortage = model.NewIntVar(
+                0, required, f"shortage_d{day}_h{hour}"
+            )
+            excess = model.NewIntVar(
+                0, len(staff_vars), f"excess_d{day}_h{hour}"
+            )
+            model.Add(sum(staff_vars) + shortage - excess == required)
+            objective_terms.append(shortage * 20)
+            objective_terms.append(excess * 5)
+            if shortage_terms is not None:
+                shortage_terms.append((shortage, 1))
 
-    # 3. 希望勤務時間帯制約
-    print("希望勤務時間帯制約を設定中...")
+    # 連勤制約
+    print("連勤制約を設定中...")
+    fixed = fixed or {}
+    add_consecutive_days_constraint(
+        model, works, staffs, first_day, last_day,
+        carry_in=carry_in, carry_out=carry_out,
+        max_consecutive_days=rules.max_consecutive_days,
+        fixed_days=set(fixed)
+    )
+
+    # 週の勤務時間の上限
+    pattern_hours = {p.id: p.end_time - p.start_time for p in patterns}
+    hours = defaultdict(list)
+    for (staff_id, day, pattern_id), var in x.items():
+        hours[(staff_id, day)].append(var * pattern_hours[pattern_id])
+    add_weekly_hours_constraint(
+        model, {key: sum(terms) for key, terms in hours.items()},
+        staffs, first_day, last_day, rules,
+        fixed_hours={key: end - start for key, (start, end) in fixed.items()}
+    )
+
+    return x, y
+
+
+def solve_shift_patterns(
+    store: Store,
+    staffs: List[Staff],
+    patterns: List[ShiftPattern],
+    requests: Dict[Tuple[int, int], ShiftRequest],
+    required_staff: Dict[Tuple[int, int], int],
+    last_day: int,
+    first_day: int = 1,
+    target_days: Dict[int, int] = None,
+    carry_in: Dict[int, int] = None,
+    carry_out: Dict[int, int] = None,
+    time_limit: float = 30.0,
+    num_workers: int = 8,
+    break_symmetry: bool = False,
+    rules: LaborRules = DEFAULT_LABOR_RULES,
+    fixed: Dict[Tuple[int, int], Tuple[int, int]] = None
+) -> Dict[Tuple[int, int], ShiftPattern]:
+    """CP-SATでシフトパターンの割り当てを解く
+    
+    Args:
+        store: 店舗情報
+        staffs: バイトスタッフリスト
+        patterns: シフトパターンリスト
+        requests: (staff_id, day) → ShiftRequest
+        required_staff: (day, hour) → 必要なバイトの人数
+        last_day: 対象期間の最終日
+        first_day: 対象期間の開始日
+        target_days: staff_id → 採用目標日数（公平性）
+        carry_in: staff_id → first_day直前までの連続勤務日数
+        carry_out: staff_id → last_day直後からの連続勤務日数
+        time_limit: 探索時間の上限（秒）
+        num_workers: CP-SATの探索スレッド数
+        break_symmetry: 区別できないスタッフの入れ替え解を除くか
+            （BoolVarのみのこのモデルはCP-SATの前処理が対称性を
+            検出するため、既定では追加しない）
+        rules: 労務ルール
+        fixed: (staff_id, day) → (開始時間, 終了時間) 固定したシフト
+            （必要人数から差し引き済みの確定した勤務）
+    
+    Returns:
+        assignments: (staff_id, day) → ShiftPattern（解なしの場合はNone）
+    """
+    model = cp_model.CpModel()
+    objective_terms = []
+    shortage_terms = []
+    x, _ = assign_shift_patterns(
+        model, staffs, patterns, requests, required_staff, store,
+        last_day, first_day=first_day, objective_terms=objective_terms,
+        carry_in=carry_in, carry_out=carry_out, rules=rules, fixed=fixed,
+        shortage_terms=shortage_terms
+    )
+
+    # 公平性: 採用日数を目標日数に近づける
+    staff_vars = defaultdict(list)
+    for (staff_id, _, _), var in x.items():
+        staff_vars[staff_id].append(var)
+    add_fairness_penalties(
+        model, staff_vars, target_days, objective_terms
+    )
+    if break_symmetry:
+        groups = find_interchangeable_staff(
+            staffs, requests, first_day, last_day,
+            target_days=target_days, carry_in=carry_in, carry_out=carry_out,
+            fixed_days=fixed
+        )
+        count = add_symmetry_breaking(model, groups, x)
+        print(f"対称性の除去: {len(groups)}グループ, 順序制約 {count}件")
+
+    solver = cp_model.CpSolver()
+    status = run_solver(
+        model, solver, objective_terms, time_limit, num_workers,
+        f"{first_day}日～{last_day}日",
+        demand_hours=sum(
+            required for (day, _), required in required_staff.items()
+            if first_day <= day <= last_day
+        ),
+        shortage_terms=shortage_terms
+    )
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return None
+
+    assignments = {}
+    pattern_by_id = {p.id: p for p in patterns}
+    for (staff_id, day, pattern_id), var in x.items():
+        if solver.Value(var):
+            assignments[(staff_id, day)] = pattern_by_id[pattern_id]
+    return assignments
+
+
+def add_fairness_penalties(
+    model: cp_model.CpModel,
+    staff_vars: Dict[int, List],
+    target_days: Dict[int, int],
+    objective_terms: List
+) -> None:
+    """採用日数と目標日数の差をペナルティとして目的関数に加える
+    
+    Args:
+        staff_vars: staff_id → 勤務を表す変数のリスト
+        target_days: staff_id → 採用目標日数
+    """
+    if not target_days:
+        return
+    for staff_id, target in target_days.items():
+        work_vars = staff_vars.get(staff_id, [])
+        upper = max(len(work_vars), target)
+        deviation = model.NewIntVar(0, upper, f"fair_dev_s{staff_id}")
+        model.AddAbsEquality(deviation, sum(work_vars) - target)
+        objective_terms.append(deviation * 10)
+
+
+def find_interchangeable_staff(
+    staffs: List[Staff],
+    requests: Dict[Tuple[int, int], ShiftRequest],
+    first_day: int,
+    last_day: int,
+    target_days: Dict[int, int] = None,
+    carry_in: Dict[int, int] = None,
+    carry_out: Dict[int, int] = None,
+    fixed_days: Set[Tuple[int, int]] = None
+) -> List[List[int]]:
+    """モデル上で区別できないスタッフのグループを求める
+    
+    スキル・雇用形態・期間内の希望・連勤の境界条件・採用目標日数・
+    固定したセルがすべて同じスタッフ同士は、勤務表を入れ替えても
+    実行可能性と目的関数値が変わらない。
+    
+    Returns:
+        groups: 2人以上からなる staff_id のグループのリスト
+    """
+    target_days = target_days or {}
+    carry_in = carry_in or {}
+    carry_out = carry_out or {}
+    fixed_days = fixed_days or set()
+    groups = defaultdict(list)
     for s in staffs:
-        for day in range(1, last_day + 1):
+        request_signature = []
+        for day in range(first_day, last_day + 1):
             req = requests.get((s.id, day))
-            for p in patterns:
-                if req is None:
-                    model.Add(x[(s.id, day, p.id)] == 0)
-                    continue
+            if (s.id, day) in fixed_days:
+                request_signature.append(("fixed",))
+            elif req is None or req.status in ("X", "", None):
+                request_signature.append(None)
+            elif req.status == "O":
+                request_signature.append(("O",))
+            else:
+                request_signature.append(
+                    (req.status, req.start_time, req.end_time)
+                )
+        signature = (
+            s.employment_type, s.kitchen_a, s.kitchen_b, s.hall,
+            s.leadership, tuple(request_signature),
+            target_days.get(s.id), carry_in.get(s.id, 0),
+            carry_out.get(s.id, 0)
+        )
+        groups[signature].append(s.id)
+    return [sorted(ids) for ids in groups.values() if len(ids) > 1]
 
-                can_work = True
-                if req.status == "O":
-                    if (p.start_time < store.open_hours or 
-                            p.end_time > store.close_hours):
-                        can_work = False
-                elif req.status == "time":
-                    if (p.end_time <= req.start_time or 
-                            p.start_time >= req.end_time):
-                        can_work = False
-                elif req.status in ("X", ""):
-                    can_work = False
-
-                if not can_work:
-                    model.Add(x[(s.id, day, p.id)] == 0)
-
-    # 4. 連勤制約
-    print("連勤制約を設定中...")
-    max_consecutive_days = 5
-    for s in staffs:
-        for start_day in range(1, last_day - max_consecutive_days + 2):
-            work_vars = []
-            for day in range(start_day, start_day + max_consecutive_days):
-                work_var = model.NewBoolVar(f"work_s{s.id}_d{day}")
-                pattern_vars = [x[(s.id, day, p.id)] for p in patterns]
-                if pattern_vars:
-                    model.AddMaxEquality(work_var, pattern_vars)
-                work_vars.append(work_var)
-            if work_vars:
-                model.Add(sum(work_vars) <= max_consecutive_days)
 
-    return x, y
+def add_lex_ordering(
+    model: cp_model.CpModel,
+    upper: List,
+    lower: List,
+    name: str
+) -> None:
+    """BoolVarの列 upper が lower 以上（辞書式順序）となる制約を加える
+    
+    先頭から一致している間だけ次の要素の大小を比較する。
+    """
+    prefix_equal = None
+    for i, (u, v) in enumerate(zip(upper, lower)):
+        if prefix_equal is None:
+            model.Add(u >= v)
+        else:
+            model.Add(u >= v).OnlyEnforceIf(prefix_equal)
+        if i == len(upper) - 1:
+            break
+        # next_equal ⇔ ここまで一致 かつ u == v
+        next_equal = model.NewBoolVar(f"{name}_eq{i}")
+        if prefix_equal is None:
+            model.Add(next_equal == 1 - u + v)
+        else:
+            model.Add(next_equal <= prefix_equal)
+            model.Add(next_equal <= 1 - u + v)
+            model.Add(next_equal >= prefix_equal - u + v)
+        prefix_equal = next_equal
+
+
+def add_symmetry_breaking(
+    model: cp_model.CpModel,
+    groups: List[List[int]],
+    variables: Dict[Tuple, cp_model.IntVar]
+) -> int:
+    """区別できないスタッフの勤務表に辞書式の順序を課す
+    
+    同じグループ内で staff_id の小さいスタッフの勤務表が
+    辞書式で大きくなるよう連鎖させ、入れ替えただけの解を除く。
+    
+    Args:
+        groups: find_interchangeable_staff の結果
+        variables: 先頭要素が staff_id のキー → BoolVar
+    
+    Returns:
+        追加した順序制約の数
+    """
+    vectors = defaultdict(list)
+    for key in sorted(variables):
+        vectors[key[0]].append(variables[key])
+
+    count = 0
+    for group in groups:
+        for upper_id, lower_id in zip(group, group[1:]):
+            upper, lower = vectors[upper_id], vectors[lower_id]
+            if not upper or len(upper) != len(lower):
+                continue
+            add_lex_ordering(
+                model, upper, lower, f"sym_s{upper_id}_s{lower_id}"
+            )
+            count += 1
+    return count
+
+
+def run_solver(
+    model: cp_model.CpModel,
+    solver: cp_model.CpSolver,
+    objective_terms: List,
+    time_limit: float,
+    num_workers: int,
+    label: str,
+    demand_hours: int = None,
+    shortage_terms: List = None
+) -> int:
+    """目的関数を設定してCP-SATを実行する
+    
+    進捗の通知先があれば改善解ごとに通知する（shift_progress）。
+    
+    Args:
+        demand_hours: 必要人数の延べ時間（改善解の充足率の計算用）
+        shortage_terms: (不足人数の変数, 時間数) のリスト（不足時間の計算用）
+    
+    Returns:
+        status: CP-SATの求解ステータス
+    """
+    if objective_terms:
+        model.Minimize(sum(objective_terms))
+    solver.parameters.max_time_in_seconds = time_limit
+    solver.parameters.num_workers = num_workers
+    status = solve_with_progress(
+        solver, model, label, demand_hours, shortage_terms
+    )
+    print(
+        f"{label}: {solver.StatusName(status)} "
+        f"(目的関数値: {solver.ObjectiveValue() if objective_terms else 0})"
+    )
+    return status
+
+
+def get_request_window(
+    req: ShiftRequest,
+    store: Store,
+    is_minor: bool,
+    minor_end_hour: int = DEFAULT_LABOR_RULES.minor_end_hour
+) -> Tuple[int, int]:
+    """シフト希望から勤務可能な時間帯を求める
+    
+    Returns:
+        (開始時間, 終了時間)。勤務不可の場合はNone
+    """
+    if req is None or req.status not in ("O", "time"):
+        return None
+    if req.status == "O":
+        start, end = store.open_hours, store.close_hours
+    else:
+        start, end = req.start_time, req.end_time
+    if is_minor:
+        end = min(end, minor_end_hour)
+    if start >= end:
+        return None
+    return start, end
+
+
+def add_cumulative_coverage(
+    model: cp_model.CpModel,
+    work_intervals: List,
+    off_intervals: List,
+    demand: Dict[int, int],
+    open_hours: int,
+    close_hours: int,
+    objective_terms: List = None,
+    label: str = "",
+    shortage_terms: List = None
+) -> None:
+    """時間帯ごとの必要人数を累積制約で課す
+    
+    下限は「勤務していない区間」と需要ブロックの累積が候補人数を
+    超えないこと、上限は勤務区間と余白ブロックの累積が候補人数を
+    超えないことで表す。需要が同じ時間は1つのブロックにまとめる。
+    
+    Args:
+        work_intervals: 勤務区間（候補者ごとに1つ）
+        off_intervals: 非勤務区間（勤務前・勤務後・終日休み）
+        demand: hour → 必要人数
+        objective_terms: 指定された場合、過不足をペナルティとして扱う
+        shortage_terms: 指定された場合、(不足人数の変数, 時間数) を追加する
+    """
+    capacity = len(work_intervals)
+    blocks = []
+    hour = open_hours
+    while hour < close_hours:
+        end = hour + 1
+        while end < close_hours and demand.get(end, 0) == demand.get(hour, 0):
+            end += 1
+        blocks.append((hour, end, demand.get(hour, 0)))
+        hour = end
+
+    lower_demands = []
+    lower_intervals = []
+    upper_demands = []
+    upper_intervals = []
+    for start, end, required in blocks:
+        size = end - start
+        block = model.NewIntervalVar(
+            start, size, end, f"block_{label}_h{start}"
+        )
+        if objective_terms is None:
+            if required > capacity:
+                model.AddBoolOr([])  # 候補者が足りないため解なし
+                return
+            lower_demands.append(required)
+            upper_demands.append(capacity - required)
+        else:
+            shortage = model.NewIntVar(
+                max(0, required - capacity), required,
+                f"shortage_{label}_h{start}"
+            )
+            excess = model.NewIntVar(
+                0, max(0, capacity - required), f"excess_{label}_h{start}"
+            )
+            lower_demands.append(required - shortage)
+            upper_demands.append(max(0, capacity - required) - excess)
+            objective_terms.append(shortage * 20 * size)
+            objective_terms.append(excess * 5 * size)
+            if shortage_terms is not None:
+                shortage_terms.append((shortage, size))
+        lower_intervals.append(block)
+        upper_intervals.append(block)
+
+    model.AddCumulative(
+        off_intervals + lower_intervals,
+        [1] * len(off_intervals) + lower_demands,
+        capacity
+    )
+    model.AddCumulative(
+        work_intervals + upper_intervals,
+        [1] * len(work_intervals) + upper_demands,
+        capacity
+    )
+
+
+def assign_shift_intervals(
+    model: cp_model.CpModel,
+    staffs: List[Staff],
+    requests: Dict[Tuple[int, int], ShiftRequest],
+    required_staff: Dict[Tuple[int, int], int],
+    store: Store,
+    last_day: int,
+    first_day: int = 1,
+    objective_terms: List = None,
+    carry_in: Dict[int, int] = None,
+    carry_out: Dict[int, int] = None,
+    rules: LaborRules = DEFAULT_LABOR_RULES,
+    fixed_hours: Dict[Tuple[int, int], int] = None,
+    fixed_days: Set[Tuple[int, int]] = None,
+    shortage_terms: List = None
+) -> Tuple[Dict, Dict, Dict]:
+    """勤務区間を区間変数で表し、必要人数を累積制約で割り当てる
+    
+    時間ごとのBoolVarを作らず、(staff, day)ごとに開始・長さ・終了を
+    持つオプショナル区間を1つだけ作る。時間の刻みや営業時間が
+    増えても変数の数は変わらない。
+    
+    Args:
+        rules: 労務ルール（勤務時間の長さ・終業時刻・連勤・週の勤務時間）
+        fixed_hours: (staff_id, day) → 確定済みの勤務時間
+            （期間外の勤務や固定したセル。週の勤務時間の境界条件）
+        fixed_days: 期間内で勤務が確定している (staff_id, day)。
+            requests と required_staff からは除いておき、連勤に数える
+        shortage_terms: 指定された場合、(不足人数の変数, 時間数) を追加する
+    
+    Returns:
+        works: (staff_id, day) → 勤務有無のBoolVar
+        starts: (staff_id, day) → 開始時間のIntVar
+        ends: (staff_id, day) → 終了時間のIntVar
+    """
+    print("\n=== 勤務区間の割り当て ===")
+    
+    works = {}
+    starts = {}
+    ends = {}
+    hours = {}
+    weekly_capped = {s.id for s in staffs if rules.weekly_cap(s) is not None}
+    min_hours, max_hours = rules.shift_length_range()
+    days = range(first_day, last_day + 1)
+    # 確定済みの勤務だけで連勤の上限に達する日は候補にしない。勤務が0に
+    # 固定された区間だけの日があると、CP-SATの前処理が不足人数を含む
+    # 目的関数のもとで誤って解なしと判定することがある
+    forced_off = find_forced_off_days(
+        staffs, first_day, last_day, carry_in=carry_in, carry_out=carry_out,
+        max_consecutive_days=rules.max_consecutive_days,
+        fixed_days=fixed_days
+    )
+    for day in days:
+        work_intervals = []
+        off_intervals = []
+        for s in staffs:
+            end_hour_limit = rules.end_hour_limit(s)
+            window = get_request_window(
+                requests.get((s.id, day)), store,
+                end_hour_limit is not None, end_hour_limit
+            )
+            if window is None or (s.id, day) in forced_off:
+                continue
+            req_start, req_end = window
+            available = req_end - req_start
+            shortest = min(min_hours, available)
+            longest = max(shortest, min(max_hours, available))
+
+            key = (s.id, day)
+            works[key] = model.NewBoolVar(f"work_s{s.id}_d{day}")
+            starts[key] = model.NewIntVar(
+                req_start, req_end - shortest, f"start_s{s.id}_d{day}"
+            )
+            ends[key] = model.NewIntVar(
+                req_start + shortest, req_end, f"end_s{s.id}_d{day}"
+            )
+            length = model.NewIntVar(
+                shortest, longest, f"len_s{s.id}_d{day}"
+            )
+            work_intervals.append(model.NewOptionalIntervalVar(
+                starts[key], length, ends[key], works[key],
+                f"shift_s{s.id}_d{day}"
+            ))
+            if s.id in weekly_capped:
+                # 休みの日の長さは自由なため、勤務時間は勤務する日だけ数える
+                hours[key] = model.NewIntVar(
+                    0, longest, f"hours_s{s.id}_d{day}"
+                )
+                model.Add(hours[key] == length).OnlyEnforceIf(works[key])
+                model.Add(hours[key] == 0).OnlyEnforceIf(works[key].Not())
+
+            # 勤務前・勤務後・終日休みの区間（下限の累積制約用）
+            before = model.NewIntVar(
+                0, store.close_hours - store.open_hours,
+                f"before_s{s.id}_d{day}"
+            )
+            model.Add(before == starts[key] - store.open_hours)
+            after = model.NewIntVar(
+                0, store.close_hours - store.open_hours,
+                f"after_s{s.id}_d{day}"
+            )
+            model.Add(after == store.close_hours - ends[key])
+            off_intervals.append(model.NewOptionalIntervalVar(
+                store.open_hours, before, starts[key], works[key],
+                f"before_iv_s{s.id}_d{day}"
+            ))
+            off_intervals.append(model.NewOptionalIntervalVar(
+                ends[key], after, store.close_hours, works[key],
+                f"after_iv_s{s.id}_d{day}"
+            ))
+            off_intervals.append(model.NewOptionalFixedSizeIntervalVar(
+                store.open_hours, store.close_hours - store.open_hours,
+                works[key].Not(), f"off_iv_s{s.id}_d{day}"
+            ))
+
+        demand = {
+            hour: required_staff.get((day, hour), 0)
+            for hour in range(store.open_hours, store.close_hours)
+        }
+        add_cumulative_coverage(
+            model, work_intervals, off_intervals, demand,
+            store.open_hours, store.close_hours,
+            objective_terms=objective_terms, label=f"d{day}",
+            shortage_terms=shortage_terms
+        )
+
+    print(f"勤務区間の数: {len(works)}")
+    add_consecutive_days_constraint(
+        model, works, staffs, first_day, last_day,
+        carry_in=carry_in, carry_out=carry_out,
+        max_consecutive_days=rules.max_consecutive_days,
+        fixed_days=fixed_days
+    )
+    add_weekly_hours_constraint(
+        model, hours, staffs, first_day, last_day, rules,
+        fixed_hours=fixed_hours
+    )
+    return works, starts, ends
+
+
+def solve_shift_intervals(
+    store: Store,
+    staffs: List[Staff],
+    requests: Dict[Tuple[int, int], ShiftRequest],
+    required_staff: Dict[Tuple[int, int], int],
+    last_day: int,
+    first_day: int = 1,
+    target_days: Dict[int, int] = None,
+    carry_in: Dict[int, int] = None,
+    carry_out: Dict[int, int] = None,
+    time_limit: float = 30.0,
+    num_workers: int = 8,
+    break_symmetry: bool = True,
+    hints: Dict[Tuple[int, int], Tuple[int, int]] = None,
+    rules: LaborRules = DEFAULT_LABOR_RULES,
+    fixed: Dict[Tuple[int, int], Tuple[int, int]] = None
+) -> Dict[Tuple[int, int], Tuple[int, int]]:
+    """区間変数の定式化でシフトを解く
+    
+    Args:
+        break_symmetry: 区別できないスタッフの入れ替え解を除くか
+        hints: (staff_id, day) → (開始時間, 終了時間) 解のヒント
+            （前月のシフトなど）。ない組は休みとしてヒントを与える
+        rules: 労務ルール
+        fixed: (staff_id, day) → (開始時間, 終了時間) 固定したシフト
+            （必要人数から差し引き済みの確定した勤務）
+    
+    Returns:
+        assignments: (staff_id, day) → (開始時間, 終了時間)
+            （解なしの場合はNone）
+    """
+    fixed = fixed or {}
+    model = cp_model.CpModel()
+    objective_terms = []
+    shortage_terms = []
+    works, starts, ends = assign_shift_intervals(
+        model, staffs, requests, required_staff, store, last_day,
+        first_day=first_day, objective_terms=objective_terms,
+        carry_in=carry_in, carry_out=carry_out, rules=rules,
+        fixed_hours={key: end - start for key, (start, end) in fixed.items()},
+        fixed_days=set(fixed), shortage_terms=shortage_terms
+    )
+
+    staff_vars = defaultdict(list)
+    for (staff_id, _), var in works.items():
+        staff_vars[staff_id].append(var)
+    add_fairness_penalties(
+        model, staff_vars, target_days, objective_terms
+    )
+    # ヒントがあるとスタッフを区別できるため、順序制約はヒントと矛盾し得る
+    if break_symmetry and not hints:
+        groups = find_interchangeable_staff(
+            staffs, requests, first_day, last_day,
+            target_days=target_days, carry_in=carry_in, carry_out=carry_out,
+            fixed_days=fixed
+        )
+        count = add_symmetry_breaking(model, groups, works)
+        print(f"対称性の除去: {len(groups)}グループ, 順序制約 {count}件")
+    if hints:
+        for key, work in works.items():
+            hint = hints.get(key)
+            model.AddHint(work, 1 if hint else 0)
+            if hint:
+                model.AddHint(starts[key], hint[0])
+                model.AddHint(ends[key], hint[1])
+
+    solver = cp_model.CpSolver()
+    status = run_solver(
+        model, solver, objective_terms, time_limit, num_workers,
+        f"{first_day}日～{last_day}日 (区間)",
+        demand_hours=sum(
+            required for (day, _), required in required_staff.items()
+            if first_day <= day <= last_day
+        ),
+        shortage_terms=shortage_terms
+    )
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return None
+
+    assignments = {}
+    for key, work in works.items():
+        if solver.Value(work):
+            assignments[key] = (
+                solver.Value(starts[key]), solver.Value(ends[key])
+            )
+    return assignments
 
 
 def optimize_time_patterns(
@@ -0,0 +1,132 @@
+import time
+from typing import List, Tuple
+from models import Shiftresult
+from .shift_generator import (
+    build_employee_results,
+    calculate_target_days,
+    intervals_to_results
+)
+from .shift_lns import solve_neighbourhood
+from .shift_pins import (
+    apply_pins_to_requests,
+    merge_pinned_results,
+    pinned_shifts
+)
+from .shift_optimizer import (
+    optimize_required_staff as calculate_hourly_required_staff
+)
+from .shift_snapshot import GenerationSnapshot
+from .shift_validator import validate_shift_requests
+from .shift_warmstart import build_warm_start
+
+
+def regenerate_day_range(
+    snapshot: GenerationSnapshot,
+    first_day: int,
+    end_day: int,
+    fixed_results: List[Tuple[int, int, int, int]],
+    time_limit: float = 10.0
+) -> List[Shiftresult]:
+    """月の一部の日だけを作り直し、残りの日の保存済みシフトは固定する
+
+    範囲外のバイトの勤務は連勤と採用日数（公平性）の境界条件として与え、
+    範囲内のバイトの勤務区間だけをCP-SATで解く。範囲内の社員のシフトは
+    希望通りに確定する。固定したセル（snapshot.pins）は範囲内でも変えない。
+
+    Args:
+        snapshot: 生成入力のスナップショット
+        first_day: 作り直す範囲の開始日
+        end_day: 作り直す範囲の終了日
+        fixed_results: 保存済みのシフト (staff_id, day, 開始時間, 終了時間)。
+            範囲内の行は無視する
+        time_limit: 探索時間の上限（秒）
+
+    Returns:
+        results: 月全体のシフト結果（範囲外は fixed_results のまま）
+    """
+    if not 1 <= first_day <= end_day <= snapshot.last_day:
+        raise ValueError(
+            f"作り直す範囲が不正です: {first_day}日～{end_day}日"
+        )
+    print(f"\n=== {first_day}日～{end_day}日のシフトの作り直し ===")
+    started = time.perf_counter()
+    store = snapshot.store
+    employees = list(snapshot.employees)
+    staffs = list(snapshot.staffs)
+    year, month, last_day = snapshot.year, snapshot.month, snapshot.last_day
+
+    requests = apply_pins_to_requests(
+        snapshot.requests, snapshot.pins, year, month
+    )
+    valid_requests = validate_shift_requests(
+        requests, employees + staffs, store
+    )
+    # 範囲内の固定したシフトは近傍の中でも動かさない勤務として扱う
+    in_range = range(first_day, end_day + 1)
+    staff_ids = {s.id for s in staffs}
+    fixed = {
+        key: value
+        for key, value in pinned_shifts(snapshot.pins, staff_ids).items()
+        if key[1] in in_range
+    }
+    employee_results, employee_shifts = build_employee_results(
+        store, employees, valid_requests, year, month,
+        range(1, last_day + 1)
+    )
+    required_staff = calculate_hourly_required_staff(
+        store, employees, staffs, snapshot.holidays,
+        year, month, last_day, employee_shifts
+    )
+    target_days = calculate_target_days(
+        store, staffs,
+        {key: req for key, req in valid_requests.items() if key not in fixed},
+        year, month, last_day, snapshot.holidays, employee_shifts
+    )
+
+    # 範囲外のシフトはそのまま残す
+    kept = [r for r in fixed_results if r[1] not in in_range]
+    intervals = {
+        (staff_id, day): (start, end)
+        for staff_id, day, start, end in kept if staff_id in staff_ids
+    }
+    intervals.update(fixed)
+    print(f"固定するシフト: {len(kept)}件 (範囲内の固定したセル {len(fixed)}件)")
+
+    warm_start = build_warm_start(
+        snapshot.previous_shifts, list(staff_ids), year, month,
+        snapshot.holidays,
+        max_consecutive_days=snapshot.rules.max_consecutive_days
+    )
+    updated = solve_neighbourhood(
+        store, staffs, valid_requests, required_staff, intervals,
+        target_days, first_day, end_day, time_limit,
+        month_carry_in=warm_start.carry_in, rules=snapshot.rules,
+        fixed=set(fixed)
+    )
+    if updated is None:
+        raise ValueError(
+            f"{first_day}日～{end_day}日のシフトを求解できませんでした"
+        )
+
+    results = [
+        Shiftresult(
+            staff_id=staff_id,
+            year=year,
+            month=month,
+            day=day,
+            start_time=start,
+            end_time=end
+        )
+        for staff_id, day, start, end in kept
+    ]
+    results.extend(r for r in employee_results if r.day in in_range)
+    results.extend(intervals_to_results(
+        {key: value for key, value in updated.items() if key[1] in in_range},
+        year, month
+    ))
+    results = merge_pinned_results(
+        results, [pin for pin in snapshot.pins if pin.day in in_range]
+    )
+    print(f"作り直したシフト: {len(results) - len(kept)}件 "
+          f"({time.perf_counter() - started:.2f}秒)")
+    return results
@@ -0,0 +1,150 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+from models import Shiftresult
+from .shift_snapshot import PinSnapshot, RequestSnapshot
+
+
+def apply_pins_to_requests(
+    requests: Iterable,
+    pins: Iterable[PinSnapshot],
+    year: int,
+    month: int
+) -> List:
+    """固定したセルをシフト希望に反映し、生成方式が選べる範囲を狭める
+
+    勤務させない日は希望を "X" に、固定したシフトは希望をその時間だけの
+    "time" に置き換える。社員のシフトと検証はこの希望をそのまま使い、
+    バイトの固定したシフトは生成方式が確定済みの勤務として扱う
+    （pinned_shifts）。
+
+    Args:
+        requests: シフト希望リスト
+        pins: 手動で固定したセル
+        year: 年
+        month: 月
+
+    Returns:
+        requests: 固定したセルを反映したシフト希望リスト
+    """
+    pin_by_key = {(pin.staff_id, pin.day): pin for pin in pins}
+    if not pin_by_key:
+        return list(requests)
+
+    applied = []
+    for req in requests:
+        if (req.staff_id, req.day) not in pin_by_key:
+            applied.append(req)
+    for (staff_id, day), pin in sorted(pin_by_key.items()):
+        applied.append(RequestSnapshot(
+            staff_id=staff_id,
+            year=year,
+            month=month,
+            day=day,
+            status="X" if pin.is_exclusion else "time",
+            start_time=pin.start_time,
+            end_time=pin.end_time
+        ))
+    return applied
+
+
+def pinned_shifts(
+    pins: Iterable[PinSnapshot],
+    staff_ids: Iterable[int]
+) -> Dict[Tuple[int, int], Tuple[int, int]]:
+    """固定したシフトのうち指定したスタッフの分を取り出す
+
+    Args:
+        pins: 手動で固定したセル
+        staff_ids: 対象スタッフIDのリスト
+
+    Returns:
+        fixed: (staff_id, 日) → (開始時間, 終了時間)
+    """
+    staff_ids = set(staff_ids)
+    return {
+        (pin.staff_id, pin.day): (pin.start_time, pin.end_time)
+        for pin in pins
+        if not pin.is_exclusion and pin.staff_id in staff_ids
+    }
+
+
+def count_pinned_staff(
+    fixed: Dict[Tuple[int, int], Tuple[int, int]],
+    day: int,
+    hour: int
+) -> int:
+    """指定した日時に勤務している固定シフトの人数を数える"""
+    return sum(
+        1 for (_, d), (start, end) in fixed.items()
+        if d == day and start <= hour < end
+    )
+
+
+def subtract_pinned_coverage(
+    required_staff: Dict[Tuple[int, int], int],
+    fixed: Dict[Tuple[int, int], Tuple[int, int]]
+) -> Dict[Tuple[int, int], int]:
+    """時間帯ごとの必要人数から固定シフトで満たされる分を差し引く
+
+    Args:
+        required_staff: (day, hour) → 必要人数
+        fixed: (staff_id, 日) → (開始時間, 終了時間) 固定したシフト
+
+    Returns:
+        required_staff: 固定シフトの分を差し引いた (day, hour) → 必要人数
+    """
+    residual = dict(required_staff)
+    for (_, day), (start, end) in fixed.items():
+        for hour in range(start, end):
+            if (day, hour) in residual:
+                residual[(day, hour)] = max(0, residual[(day, hour)] - 1)
+    return residual
+
+
+def merge_pinned_results(
+    results: List[Shiftresult],
+    pins: Iterable[PinSnapshot]
+) -> List[Shiftresult]:
+    """固定したセルが生成結果にそのまま含まれていることを確かめる
+
+    どの生成方式も固定したセルを確定済みの入力として扱うため、ここでは
+    行の置き換えや追加はせず、固定したシフトが時間どおりに1件だけあり、
+    勤務させない日にシフトがないことを確認して pinned の印を付ける。
+
+    Args:
+        results: 生成したシフト結果
+        pins: 手動で固定したセル
+
+    Returns:
+        results: 固定したセルに印を付けたシフト結果
+
+    Raises:
+        ValueError: 固定したセルが生成結果と一致しない場合
+    """
+    pin_by_key = {(pin.staff_id, pin.day): pin for pin in pins}
+    if not pin_by_key:
+        return results
+
+    found = defaultdict(list)
+    for r in results:
+        if (r.staff_id, r.day) in pin_by_key:
+            found[(r.staff_id, r.day)].append(r)
+    for key, pin in sorted(pin_by_key.items()):
+        rows = found.get(key, [])
+        if pin.is_exclusion:
+            if rows:
+                raise ValueError(
+                    f"勤務させない日にシフトがあります: "
+                    f"スタッフID {key[0]}, {key[1]}日"
+                )
+            continue
+        if len(rows) != 1 or (rows[0].start_time, rows[0].end_time) != (
+            pin.start_time, pin.end_time
+        ):
+            raise ValueError(
+                f"固定したシフトが生成結果と一致しません: "
+                f"スタッフID {key[0]}, {key[1]}日"
+            )
+        rows[0].pinned = True
+    print(f"固定したセル: {len(pin_by_key)}件 (生成結果と一致)")
+    return results
@@ -0,0 +1,235 @@
+import calendar
+import contextlib
+import io
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+from typing import Callable, Dict, List, Tuple
+from models import Shiftresult
+from .shift_generator import (
+    generate_shift_results_with_ortools,
+    calculate_target_days
+)
+from .shift_lns import score_schedule
+from .shift_optimizer import get_request_window
+from .shift_pins import apply_pins_to_requests
+from .shift_progress import suppress_solutions
+from .shift_snapshot import GenerationSnapshot
+from .shift_validator import get_hourly_demand, validate_shift_requests
+from .shift_warmstart import count_carry_in
+
+
+# 既定で競わせる生成方式（先頭ほど速く解を返す）
+DEFAULT_STRATEGIES = ("greedy", "flow", "interval", "cpsat", "lns")
+
+# ソルバーに与える時間の割合（残りは結果の受け渡しと評価に使う）
+SOLVER_TIME_RATIO = 0.85
+
+# 希望時間帯の外で勤務させた1時間あたりのペナルティ（不足1時間と同じ重み）
+REQUEST_WINDOW_WEIGHT = 20
+
+
+def run_strategy(
+    snapshot: GenerationSnapshot,
+    strategy: str,
+    time_limit: float,
+    conn
+) -> None:
+    """子プロセスで1つの生成方式を実行し、結果をパイプで返す
+
+    監視付きの子プロセス（shift_supervisor）から起動された場合も、
+    進捗の通知先のパイプに複数のプロセスから書き込まないよう、
+    各方式の進捗は通知しない（打ち切りの要求は引き継ぐ）。
+    """
+    started = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), suppress_solutions():
+            results = generate_shift_results_with_ortools(
+                snapshot.store, snapshot.employees, snapshot.staffs,
+                snapshot.requests, snapshot.patterns, snapshot.holidays,
+                snapshot.year, snapshot.month, db=None, strategy=strategy,
+                time_limit=time_limit, capacity_check="off",
+                pins=snapshot.pins, previous_shifts=snapshot.previous_shifts,
+                rules=snapshot.rules
+            )
+        conn.send({
+            "strategy": strategy,
+            "results": [
+                (r.staff_id, r.day, r.start_time, r.end_time)
+                for r in results
+            ],
+            "elapsed": time.perf_counter() - started,
+        })
+    except Exception as e:
+        conn.send({"strategy": strategy, "error": str(e)})
+    finally:
+        conn.close()
+
+
+def score_results(
+    results: List[Tuple[int, int, int, int]],
+    snapshot: GenerationSnapshot
+) -> int:
+    """生成方式によらず同じ目的関数でシフトを評価する（小さいほど良い）
+
+    社員を含む総人数を必要人数と比べ、バイトの採用日数の公平性と
+    労務ルール違反（前月からの連勤を含む）、希望時間帯（固定したセルは
+    固定した時間）の外の勤務時間を加える。
+    社員のシフトはどの方式でも同じため比較に影響しない。
+    """
+    employee_ids = {e.id for e in snapshot.employees}
+    employee_shifts = [
+        (staff_id, day, start)
+        for staff_id, day, start, _ in results if staff_id in employee_ids
+    ]
+    with contextlib.redirect_stdout(io.StringIO()):
+        valid_requests = validate_shift_requests(
+            apply_pins_to_requests(
+                snapshot.requests, snapshot.pins, snapshot.year,
+                snapshot.month
+            ),
+            snapshot.employees + snapshot.staffs, snapshot.store
+        )
+        target_days = calculate_target_days(
+            snapshot.store, snapshot.staffs, valid_requests,
+            snapshot.year, snapshot.month, snapshot.last_day,
+            snapshot.holidays, employee_shifts
+        )
+    demand = get_hourly_demand(
+        snapshot.store, snapshot.holidays, snapshot.year, snapshot.month,
+        snapshot.last_day
+    )
+    intervals = {
+        (staff_id, day): (start, end)
+        for staff_id, day, start, end in results
+    }
+    outside_hours = 0
+    for (staff_id, day), (start, end) in intervals.items():
+        window = get_request_window(
+            valid_requests.get((staff_id, day)), snapshot.store, False
+        )
+        if window is None:
+            outside_hours += end - start
+            continue
+        inside = min(end, window[1]) - max(start, window[0])
+        outside_hours += (end - start) - max(0, inside)
+    prev_year, prev_month = (
+        (snapshot.year - 1, 12) if snapshot.month == 1
+        else (snapshot.year, snapshot.month - 1)
+    )
+    carry_in = count_carry_in(
+        snapshot.previous_shifts, calendar.monthrange(prev_year, prev_month)[1],
+        snapshot.rules.max_consecutive_days
+    )
+    return score_schedule(
+        intervals, demand, target_days, snapshot.last_day,
+        list(snapshot.staffs), snapshot.rules, carry_in=carry_in
+    ) + REQUEST_WINDOW_WEIGHT * outside_hours
+
+
+def run_portfolio(
+    snapshot: GenerationSnapshot,
+    time_limit: float = 30.0,
+    strategies: Tuple[str, ...] = DEFAULT_STRATEGIES,
+    on_result: Callable[[str, int, List[Shiftresult]], None] = None
+) -> Tuple[List[Shiftresult], Dict]:
+    """複数の生成方式を別プロセスで並行に実行し、期限までの最良解を返す
+
+    結果が届くたびに評価し、改善していれば on_result を呼ぶ。
+    期限を過ぎても終わっていないプロセスは停止する。
+
+    Args:
+        snapshot: 生成入力のスナップショット
+        time_limit: 期限（秒）
+        strategies: 競わせる生成方式
+        on_result: 最良解が更新されたときに呼ぶ関数
+            (生成方式, スコア, シフト結果)
+
+    Returns:
+        results: 最良のシフト結果
+        report: 方式ごとのスコア・所要時間と採用された方式
+    """
+    print("\n=== ポートフォリオ実行 ===")
+    started = time.perf_counter()
+    deadline = started + time_limit
+    solver_time_limit = max(1.0, time_limit * SOLVER_TIME_RATIO)
+
+    processes = {}
+    for strategy in strategies:
+        parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+            target=run_strategy,
+            args=(snapshot, strategy, solver_time_limit, child_conn),
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        processes[parent_conn] = (strategy, process)
+    print(f"実行中の方式: {', '.join(strategies)}")
+
+    best = None
+    best_score = None
+    best_strategy = None
+    report = {"strategies": {}}
+    pending = list(processes)
+    while pending:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        for conn in wait(pending, timeout=remaining):
+            pending.remove(conn)
+            strategy, _ = processes[conn]
+            try:
+                message = conn.recv()
+            except EOFError:
+                message = {"strategy": strategy, "error": "異常終了しました"}
+            elapsed = round(time.perf_counter() - started, 2)
+
+            if "error" in message:
+                report["strategies"][strategy] = {
+                    "error": message["error"], "elapsed": elapsed
+                }
+                print(f"  {elapsed}秒: {strategy} 失敗 ({message['error']})")
+                continue
+
+            score = score_results(message["results"], snapshot)
+            report["strategies"][strategy] = {
+                "score": score, "elapsed": elapsed
+            }
+            print(f"  {elapsed}秒: {strategy} スコア {score}")
+            if best_score is None or score < best_score:
+                best = [
+                    Shiftresult(
+                        staff_id=staff_id,
+                        year=snapshot.year,
+                        month=snapshot.month,
+                        day=day,
+                        start_time=start,
+                        end_time=end
+                    )
+                    for staff_id, day, start, end in message["results"]
+                ]
+                best_score = score
+                best_strategy = strategy
+                if on_result:
+                    on_result(strategy, score, best)
+
+    # 期限までに終わらなかった方式を停止する
+    for conn, (strategy, process) in processes.items():
+        if conn in pending:
+            report["strategies"][strategy] = {"error": "期限切れ"}
+            print(f"  {strategy} は期限までに終わらなかったため停止します")
+        if process.is_alive():
+            process.terminate()
+        process.join(timeout=1)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        conn.close()
+
+    if best is None:
+        raise ValueError("期限までにシフトを生成できた方式がありません")
+    report["best"] = best_strategy
+    report["score"] = best_score
+    print(f"採用: {best_strategy} (スコア {best_score})")
+    return best, report
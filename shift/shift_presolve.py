@@ -0,0 +1,106 @@
+from datetime import datetime
+from typing import Dict, List, Set, Tuple
+from models import Staff, Store, ShiftRequest
+from .shift_pins import count_pinned_staff
+from .shift_validator import get_day_type
+
+
+def count_peak_employees(
+    employee_shifts: List[Tuple[int, int, int]],
+    day: int,
+    peak_start_hour: int
+) -> int:
+    """ピーク開始時刻に勤務している社員の人数を数える"""
+    return sum(
+        1 for _, d, h in employee_shifts
+        if d == day and h == peak_start_hour
+    )
+
+
+def presolve_trivial_days(
+    store: Store,
+    staffs: List[Staff],
+    valid_requests: Dict[Tuple[int, int], ShiftRequest],
+    employee_shifts: List[Tuple[int, int, int]],
+    holidays: Set[datetime.date],
+    year: int,
+    month: int,
+    last_day: int,
+    fixed: Dict[Tuple[int, int], Tuple[int, int]] = None
+) -> Tuple[Dict[int, List[int]], List[int], Dict]:
+    """採用/不採用を判断する必要のない日を事前に確定する
+
+    希望者がバイトの必要人数（ピーク人数 - 社員数 - 固定したシフトの人数）
+    以下の日は全員採用、希望者がいない日は判断不要として確定し、
+    希望者が必要人数を超える日だけを最適化の対象として残す。
+
+    Args:
+        store: 店舗情報
+        staffs: バイトスタッフリスト
+        valid_requests: 有効なシフト希望
+        employee_shifts: 社員のシフトリスト (e_id, day, hour)
+        holidays: 祝日セット
+        year: 年
+        month: 月
+        last_day: 月末日
+        fixed: (staff_id, day) → (開始時間, 終了時間) 固定したシフト
+
+    Returns:
+        decided: day → 採用が確定したスタッフIDのリスト
+        contested: 採用/不採用の判断が必要な日のリスト
+        report: 縮小の集計
+    """
+    print("\n=== 前処理: 自明な日の確定 ===")
+    decided = {}
+    contested = []
+    applicant_days = 0
+    contested_applicant_days = 0
+    empty_days = 0
+    for day in range(1, last_day + 1):
+        skill_req = store.get_skill_requirement(
+            get_day_type(year, month, day, holidays)
+        )
+        if not skill_req:
+            continue
+        required_count = max(
+            0,
+            skill_req.peak_people - count_peak_employees(
+                employee_shifts, day, skill_req.peak_start_hour
+            ) - count_pinned_staff(
+                fixed or {}, day, skill_req.peak_start_hour
+            )
+        )
+        applicants = []
+        for s in staffs:
+            req = valid_requests.get((s.id, day))
+            if req and req.status != "X":
+                applicants.append(s.id)
+        applicant_days += len(applicants)
+
+        if not applicants:
+            empty_days += 1
+            decided[day] = []
+        elif len(applicants) <= required_count:
+            decided[day] = applicants
+        else:
+            contested.append(day)
+            contested_applicant_days += len(applicants)
+
+    report = {
+        "days": len(decided) + len(contested),
+        "accepted_days": len(decided) - empty_days,
+        "empty_days": empty_days,
+        "contested_days": len(contested),
+        "applicant_days": applicant_days,
+        "contested_applicant_days": contested_applicant_days,
+    }
+    print(
+        f"全員採用: {report['accepted_days']}日, "
+        f"希望者なし: {report['empty_days']}日, "
+        f"判断が必要: {report['contested_days']}日"
+    )
+    print(
+        f"判断対象の希望: {applicant_days}件 → "
+        f"{contested_applicant_days}件"
+    )
+    return decided, contested, report
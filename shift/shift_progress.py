@@ -0,0 +1,163 @@
+import contextlib
+import contextvars
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+from ortools.sat.python import cp_model
+
+
+# 改善解を通知する最短間隔（秒）。CP-SATは短時間に多数の解を返すため間引く
+SOLUTION_INTERVAL = 0.25
+
+# 改善解が出ない間も打ち切りの要求を確かめる間隔（秒）
+STOP_POLL_INTERVAL = 0.2
+
+_sink = contextvars.ContextVar("shift_progress_sink", default=None)
+_stop = contextvars.ContextVar("shift_progress_stop", default=None)
+
+
+@contextlib.contextmanager
+def progress_sink(callback: Callable[[Dict], None], stop_event=None):
+    """このコンテキストの生成の進捗を callback に通知する
+
+    Args:
+        callback: 進捗イベント（辞書）を受け取る関数
+        stop_event: セットされたら探索を打ち切り、その時点の最良解で
+            生成を続ける（threading.Event / multiprocessing.Event）
+    """
+    sink_token = _sink.set(callback)
+    stop_token = _stop.set(stop_event)
+    try:
+        yield
+    finally:
+        _stop.reset(stop_token)
+        _sink.reset(sink_token)
+
+
+def report_phase(phase: str, message: str = "", **data) -> None:
+    """生成の段階（検証・採用決定・時間調整など）を通知する"""
+    callback = _sink.get()
+    if callback:
+        callback({"type": "phase", "phase": phase, "message": message, **data})
+
+
+def report_solution(label: str, objective: float, **data) -> None:
+    """CP-SAT以外（大近傍探索など）の改善解を通知する"""
+    callback = _sink.get()
+    if callback:
+        callback({
+            "type": "solution", "label": label, "objective": objective, **data
+        })
+
+
+@contextlib.contextmanager
+def suppress_solutions():
+    """内側の部分問題の改善解は通知しない（打ち切りの要求は引き継ぐ）"""
+    token = _sink.set(None)
+    try:
+        yield
+    finally:
+        _sink.reset(token)
+
+
+def stop_requested() -> bool:
+    """探索の打ち切りが要求されているか"""
+    stop_event = _stop.get()
+    return stop_event is not None and stop_event.is_set()
+
+
+class ProgressSolutionCallback(cp_model.CpSolverSolutionCallback):
+    """CP-SATの改善解ごとに目的関数値と不足時間を通知する
+
+    不足時間は各モデルが渡す不足人数の変数から求める。
+    打ち切りが要求されていれば探索を止める（最良解は残る）。
+
+    Args:
+        label: 通知に付ける部分問題の名前
+        demand_hours: 必要人数の延べ時間（充足率の計算用）
+        shortage_terms: (不足人数の変数, その変数が表す時間数) のリスト
+    """
+
+    def __init__(
+        self,
+        label: str,
+        demand_hours: int = None,
+        shortage_terms: List[Tuple[cp_model.IntVar, int]] = None
+    ):
+        super().__init__()
+        self._callback = _sink.get()
+        self._stop_event = _stop.get()
+        self._label = label
+        self._demand_hours = demand_hours
+        self._started = time.perf_counter()
+        self._last_sent = None
+        self.solution_count = 0
+        self._shortage_terms = list(shortage_terms or [])
+
+    def on_solution_callback(self):
+        self.solution_count += 1
+        if self._stop_event is not None and self._stop_event.is_set():
+            self.StopSearch()
+        if self._callback is None:
+            return
+        now = time.perf_counter()
+        if self._last_sent is not None and \
+                now - self._last_sent < SOLUTION_INTERVAL:
+            return
+        self._last_sent = now
+        shortage_hours = sum(
+            self.Value(var) * hours for var, hours in self._shortage_terms
+        )
+        event = {
+            "type": "solution",
+            "label": self._label,
+            "objective": self.ObjectiveValue(),
+            "best_bound": self.BestObjectiveBound(),
+            "shortage_hours": shortage_hours,
+            "elapsed": round(now - self._started, 2),
+        }
+        if self._demand_hours:
+            event["coverage_rate"] = round(
+                1 - shortage_hours / self._demand_hours, 4
+            )
+        self._callback(event)
+
+
+def solve_with_progress(
+    solver: cp_model.CpSolver,
+    model: cp_model.CpModel,
+    label: str,
+    demand_hours: int = None,
+    shortage_terms: List[Tuple[cp_model.IntVar, int]] = None
+) -> int:
+    """進捗の通知先か打ち切りの要求があれば改善解を通知しながら解く
+
+    打ち切りは実行可能解が1つ以上見つかってから行う（最良解を必ず残す）。
+
+    Args:
+        shortage_terms: (不足人数の変数, その変数が表す時間数) のリスト。
+            改善解の不足時間と充足率の計算に使う
+    """
+    stop_event = _stop.get()
+    if _sink.get() is None and stop_event is None:
+        return solver.Solve(model)
+    callback = ProgressSolutionCallback(label, demand_hours, shortage_terms)
+    if stop_event is None:
+        return solver.Solve(model, callback)
+
+    finished = threading.Event()
+
+    def watch_stop():
+        # 改善解が出ない間は解コールバックが呼ばれないため、別スレッドで見張る
+        while not finished.wait(STOP_POLL_INTERVAL):
+            if stop_event.is_set() and callback.solution_count:
+                solver.StopSearch()
+                return
+
+    watcher = threading.Thread(target=watch_stop, daemon=True)
+    watcher.start()
+    try:
+        return solver.Solve(model, callback)
+    finally:
+        finished.set()
+        watcher.join()
@@ -0,0 +1,273 @@
+import dataclasses
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from models import StoreLaborRule
+
+
+# 時間調整と区間モデルで目安とする最長勤務時間（規則の上限以下で使う）
+PREFERRED_SHIFT_HOURS = 5
+
+# 週の労働時間の上限を数える窓の長さ（任意の連続7日間）
+WEEK_DAYS = 7
+
+
+@dataclass(frozen=True)
+class LaborRules:
+    """店舗ごとの労務ルール
+
+    store_labor_rules の行（ルール名と値）から組み立て、CP-SATの制約・
+    貪欲法の絞り込み・勤務表のチェックが同じ値を使う。
+    値がNoneの上限は課さない。
+    """
+    # 連続勤務日数の上限
+    max_consecutive_days: int = 5
+    # 1日の最短・最長勤務時間（希望時間がこれより短い場合は希望時間）
+    min_shift_hours: int = 4
+    max_shift_hours: int = 8
+    # 未成年バイトの終業時刻の上限
+    minor_end_hour: int = 10
+    # 任意の連続7日間の勤務時間の上限
+    weekly_max_hours: Optional[int] = None
+    minor_weekly_max_hours: Optional[int] = None
+
+    def end_hour_limit(self, staff) -> Optional[int]:
+        """スタッフの終業時刻の上限（なければNone）"""
+        if staff.employment_type == "未成年バイト":
+            return self.minor_end_hour
+        return None
+
+    def weekly_cap(self, staff) -> Optional[int]:
+        """スタッフの連続7日間の勤務時間の上限（なければNone）"""
+        caps = [self.weekly_max_hours]
+        if staff.employment_type == "未成年バイト":
+            caps.append(self.minor_weekly_max_hours)
+        caps = [cap for cap in caps if cap is not None]
+        return min(caps) if caps else None
+
+    def shift_length_range(self) -> Tuple[int, int]:
+        """時間調整・区間モデルで使う (最短, 最長) 勤務時間"""
+        longest = min(PREFERRED_SHIFT_HOURS, self.max_shift_hours)
+        return self.min_shift_hours, max(self.min_shift_hours, longest)
+
+    def allows_pattern(self, pattern) -> bool:
+        """シフトパターンの長さが最短・最長勤務時間の範囲内か"""
+        length = pattern.end_time - pattern.start_time
+        return self.min_shift_hours <= length <= self.max_shift_hours
+
+    def as_dict(self) -> Dict[str, Optional[int]]:
+        return dataclasses.asdict(self)
+
+
+DEFAULT_LABOR_RULES = LaborRules()
+
+RULE_NAMES = tuple(f.name for f in dataclasses.fields(LaborRules))
+
+
+def compile_labor_rules(
+    rows: Iterable[Tuple[str, Optional[int]]]
+) -> LaborRules:
+    """(ルール名, 値) の並びを検証して LaborRules にする
+
+    値がNoneのルールは既定値に戻す。
+
+    Raises:
+        ValueError: 不明なルール名や矛盾する値がある場合
+    """
+    values = {}
+    for rule, value in rows:
+        if rule not in RULE_NAMES:
+            raise ValueError(f"不明な労務ルールです: {rule}")
+        if value is None:
+            continue
+        value = int(value)
+        if value < 1:
+            raise ValueError(f"労務ルール {rule} は1以上で指定してください")
+        values[rule] = value
+    rules = LaborRules(**values)
+    if rules.min_shift_hours > rules.max_shift_hours:
+        raise ValueError("最短勤務時間が最長勤務時間を超えています")
+    for cap in (rules.weekly_max_hours, rules.minor_weekly_max_hours):
+        if cap is not None and cap < rules.min_shift_hours:
+            raise ValueError("週の勤務時間の上限が最短勤務時間より短いです")
+    return rules
+
+
+def load_labor_rules(db: Session, store_id: int) -> LaborRules:
+    """店舗の労務ルールを読み込む（設定のない項目は既定値）"""
+    rows = db.query(StoreLaborRule).filter(
+        StoreLaborRule.store_id == store_id
+    ).all()
+    return compile_labor_rules((row.rule, row.value) for row in rows)
+
+
+def save_labor_rules(
+    db: Session,
+    store_id: int,
+    values: Dict[str, Optional[int]]
+) -> LaborRules:
+    """店舗の労務ルールを更新する（値がNoneの項目は既定値に戻す）
+
+    保存前に今のルールと合わせて検証し、矛盾があれば何も書き込まない。
+    """
+    rows = {
+        row.rule: row for row in db.query(StoreLaborRule).filter(
+            StoreLaborRule.store_id == store_id
+        )
+    }
+    merged = {rule: row.value for rule, row in rows.items()}
+    merged.update(values)
+    rules = compile_labor_rules(merged.items())
+
+    for rule, value in values.items():
+        row = rows.get(rule)
+        if value is None:
+            if row is not None:
+                db.delete(row)
+        elif row is None:
+            db.add(StoreLaborRule(store_id=store_id, rule=rule, value=int(value)))
+        else:
+            row.value = int(value)
+    db.commit()
+    return rules
+
+
+def exceeds_weekly_cap(
+    hours_by_day: Dict[int, int],
+    day: int,
+    hours: int,
+    cap: Optional[int]
+) -> bool:
+    """day に hours 時間の勤務を加えると、day を含む連続7日間が上限を超えるか"""
+    if cap is None:
+        return False
+    for start in range(day - WEEK_DAYS + 1, day + 1):
+        total = hours + sum(
+            hours_by_day.get(d, 0) for d in range(start, start + WEEK_DAYS)
+            if d != day
+        )
+        if total > cap:
+            return True
+    return False
+
+
+def check_labor_rules(
+    intervals: Dict[Tuple[int, int], Tuple[int, int]],
+    staffs: List,
+    rules: LaborRules,
+    last_day: int,
+    windows: Dict[Tuple[int, int], Tuple[int, int]] = None,
+    carry_in: Dict[int, int] = None
+) -> List[Dict]:
+    """勤務表が労務ルールを守っているかをまとめて調べる
+
+    スタッフ×日の勤務時間の行列を作り、連勤・週の勤務時間は累積和の
+    差で窓ごとの合計を一度に求める。
+
+    Args:
+        intervals: (staff_id, day) → (開始時間, 終了時間)
+        staffs: 調べるスタッフのリスト
+        rules: 労務ルール
+        last_day: 月末日
+        windows: (staff_id, day) → 希望時間帯。希望時間帯が最短勤務時間
+            より短い日は最短勤務時間の違反にしない
+        carry_in: staff_id → 前月末日までの連続勤務日数
+
+    Returns:
+        violations: {"rule", "staff_id", "day", "value", "limit"} のリスト
+            （day は違反した窓の最終日）
+    """
+    violations = []
+    if not staffs:
+        return violations
+    windows = windows or {}
+    carry_in = carry_in or {}
+    row_of = {s.id: i for i, s in enumerate(staffs)}
+    # 前月からの連勤を数えるため、月初の前に max_consecutive_days 列を置く
+    offset = rules.max_consecutive_days
+    hours = np.zeros((len(staffs), offset + last_day), dtype=np.int32)
+    keys = [
+        key for key in intervals
+        if key[0] in row_of and 1 <= key[1] <= last_day
+    ]
+    if keys:
+        rows = np.array([row_of[staff_id] for staff_id, _ in keys])
+        days = np.array([day for _, day in keys])
+        bounds = np.array([intervals[key] for key in keys])
+        lengths = bounds[:, 1] - bounds[:, 0]
+        hours[rows, offset + days - 1] = lengths
+
+        available = np.array([
+            windows[key][1] - windows[key][0] if key in windows else 0
+            for key in keys
+        ])
+        short = (lengths < rules.min_shift_hours) & \
+            (available >= rules.min_shift_hours)
+        long = lengths > rules.max_shift_hours
+        end_limits = np.array([
+            rules.end_hour_limit(staffs[row]) or np.iinfo(np.int32).max
+            for row in rows
+        ])
+        late = bounds[:, 1] > end_limits
+        for i in np.flatnonzero(short):
+            violations.append({
+                "rule": "min_shift_hours", "staff_id": keys[i][0],
+                "day": keys[i][1], "value": int(lengths[i]),
+                "limit": rules.min_shift_hours,
+            })
+        for i in np.flatnonzero(long):
+            violations.append({
+                "rule": "max_shift_hours", "staff_id": keys[i][0],
+                "day": keys[i][1], "value": int(lengths[i]),
+                "limit": rules.max_shift_hours,
+            })
+        for i in np.flatnonzero(late):
+            violations.append({
+                "rule": "minor_end_hour", "staff_id": keys[i][0],
+                "day": keys[i][1], "value": int(bounds[i, 1]),
+                "limit": rules.minor_end_hour,
+            })
+
+    works = (hours > 0).astype(np.int32)
+    for staff_id, run in carry_in.items():
+        if staff_id in row_of and run:
+            works[row_of[staff_id], offset - min(run, offset):offset] = 1
+
+    # 連勤: max_consecutive_days + 1 日の窓がすべて勤務なら違反
+    span = rules.max_consecutive_days + 1
+    cumulative = np.concatenate(
+        [np.zeros((len(staffs), 1), dtype=np.int32), works.cumsum(axis=1)],
+        axis=1
+    )
+    window_sums = cumulative[:, span:] - cumulative[:, :-span]
+    for row, end in zip(*np.nonzero(window_sums == span)):
+        day = int(end) + span - offset
+        if day >= 1:
+            violations.append({
+                "rule": "max_consecutive_days", "staff_id": staffs[row].id,
+                "day": day, "value": span,
+                "limit": rules.max_consecutive_days,
+            })
+
+    # 週の勤務時間: 月内の連続7日間ごとの合計
+    caps = np.array([
+        rules.weekly_cap(s) if rules.weekly_cap(s) is not None
+        else np.iinfo(np.int32).max
+        for s in staffs
+    ])
+    if last_day >= WEEK_DAYS and (caps < np.iinfo(np.int32).max).any():
+        month_hours = hours[:, offset:]
+        cumulative = np.concatenate(
+            [np.zeros((len(staffs), 1), dtype=np.int32),
+             month_hours.cumsum(axis=1)],
+            axis=1
+        )
+        weekly = cumulative[:, WEEK_DAYS:] - cumulative[:, :-WEEK_DAYS]
+        for row, start in zip(*np.nonzero(weekly > caps[:, None])):
+            violations.append({
+                "rule": "weekly_max_hours", "staff_id": staffs[row].id,
+                "day": int(start) + WEEK_DAYS, "value": int(weekly[row, start]),
+                "limit": int(caps[row]),
+            })
+    return violations
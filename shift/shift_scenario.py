@@ -0,0 +1,243 @@
+import argparse
+import contextlib
+import dataclasses
+import io
+import json
+from datetime import datetime
+from typing import Dict, List
+from models import Shiftresult
+from .shift_metrics import compute_schedule_metrics
+from .shift_snapshot import (
+    GenerationSnapshot, RequestSnapshot, StaffSnapshot, load_snapshot
+)
+from .shift_supervisor import run_supervised_candidates
+from .shift_validator import validate_shift_requests
+
+
+BASELINE_NAME = "現状"
+
+HEADCOUNT_FIELDS = ("peak_people", "open_people", "close_people")
+
+# Webから1回に比較できるシナリオの数の上限（現状を除く）
+MAX_SCENARIOS = 5
+
+
+def apply_scenario(
+    snapshot: GenerationSnapshot,
+    scenario: Dict
+) -> GenerationSnapshot:
+    """シナリオの変更（必要人数・仮想スタッフ追加・スタッフ除外）を適用する
+
+    Args:
+        snapshot: 現状の生成入力
+        scenario: シナリオ定義
+            name: シナリオ名
+            headcounts: {曜日区分: {"peak_people": n, ...}}
+            extra_staff: [{"name", "employment_type", スキル,
+                           "weekdays": [0-6] または "days": [日],
+                           "status": "O" / "time", "start_time", "end_time"}]
+            removed_staff_ids: [staff_id]
+
+    Returns:
+        snapshot: シナリオ適用後の生成入力
+    """
+    year, month = snapshot.year, snapshot.month
+
+    # 必要人数の変更
+    headcounts = scenario.get("headcounts", {})
+    store = dataclasses.replace(
+        snapshot.store,
+        default_skill_requirements=tuple(
+            dataclasses.replace(r, **{
+                field: int(value)
+                for field, value in headcounts.get(r.day_type, {}).items()
+                if field in HEADCOUNT_FIELDS
+            })
+            for r in snapshot.store.default_skill_requirements
+        ),
+        requirements_by_day_type=None
+    )
+
+    # スタッフの除外
+    removed = set(scenario.get("removed_staff_ids", []))
+    employees = [s for s in snapshot.employees if s.id not in removed]
+    staffs = [s for s in snapshot.staffs if s.id not in removed]
+    requests = [r for r in snapshot.requests if r.staff_id not in removed]
+
+    # 仮想スタッフの追加（既存IDと衝突しないよう負のIDを使う）
+    index = len(snapshot.staff_by_id)
+    for i, extra in enumerate(scenario.get("extra_staff", []), start=1):
+        staff = StaffSnapshot(
+            id=-i,
+            index=index,
+            name=extra.get("name", f"仮スタッフ{i}"),
+            employment_type=extra.get("employment_type", "バイト"),
+            kitchen_a=extra.get("kitchen_a", "C"),
+            kitchen_b=extra.get("kitchen_b", "C"),
+            hall=int(extra.get("hall", 0)),
+            leadership=int(extra.get("leadership", 0)),
+            store_id=store.id
+        )
+        index += 1
+        if staff.employment_type == "社員":
+            employees.append(staff)
+        else:
+            staffs.append(staff)
+
+        weekdays = set(extra.get("weekdays", []))
+        days = set(extra.get("days", []))
+        for day in range(1, snapshot.last_day + 1):
+            weekday = datetime(year, month, day).weekday()
+            if day not in days and weekday not in weekdays:
+                continue
+            requests.append(RequestSnapshot(
+                staff_id=staff.id,
+                year=year,
+                month=month,
+                day=day,
+                status=extra.get("status", "O"),
+                start_time=extra.get("start_time", store.open_hours),
+                end_time=extra.get("end_time", store.close_hours)
+            ))
+
+    return dataclasses.replace(
+        snapshot, store=store, employees=tuple(employees),
+        staffs=tuple(staffs), requests=tuple(requests),
+        pins=tuple(p for p in snapshot.pins if p.staff_id not in removed),
+        staff_by_id=None
+    )
+
+
+def measure_scenario(
+    snapshot: GenerationSnapshot,
+    results: List[Shiftresult]
+) -> Dict:
+    """シナリオ適用後の入力と生成結果から指標を求める"""
+    staffs = list(snapshot.staffs)
+    with contextlib.redirect_stdout(io.StringIO()):
+        valid_requests = validate_shift_requests(
+            snapshot.requests, list(snapshot.employees) + staffs,
+            snapshot.store
+        )
+    return compute_schedule_metrics(
+        results, snapshot.store, staffs, valid_requests, snapshot.holidays,
+        snapshot.year, snapshot.month, snapshot.last_day
+    )
+
+
+def run_scenarios(
+    snapshot: GenerationSnapshot,
+    scenarios: List[Dict],
+    strategy: str = "greedy",
+    time_limit: float = 30.0,
+    max_workers: int = None,
+    job_key: str = "scenarios"
+) -> List[Dict]:
+    """現状と各シナリオを監視付きの子プロセスで並行に生成し、指標を並べて返す
+
+    Args:
+        snapshot: 現状の生成入力
+        scenarios: シナリオ定義のリスト
+        strategy: 生成方式
+        time_limit: シナリオ1つあたりの探索時間の上限（秒）
+        max_workers: 並行に生成するシナリオの数（省略時はCPU数）
+        job_key: 中止に使うキー（シナリオごとに "job_key.番号" で実行する）
+
+    Returns:
+        comparisons: 先頭が現状、以降が各シナリオの結果
+    """
+    all_scenarios = [{"name": BASELINE_NAME}] + list(scenarios)
+    applied = [apply_scenario(snapshot, scenario) for scenario in all_scenarios]
+    outcomes = run_supervised_candidates(
+        [(str(i), s) for i, s in enumerate(applied)],
+        job_key, strategy=strategy, time_limit=time_limit,
+        max_workers=max_workers
+    )
+
+    comparisons = []
+    for scenario, applied_snapshot, outcome in zip(
+        all_scenarios, applied, outcomes
+    ):
+        name = scenario.get("name", "")
+        if "error" in outcome:
+            raise ValueError(
+                f"シナリオ「{name}」の生成に失敗しました: {outcome['error']}"
+            )
+        comparisons.append({
+            "name": name,
+            "metrics": measure_scenario(applied_snapshot, outcome["results"]),
+            "elapsed": outcome["elapsed"],
+        })
+
+    baseline = comparisons[0]["metrics"]
+    for comparison in comparisons:
+        comparison["diff"] = {
+            key: comparison["metrics"][key] - baseline[key]
+            for key in (
+                "shortage_hours", "excess_hours", "rejected_days",
+                "part_time_hours", "total_hours"
+            )
+        }
+    return comparisons
+
+
+def format_comparisons(comparisons: List[Dict]) -> str:
+    """シナリオ比較を表形式の文字列にする"""
+    columns = [
+        ("充足率", lambda m: f"{m['coverage_rate']:.1%}"),
+        ("不足(h)", lambda m: m["shortage_hours"]),
+        ("過剰(h)", lambda m: m["excess_hours"]),
+        ("不採用率", lambda m: f"{m['rejection_rate']:.1%}"),
+        ("不採用(日)", lambda m: m["rejected_days"]),
+        ("バイト(h)", lambda m: m["part_time_hours"]),
+        ("総時間(h)", lambda m: m["total_hours"]),
+    ]
+    header = ["シナリオ"] + [name for name, _ in columns] + ["秒"]
+    lines = ["\t".join(header)]
+    for c in comparisons:
+        row = [c["name"]] + [str(fmt(c["metrics"])) for _, fmt in columns]
+        row.append(str(c["elapsed"]))
+        lines.append("\t".join(row))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="DBを変更せずにシフト生成のシナリオを比較する"
+    )
+    parser.add_argument("--store-id", type=int, required=True)
+    parser.add_argument("--year", type=int, required=True)
+    parser.add_argument("--month", type=int, required=True)
+    parser.add_argument(
+        "--scenarios", required=True,
+        help="シナリオ定義のJSONファイル（シナリオのリスト）"
+    )
+    parser.add_argument("--strategy", default="greedy")
+    parser.add_argument("--time-limit", type=float, default=30.0)
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="JSONで出力する")
+    args = parser.parse_args(argv)
+
+    from database import SessionLocal
+
+    with open(args.scenarios, encoding="utf-8") as f:
+        scenarios = json.load(f)
+
+    db = SessionLocal()
+    try:
+        snapshot = load_snapshot(db, args.store_id, args.year, args.month)
+    finally:
+        db.close()
+
+    comparisons = run_scenarios(
+        snapshot, scenarios, strategy=args.strategy,
+        time_limit=args.time_limit, max_workers=args.jobs
+    )
+    if args.json:
+        print(json.dumps(comparisons, ensure_ascii=False, indent=2))
+    else:
+        print(format_comparisons(comparisons))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+import calendar
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+from sqlalchemy.orm import Session
+from models import (
+    Staff, Store, ShiftRequest, ShiftPattern, StoreDefaultSkillRequirement,
+    Shift, Shiftresult, ShiftExclusion
+)
+from .shift_creator import get_holidays
+from .shift_rules import DEFAULT_LABOR_RULES, LaborRules, load_labor_rules
+
+
+@dataclass(frozen=True)
+class SkillRequirementSnapshot:
+    """曜日区分ごとの必要スキル・人数"""
+    day_type: str
+    peak_start_hour: int
+    peak_end_hour: int
+    kitchen_a: str
+    kitchen_b: str
+    hall: int
+    leadership: int
+    peak_people: int
+    open_people: int
+    close_people: int
+    store_id: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class PatternSnapshot:
+    """シフトパターン"""
+    id: int
+    name: str
+    start_time: int
+    end_time: int
+    is_fulltime: bool = False
+    default: bool = False
+    store_id: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class StoreSnapshot:
+    """店舗情報（曜日区分ごとの必要人数を辞書で引ける）"""
+    id: int
+    name: str
+    open_hours: int
+    close_hours: int
+    default_skill_requirements: Tuple[SkillRequirementSnapshot, ...] = ()
+    shift_patterns: Tuple[PatternSnapshot, ...] = ()
+    requirements_by_day_type: Dict[str, SkillRequirementSnapshot] = field(
+        default=None, compare=False, repr=False
+    )
+
+    def __post_init__(self):
+        if self.requirements_by_day_type is None:
+            object.__setattr__(self, "requirements_by_day_type", {
+                r.day_type: r for r in self.default_skill_requirements
+            })
+
+    def get_skill_requirement(
+        self, day_type: str
+    ) -> Optional[SkillRequirementSnapshot]:
+        return self.requirements_by_day_type.get(day_type)
+
+
+@dataclass(frozen=True)
+class StaffSnapshot:
+    """スタッフ（indexは社員・バイトを通した0始まりの連番）"""
+    id: int
+    index: int
+    name: str
+    employment_type: str
+    kitchen_a: str
+    kitchen_b: str
+    hall: int
+    leadership: int
+    store_id: Optional[int] = None
+
+    @property
+    def is_minor(self) -> bool:
+        return self.employment_type == "未成年バイト"
+
+
+@dataclass(frozen=True)
+class RequestSnapshot:
+    """シフト希望"""
+    staff_id: int
+    year: int
+    month: int
+    day: int
+    status: Optional[str]
+    start_time: Optional[int]
+    end_time: Optional[int]
+    id: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class PinSnapshot:
+    """手動で固定したセル（開始・終了時間がNoneなら勤務させない）"""
+    staff_id: int
+    day: int
+    start_time: Optional[int] = None
+    end_time: Optional[int] = None
+
+    @property
+    def is_exclusion(self) -> bool:
+        return self.start_time is None
+
+
+@dataclass(frozen=True)
+class GenerationSnapshot:
+    """シフト生成の入力一式
+
+    DBセッションに依存しないため、pickleして別プロセスに渡せる。
+    """
+    store: StoreSnapshot
+    employees: Tuple[StaffSnapshot, ...]
+    staffs: Tuple[StaffSnapshot, ...]
+    requests: Tuple[RequestSnapshot, ...]
+    patterns: Tuple[PatternSnapshot, ...]
+    holidays: FrozenSet[datetime.date]
+    year: int
+    month: int
+    last_day: int
+    pins: Tuple[PinSnapshot, ...] = ()
+    # 前月の確定シフト (staff_id, 日, 開始時間, 終了時間)。ウォームスタート用
+    previous_shifts: Tuple[Tuple[int, int, int, int], ...] = ()
+    # 店舗の労務ルール（連勤・勤務時間・未成年の終業時刻・週の上限）
+    rules: LaborRules = DEFAULT_LABOR_RULES
+    staff_by_id: Dict[int, StaffSnapshot] = field(
+        default=None, compare=False, repr=False
+    )
+
+    def __post_init__(self):
+        if self.staff_by_id is None:
+            object.__setattr__(self, "staff_by_id", {
+                s.id: s for s in self.employees + self.staffs
+            })
+
+
+def freeze_skill_requirement(r) -> SkillRequirementSnapshot:
+    if isinstance(r, SkillRequirementSnapshot):
+        return r
+    return SkillRequirementSnapshot(
+        day_type=r.day_type,
+        peak_start_hour=r.peak_start_hour,
+        peak_end_hour=r.peak_end_hour,
+        kitchen_a=r.kitchen_a,
+        kitchen_b=r.kitchen_b,
+        hall=r.hall,
+        leadership=r.leadership,
+        peak_people=r.peak_people,
+        open_people=r.open_people,
+        close_people=r.close_people,
+        store_id=r.store_id
+    )
+
+
+def freeze_pattern(p) -> PatternSnapshot:
+    if isinstance(p, PatternSnapshot):
+        return p
+    return PatternSnapshot(
+        id=p.id,
+        name=p.name,
+        start_time=p.start_time,
+        end_time=p.end_time,
+        is_fulltime=bool(p.is_fulltime),
+        default=bool(p.default),
+        store_id=p.store_id
+    )
+
+
+def freeze_store(
+    store,
+    requirements: Iterable = None,
+    patterns: Iterable = None
+) -> StoreSnapshot:
+    """店舗をスナップショットに変換する
+
+    Args:
+        store: 店舗（ORMオブジェクトまたはスナップショット）
+        requirements: 必要スキル設定（省略時は store から取得）
+        patterns: シフトパターン（省略時は store から取得）
+    """
+    if isinstance(store, StoreSnapshot) and requirements is None \
+            and patterns is None:
+        return store
+    if requirements is None:
+        requirements = store.default_skill_requirements
+    if patterns is None:
+        patterns = store.shift_patterns
+    return StoreSnapshot(
+        id=store.id,
+        name=store.name,
+        open_hours=store.open_hours,
+        close_hours=store.close_hours,
+        default_skill_requirements=tuple(
+            freeze_skill_requirement(r) for r in requirements
+        ),
+        shift_patterns=tuple(freeze_pattern(p) for p in patterns)
+    )
+
+
+def freeze_staff(staff, index: int) -> StaffSnapshot:
+    if isinstance(staff, StaffSnapshot) and staff.index == index:
+        return staff
+    return StaffSnapshot(
+        id=staff.id,
+        index=index,
+        name=staff.name,
+        employment_type=staff.employment_type,
+        kitchen_a=staff.kitchen_a,
+        kitchen_b=staff.kitchen_b,
+        hall=staff.hall,
+        leadership=staff.leadership,
+        store_id=staff.store_id
+    )
+
+
+def freeze_request(req) -> RequestSnapshot:
+    if isinstance(req, RequestSnapshot):
+        return req
+    return RequestSnapshot(
+        staff_id=req.staff_id,
+        year=req.year,
+        month=req.month,
+        day=req.day,
+        status=req.status,
+        start_time=req.start_time,
+        end_time=req.end_time,
+        id=req.id
+    )
+
+
+def build_snapshot(
+    store,
+    employees: Iterable,
+    staffs: Iterable,
+    requests: Iterable,
+    patterns: Iterable,
+    holidays: Iterable[datetime.date],
+    year: int,
+    month: int,
+    pins: Iterable[PinSnapshot] = (),
+    previous_shifts: Iterable[Tuple[int, int, int, int]] = (),
+    rules: LaborRules = DEFAULT_LABOR_RULES
+) -> GenerationSnapshot:
+    """生成の入力（ORMオブジェクトまたはスナップショット）を固定する
+
+    Args:
+        store: 店舗情報
+        employees: 社員リスト
+        staffs: バイトスタッフリスト
+        requests: シフト希望リスト
+        patterns: シフトパターンリスト
+        holidays: 祝日
+        year: 年
+        month: 月
+        pins: 手動で固定したセル
+        previous_shifts: 前月の確定シフト (staff_id, 日, 開始時間, 終了時間)
+        rules: 店舗の労務ルール
+
+    Returns:
+        snapshot: 生成入力のスナップショット
+    """
+    patterns = tuple(freeze_pattern(p) for p in patterns)
+    store = freeze_store(
+        store, requirements=store.default_skill_requirements,
+        patterns=patterns
+    )
+    employees = list(employees)
+    members = [
+        freeze_staff(s, index)
+        for index, s in enumerate(employees + list(staffs))
+    ]
+    return GenerationSnapshot(
+        store=store,
+        employees=tuple(members[:len(employees)]),
+        staffs=tuple(members[len(employees):]),
+        requests=tuple(freeze_request(r) for r in requests),
+        patterns=patterns,
+        holidays=frozenset(holidays),
+        year=year,
+        month=month,
+        last_day=calendar.monthrange(year, month)[1],
+        pins=tuple(pins),
+        previous_shifts=tuple(tuple(shift) for shift in previous_shifts),
+        rules=rules
+    )
+
+
+def load_pins(
+    db: Session,
+    staff_ids: Iterable[int],
+    year: int,
+    month: int
+) -> Tuple[PinSnapshot, ...]:
+    """固定されたシフトと勤務させない日を読み込む
+
+    同じセルに両方ある場合は固定されたシフトを優先する。
+    """
+    staff_ids = list(staff_ids)
+    if not staff_ids:
+        return ()
+    pinned = db.query(Shiftresult).filter(
+        Shiftresult.year == year,
+        Shiftresult.month == month,
+        Shiftresult.staff_id.in_(staff_ids),
+        Shiftresult.pinned.is_(True)
+    ).order_by(Shiftresult.id).all()
+    exclusions = db.query(ShiftExclusion).filter(
+        ShiftExclusion.year == year,
+        ShiftExclusion.month == month,
+        ShiftExclusion.staff_id.in_(staff_ids)
+    ).all()
+
+    pins = {}
+    for r in pinned:
+        pins.setdefault(
+            (r.staff_id, r.day),
+            PinSnapshot(r.staff_id, r.day, r.start_time, r.end_time)
+        )
+    for e in exclusions:
+        pins.setdefault((e.staff_id, e.day), PinSnapshot(e.staff_id, e.day))
+    return tuple(pins[key] for key in sorted(pins))
+
+
+def load_previous_shifts(
+    db: Session,
+    staff_ids: Iterable[int],
+    year: int,
+    month: int
+) -> Tuple[Tuple[int, int, int, int], ...]:
+    """前月の確定シフト（Shift）を読み込む
+
+    Returns:
+        shifts: (staff_id, 日, 開始時間, 終了時間) のタプル
+    """
+    staff_ids = list(staff_ids)
+    if not staff_ids:
+        return ()
+    year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    shifts = db.query(Shift).filter(
+        Shift.year == year,
+        Shift.month == month,
+        Shift.staff_id.in_(staff_ids)
+    ).order_by(Shift.staff_id, Shift.date).all()
+    return tuple(
+        (s.staff_id, s.date, s.start_time, s.end_time) for s in shifts
+    )
+
+
+def load_snapshot(
+    db: Session,
+    store_id: int,
+    year: int,
+    month: int,
+    holidays: Iterable[datetime.date] = None,
+    warm_start: bool = False
+) -> GenerationSnapshot:
+    """店舗・スタッフ・希望・パターンをまとめて読み込みスナップショットにする
+
+    関連の遅延読み込みは使わず、テーブルごとに1回ずつ問い合わせる。
+
+    Args:
+        db: DBセッション
+        store_id: 店舗ID
+        year: 年
+        month: 月
+        holidays: 祝日（省略時は jpholiday から取得）
+        warm_start: 前月の確定シフトも読み込み、解のヒントに使うか
+
+    Returns:
+        snapshot: 生成入力のスナップショット
+    """
+    store = db.query(Store).filter(Store.id == store_id).first()
+    if not store:
+        raise ValueError("店舗が見つかりません")
+
+    requirements = db.query(StoreDefaultSkillRequirement).filter(
+        StoreDefaultSkillRequirement.store_id == store_id
+    ).all()
+    patterns = db.query(ShiftPattern).filter(
+        ShiftPattern.store_id == store_id
+    ).order_by(ShiftPattern.id).all()
+    members = db.query(Staff).filter(
+        Staff.store_id == store_id
+    ).order_by(Staff.id).all()
+    requests = db.query(ShiftRequest).join(
+        Staff, Staff.id == ShiftRequest.staff_id
+    ).filter(
+        Staff.store_id == store_id,
+        ShiftRequest.year == year,
+        ShiftRequest.month == month
+    ).all()
+
+    if holidays is None:
+        holidays = get_holidays(year, month)
+
+    pins = load_pins(db, [s.id for s in members], year, month)
+    previous_shifts = load_previous_shifts(
+        db, [s.id for s in members], year, month
+    ) if warm_start else ()
+    rules = load_labor_rules(db, store_id)
+
+    store = freeze_store(store, requirements=requirements, patterns=patterns)
+    return build_snapshot(
+        store,
+        [s for s in members if s.employment_type == "社員"],
+        [s for s in members if s.employment_type != "社員"],
+        requests, patterns, holidays, year, month, pins=pins,
+        previous_shifts=previous_shifts, rules=rules
+    )
@@ -0,0 +1,595 @@
+import contextlib
+import multiprocessing
+import os
+import resource
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import wait
+from typing import Callable, Dict, List, Tuple
+from sqlalchemy.orm import Session
+from models import Shiftresult
+from .shift_cache import (
+    compute_snapshot_hash,
+    load_cached_results,
+    store_cached_results
+)
+from .shift_snapshot import GenerationSnapshot
+
+
+# 子プロセスのメモリ上限（MB）
+MEMORY_LIMIT_MB = int(os.getenv("SHIFT_SOLVER_MEMORY_MB", "2048"))
+
+# 探索時間に加えて待つ時間（秒）。プロセス起動・入力検証・結果の受け渡し分
+WALL_CLOCK_GRACE = float(os.getenv("SHIFT_SOLVER_GRACE_SECONDS", "30"))
+
+# 子プロセスの優先度を下げ、Webの処理にCPUを譲る
+NICE_INCREMENT = 10
+
+# 停止を要求してから強制終了するまでの待ち時間（秒）
+TERMINATE_TIMEOUT = 1.0
+
+# Webのワーカーはスレッドを持つため、fork ではなく spawn で起動する
+_context = multiprocessing.get_context("spawn")
+
+# 実行中の生成を記録するディレクトリ。Webのワーカーが複数でも、
+# どのワーカーに届いた中止・打ち切りの要求も生成中のプロセスに伝える
+RUN_DIR = os.getenv(
+    "SHIFT_SOLVER_RUN_DIR",
+    os.path.join(tempfile.gettempdir(), "shift_generation")
+)
+
+# 監視中に他のワーカーからの中止・打ち切りの要求を確かめる間隔（秒）
+CONTROL_POLL_INTERVAL = 0.2
+
+# Webから指定できる探索時間の上限（秒）
+MAX_TIME_LIMIT = float(os.getenv("SHIFT_SOLVER_MAX_TIME_LIMIT", "120"))
+
+_running = {}
+_running_lock = threading.Lock()
+
+
+class GenerationCancelled(ValueError):
+    """生成が中止された"""
+
+
+def generation_job_key(store_id: int, year: int, month: int) -> str:
+    """店舗・年月から生成ジョブのキーを作る"""
+    return f"{store_id}-{year}-{month}"
+
+
+def job_file(job_key: str, kind: str) -> str:
+    """生成ジョブの記録ファイルのパス（kind: pid / cancel / stop）"""
+    return os.path.join(RUN_DIR, f"{job_key}.{kind}")
+
+
+def process_alive(pid: int) -> bool:
+    """同じホストのプロセスが動いているか"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_job_pids(job_key: str) -> Tuple[int, int]:
+    """記録した (監視しているワーカーのpid, 子プロセスのpid) を読む
+
+    子プロセスの起動前は子プロセスのpidをNoneとする。
+    記録がない場合や監視していたワーカーが終了している場合は (None, None)。
+    """
+    try:
+        with open(job_file(job_key, "pid")) as f:
+            pids = [int(pid) for pid in f.read().split()]
+    except (FileNotFoundError, ValueError):
+        return None, None
+    if not pids or not process_alive(pids[0]):
+        return None, None
+    return pids[0], pids[1] if len(pids) > 1 else None
+
+
+def claim_job(job_key: str) -> None:
+    """生成ジョブの記録を作る（他のワーカーで実行中ならValueError）
+
+    記録は排他的に作成するため、同じ job_key の生成はワーカーを
+    またいでも同時に1つだけになる。
+    """
+    os.makedirs(RUN_DIR, exist_ok=True)
+    for _ in range(2):
+        try:
+            fd = os.open(
+                job_file(job_key, "pid"), os.O_CREAT | os.O_EXCL | os.O_WRONLY
+            )
+        except FileExistsError:
+            if read_job_pids(job_key)[0] is not None:
+                raise ValueError("このシフトは既に生成中です")
+            # 異常終了したワーカーの記録は消して作り直す
+            release_job(job_key)
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        for kind in ("cancel", "stop"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(job_file(job_key, kind))
+        return
+    raise ValueError("このシフトは既に生成中です")
+
+
+def record_child(job_key: str, pid: int) -> None:
+    """起動した子プロセスのpid（プロセスグループのID）を記録する"""
+    with open(job_file(job_key, "pid"), "w") as f:
+        f.write(f"{os.getpid()} {pid}")
+
+
+def release_job(job_key: str) -> None:
+    """生成ジョブの記録と中止・打ち切りの要求を消す"""
+    for kind in ("pid", "cancel", "stop"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(job_file(job_key, kind))
+
+
+def matching_job_keys(job_key: str) -> List[str]:
+    """job_key と、その下位のジョブ（"job_key.名前"）のキー
+
+    代替案やシナリオは店舗・年月のキーの下に候補ごとのキーを作るため、
+    店舗・年月のキーで中止するとまとめて止まる。
+    """
+    keys = {job_key}
+    with _running_lock:
+        keys.update(key for key in _running if key.startswith(job_key + "."))
+    if os.path.isdir(RUN_DIR):
+        prefix = job_key + "."
+        keys.update(
+            name[:-len(".pid")] for name in os.listdir(RUN_DIR)
+            if name.startswith(prefix) and name.endswith(".pid")
+        )
+    return sorted(keys)
+
+
+def limit_child_resources(memory_limit_mb: int) -> None:
+    """子プロセス自身のメモリ上限と優先度を設定する
+
+    LinuxではRSSの上限（RLIMIT_RSS）が効かないため、仮想メモリの上限
+    （RLIMIT_AS）で代用する。子プロセスは自分を先頭とするプロセスグループを
+    作り、停止するときに子プロセスが起動したプロセスごと止められるようにする。
+    """
+    os.setpgid(0, 0)
+    if memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    os.nice(NICE_INCREMENT)
+
+
+def run_generation_child(
+    snapshot: GenerationSnapshot,
+    strategy: str,
+    time_limit: float,
+    memory_limit_mb: int,
+    conn,
+    day_range: Tuple[int, int] = None,
+    fixed_results: List[Tuple[int, int, int, int]] = None,
+    stop_event=None
+) -> None:
+    """子プロセスでシフトを生成し、結果をパイプで返す（DBには触れない）
+
+    生成中の進捗は {"progress": イベント} として同じパイプで先に送る。
+    """
+    from .shift_progress import progress_sink
+
+    send_lock = threading.Lock()
+
+    def send_progress(event: Dict) -> None:
+        # CP-SATの改善解はソルバーのスレッドから通知される
+        with send_lock:
+            conn.send({"progress": event})
+
+    try:
+        limit_child_resources(memory_limit_mb)
+        with progress_sink(send_progress, stop_event):
+            results = generate_in_child(
+                snapshot, strategy, time_limit, day_range, fixed_results
+            )
+        with send_lock:
+            conn.send({
+                "results": [
+                    (r.staff_id, r.day, r.start_time, r.end_time)
+                    for r in results
+                ]
+            })
+    except MemoryError:
+        conn.send({"error": f"メモリ上限（{memory_limit_mb}MB）を超えました"})
+    except Exception as e:
+        conn.send({"error": str(e)})
+    finally:
+        conn.close()
+
+
+def generate_in_child(
+    snapshot: GenerationSnapshot,
+    strategy: str,
+    time_limit: float,
+    day_range: Tuple[int, int] = None,
+    fixed_results: List[Tuple[int, int, int, int]] = None
+) -> List[Shiftresult]:
+    """子プロセス内で月全体または日付範囲のシフトを生成する"""
+    if day_range:
+        from .shift_partial import regenerate_day_range
+        return regenerate_day_range(
+            snapshot, day_range[0], day_range[1], fixed_results or [],
+            time_limit=time_limit
+        )
+    from .shift_generator import generate_shift_results_with_ortools
+    return generate_shift_results_with_ortools(
+        snapshot.store, snapshot.employees, snapshot.staffs,
+        snapshot.requests, snapshot.patterns, snapshot.holidays,
+        snapshot.year, snapshot.month, db=None, strategy=strategy,
+        time_limit=time_limit, pins=snapshot.pins,
+        previous_shifts=snapshot.previous_shifts, rules=snapshot.rules
+    )
+
+
+def signal_process_group(process, signum: int) -> None:
+    """子プロセスのプロセスグループ全体にシグナルを送る"""
+    try:
+        os.killpg(process.pid, signum)
+    except (ProcessLookupError, PermissionError):
+        # プロセスグループを作る前なら子プロセスだけに送る
+        if process.is_alive():
+            os.kill(process.pid, signum)
+
+
+def stop_process(process) -> None:
+    """子プロセスを停止する（応答がなければ強制終了する）
+
+    ポートフォリオのように子プロセスが起動したプロセスも、
+    同じプロセスグループごと停止する。
+    """
+    if process.is_alive():
+        signal_process_group(process, signal.SIGTERM)
+    process.join(timeout=TERMINATE_TIMEOUT)
+    if process.is_alive():
+        signal_process_group(process, signal.SIGKILL)
+        process.join()
+    # 子プロセスが先に終わっても、残ったプロセスがあれば止める
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def new_stop_event():
+    """子プロセスと共有できる打ち切り要求のイベントを作る"""
+    return _context.Event()
+
+
+def run_supervised_generation(
+    snapshot: GenerationSnapshot,
+    job_key: str,
+    strategy: str = "greedy",
+    time_limit: float = 30.0,
+    wall_clock_limit: float = None,
+    memory_limit_mb: int = MEMORY_LIMIT_MB,
+    day_range: Tuple[int, int] = None,
+    fixed_results: List[Tuple[int, int, int, int]] = None,
+    on_progress: Callable[[Dict], None] = None,
+    stop_event=None
+) -> List[Shiftresult]:
+    """シフト生成を監視付きの子プロセスで実行する
+
+    子プロセスにはメモリ上限を設定し、期限を過ぎた場合や
+    cancel_generation で中止された場合は停止する。
+    stop_generation で打ち切った場合はその時点の最良解を返す。
+    同じ job_key の生成は、Webのワーカーをまたいでも同時に1つだけ
+    実行できる（RUN_DIR の記録で排他する）。
+
+    Args:
+        snapshot: 生成入力のスナップショット
+        job_key: 中止に使うキー（店舗・年月ごと）
+        strategy: 生成方式
+        time_limit: 探索時間の上限（秒）
+        wall_clock_limit: 子プロセスを停止するまでの時間（秒）。
+            省略時は time_limit + WALL_CLOCK_GRACE
+        memory_limit_mb: 子プロセスのメモリ上限（MB）
+        day_range: (開始日, 終了日)。指定した場合はこの範囲だけを作り直す
+        fixed_results: day_range 外で固定する保存済みのシフト
+            (staff_id, day, 開始時間, 終了時間)
+        on_progress: 子プロセスからの進捗イベントを受け取る関数
+        stop_event: 打ち切りの要求に使うイベント（new_stop_event で作る）。
+            省略時は内部で作る
+
+    Returns:
+        results: シフト結果のリスト（DB未保存）
+    """
+    if wall_clock_limit is None:
+        wall_clock_limit = time_limit + WALL_CLOCK_GRACE
+
+    parent_conn, child_conn = _context.Pipe(duplex=False)
+    if stop_event is None:
+        stop_event = new_stop_event()
+    # ポートフォリオは子プロセスの中で方式ごとのプロセスを起動するため、
+    # daemon にはしない（daemon のプロセスは子プロセスを持てない）。
+    # 停止は stop_process がプロセスグループごと行う
+    process = _context.Process(
+        target=run_generation_child,
+        args=(
+            snapshot, strategy, time_limit, memory_limit_mb, child_conn,
+            day_range, fixed_results, stop_event
+        ),
+        daemon=False
+    )
+    job = {"process": process, "cancelled": False, "stop": stop_event}
+    with _running_lock:
+        if job_key in _running:
+            raise ValueError("このシフトは既に生成中です")
+        _running[job_key] = job
+    try:
+        claim_job(job_key)
+    except ValueError:
+        with _running_lock:
+            _running.pop(job_key, None)
+        raise
+
+    started = time.perf_counter()
+    try:
+        process.start()
+        child_conn.close()
+        record_child(job_key, process.pid)
+        if job["cancelled"]:
+            raise GenerationCancelled("シフトの生成が中止されました")
+        print(f"生成プロセスを開始しました: {job_key} (pid={process.pid}, "
+              f"期限 {wall_clock_limit:.0f}秒, "
+              f"メモリ上限 {memory_limit_mb}MB)")
+
+        message = None
+        deadline = started + wall_clock_limit
+        while True:
+            # 他のワーカーに届いた中止・打ち切りの要求を反映する
+            if os.path.exists(job_file(job_key, "cancel")):
+                break
+            if os.path.exists(job_file(job_key, "stop")):
+                stop_event.set()
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            if not wait(
+                [parent_conn], timeout=min(remaining, CONTROL_POLL_INTERVAL)
+            ):
+                continue
+            try:
+                message = parent_conn.recv()
+            except EOFError:
+                message = None
+                break
+            if "progress" not in message:
+                break
+            if on_progress:
+                on_progress(message["progress"])
+            message = None
+        elapsed = time.perf_counter() - started
+        if os.path.exists(job_file(job_key, "cancel")):
+            job["cancelled"] = True
+
+        if job["cancelled"]:
+            raise GenerationCancelled("シフトの生成が中止されました")
+        if message is None:
+            if elapsed >= wall_clock_limit:
+                raise ValueError(
+                    f"シフトの生成が{wall_clock_limit:.0f}秒以内に"
+                    f"終わりませんでした"
+                )
+            raise ValueError(
+                f"生成プロセスが異常終了しました "
+                f"(終了コード {process.exitcode})"
+            )
+        if "error" in message:
+            raise ValueError(message["error"])
+        print(f"生成プロセスが完了しました: {job_key} ({elapsed:.1f}秒)")
+    finally:
+        if process.pid is not None:
+            stop_process(process)
+        parent_conn.close()
+        with _running_lock:
+            _running.pop(job_key, None)
+        release_job(job_key)
+
+    return [
+        Shiftresult(
+            staff_id=staff_id,
+            year=snapshot.year,
+            month=snapshot.month,
+            day=day,
+            start_time=start,
+            end_time=end
+        )
+        for staff_id, day, start, end in message["results"]
+    ]
+
+
+def run_cached_generation(
+    db: Session,
+    snapshot: GenerationSnapshot,
+    job_key: str,
+    strategy: str = "greedy",
+    time_limit: float = 30.0,
+    on_progress: Callable[[Dict], None] = None,
+    **kwargs
+) -> List[Shiftresult]:
+    """解のキャッシュを親プロセスで引き、なければ監視付きで生成する
+
+    子プロセスはDBセッションを持たないため、キャッシュの参照と保存は
+    ここで行う。打ち切った生成の結果は最良解とは限らないため保存しない。
+    コミットは呼び出し側（save_shift_results）に任せる。
+
+    Args:
+        db: DBセッション
+        snapshot: 生成入力のスナップショット
+        job_key: 中止に使うキー（店舗・年月ごと）
+        strategy: 生成方式
+        time_limit: 探索時間の上限（秒）
+        on_progress: 進捗イベントを受け取る関数
+        **kwargs: run_supervised_generation に渡すその他の引数
+
+    Returns:
+        results: シフト結果のリスト（DB未保存）
+    """
+    input_hash = compute_snapshot_hash(snapshot, strategy, time_limit)
+    results = load_cached_results(
+        db, input_hash, snapshot.year, snapshot.month
+    )
+    if results is not None:
+        print(f"同一入力の生成結果をキャッシュから取得しました: {job_key}")
+        if on_progress:
+            on_progress({
+                "type": "phase", "phase": "cache",
+                "message": "同一入力の生成結果を再利用します",
+            })
+        return results
+
+    stop_event = new_stop_event()
+    results = run_supervised_generation(
+        snapshot, job_key, strategy=strategy, time_limit=time_limit,
+        on_progress=on_progress, stop_event=stop_event, **kwargs
+    )
+    if not stop_event.is_set():
+        store_cached_results(
+            db, snapshot.store.id, input_hash, snapshot.year, snapshot.month,
+            results
+        )
+    return results
+
+
+def run_supervised_candidates(
+    candidates: List[Tuple[str, GenerationSnapshot]],
+    job_key: str,
+    strategy: str = "greedy",
+    time_limit: float = 30.0,
+    max_workers: int = None
+) -> List[Dict]:
+    """複数の入力をそれぞれ監視付きの子プロセスで並行に生成する
+
+    代替案やシナリオ比較のように1回の要求で複数回生成する場合に使う。
+    候補ごとに "job_key.名前" のキーで run_supervised_generation を呼ぶため、
+    メモリ上限・期限はそのまま効き、cancel_generation(job_key) または
+    店舗・年月のキーでの中止で未着手の候補も含めてまとめて止まる。
+
+    Args:
+        candidates: (名前, 生成入力のスナップショット) のリスト
+        job_key: 候補全体のキー
+        strategy: 生成方式
+        time_limit: 候補1つあたりの探索時間の上限（秒）
+        max_workers: 並行に生成する候補の数（省略時はCPU数）
+
+    Returns:
+        outcomes: 候補の順の {"results" または "error", "elapsed"}
+
+    Raises:
+        ValueError: 同じキーの生成が実行中の場合
+        GenerationCancelled: 中止された場合
+    """
+    if max_workers is None:
+        max_workers = min(len(candidates), os.cpu_count() or 1)
+    claim_job(job_key)
+
+    def run(name: str, snapshot: GenerationSnapshot) -> Dict:
+        if os.path.exists(job_file(job_key, "cancel")):
+            raise GenerationCancelled("シフトの生成が中止されました")
+        started = time.perf_counter()
+        try:
+            results = run_supervised_generation(
+                snapshot, f"{job_key}.{name}", strategy=strategy,
+                time_limit=time_limit
+            )
+        except GenerationCancelled:
+            raise
+        except ValueError as e:
+            return {
+                "error": str(e),
+                "elapsed": round(time.perf_counter() - started, 3),
+            }
+        return {
+            "results": results,
+            "elapsed": round(time.perf_counter() - started, 3),
+        }
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = [
+                executor.submit(run, name, snapshot)
+                for name, snapshot in candidates
+            ]
+            outcomes = []
+            for future in futures:
+                try:
+                    outcomes.append(future.result())
+                except GenerationCancelled:
+                    # 実行中の候補を止め、未着手の候補は始めない
+                    cancel_generation(job_key)
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+    finally:
+        release_job(job_key)
+    return outcomes
+
+
+def cancel_generation(job_key: str) -> bool:
+    """実行中の生成を中止する
+
+    このワーカーで実行中の生成はその場で止める。他のワーカーで実行中の
+    生成は中止の要求を記録し、子プロセスのプロセスグループに停止を送る
+    （監視しているワーカーが要求を見て中止として終える）。
+    job_key の下位のジョブ（代替案・シナリオの候補）もまとめて中止する。
+
+    Returns:
+        中止した場合はTrue（実行中の生成がなければFalse）
+    """
+    cancelled = False
+    for key in matching_job_keys(job_key):
+        with _running_lock:
+            job = _running.get(key)
+            if job is not None:
+                job["cancelled"] = True
+        if job is not None:
+            if job["process"].pid is not None:
+                stop_process(job["process"])
+        else:
+            owner, child = read_job_pids(key)
+            if owner is None:
+                continue
+            with open(job_file(key, "cancel"), "w"):
+                pass
+            if child is not None:
+                with contextlib.suppress(ProcessLookupError, PermissionError):
+                    os.killpg(child, signal.SIGTERM)
+        print(f"生成プロセスを中止しました: {key}")
+        cancelled = True
+    return cancelled
+
+
+def stop_generation(job_key: str) -> bool:
+    """実行中の生成の探索を打ち切り、その時点の最良解で完了させる
+
+    cancel_generation と違い、子プロセスは止めずに結果を返させる。
+    他のワーカーで実行中の生成には打ち切りの要求を記録する。
+
+    Returns:
+        打ち切りを要求した場合はTrue（実行中の生成がなければFalse）
+    """
+    stopped = False
+    for key in matching_job_keys(job_key):
+        with _running_lock:
+            job = _running.get(key)
+            if job is not None:
+                job["stop"].set()
+        if job is None:
+            if read_job_pids(key)[0] is None:
+                continue
+            with open(job_file(key, "stop"), "w"):
+                pass
+        print(f"生成の探索の打ち切りを要求しました: {key}")
+        stopped = True
+    return stopped
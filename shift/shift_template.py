@@ -0,0 +1,490 @@
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+from ortools.sat.python import cp_model
+from models import Staff, Store, ShiftPattern, ShiftRequest
+from .shift_optimizer import (
+    add_consecutive_days_constraint,
+    add_weekly_hours_constraint,
+    can_work_pattern
+)
+from .shift_progress import report_phase, solve_with_progress
+from .shift_rules import DEFAULT_LABOR_RULES, WEEK_DAYS, LaborRules
+
+
+# 保持するテンプレートの最大数（超えた分は最後に使った日時の古い順に捨てる）
+MAX_TEMPLATES = 16
+
+# テンプレートの構造を変更した場合はこの値を上げる
+TEMPLATE_VERSION = 3
+
+# コンパイル済みのテンプレートを保存するディレクトリ。生成は実行ごとに
+# 起動する子プロセスで行うため、プロセス内の保持だけでは再利用されない
+TEMPLATE_DIR = os.getenv(
+    "SHIFT_TEMPLATE_DIR",
+    os.path.join(tempfile.gettempdir(), "shift_templates")
+)
+
+# 保存しておくテンプレートの最大数（超えた分は最後に使った日時の古い順に消す）
+MAX_TEMPLATE_FILES = 64
+
+_templates = OrderedDict()
+_templates_lock = threading.Lock()
+
+
+@dataclass
+class PatternModelTemplate:
+    """店舗構成ごとにコンパイル済みのシフトパターン割り当てモデル
+
+    希望・必要人数・目標日数に依存しない構造（全スタッフ×全日×全パターンの
+    変数、1日1パターン、時間帯、連勤、週の勤務時間、過不足、公平性）だけを持ち、
+    実行ごとに複製して変数の上下限を書き換えて使う。
+    """
+    key: str
+    model: cp_model.CpModel
+    x: Dict[Tuple[int, int, int], int]
+    required: Dict[Tuple[int, int], int]
+    shortages: Dict[Tuple[int, int], int]
+    targets: Dict[int, int]
+    build_seconds: float
+
+
+def compute_template_key(
+    store: Store,
+    staffs: List[Staff],
+    patterns: List[ShiftPattern],
+    last_day: int,
+    rules: LaborRules = DEFAULT_LABOR_RULES
+) -> str:
+    """モデルの構造を決める店舗構成からテンプレートのキーを計算する"""
+    payload = {
+        "version": TEMPLATE_VERSION,
+        "store": [store.id, store.open_hours, store.close_hours],
+        "staffs": [[s.id, rules.weekly_cap(s)] for s in staffs],
+        "patterns": sorted(
+            [p.id, p.start_time, p.end_time] for p in patterns
+        ),
+        "last_day": last_day,
+        "max_consecutive_days": rules.max_consecutive_days,
+    }
+    encoded = json.dumps(payload, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def compile_pattern_template(
+    store: Store,
+    staffs: List[Staff],
+    patterns: List[ShiftPattern],
+    last_day: int,
+    rules: LaborRules = DEFAULT_LABOR_RULES
+) -> PatternModelTemplate:
+    """店舗構成からシフトパターン割り当てモデルの構造を組み立てる
+
+    目的関数の重みは assign_shift_patterns / add_fairness_penalties と同じ。
+
+    Args:
+        store: 店舗情報
+        staffs: バイトスタッフリスト
+        patterns: シフトパターンリスト
+        last_day: 月末日
+        rules: 労務ルール（連勤と週の勤務時間はモデルの構造に含める）
+
+    Returns:
+        template: コンパイル済みのテンプレート
+    """
+    started = time.perf_counter()
+    model = cp_model.CpModel()
+    days = range(1, last_day + 1)
+    hours = range(store.open_hours, store.close_hours)
+    x = {}
+    y = defaultdict(list)
+    works = {}
+    for s in staffs:
+        for day in days:
+            pattern_vars = []
+            for p in patterns:
+                var = model.NewBoolVar(f"x_s{s.id}_d{day}_p{p.id}")
+                x[(s.id, day, p.id)] = var
+                pattern_vars.append(var)
+            model.AddAtMostOne(pattern_vars)
+            works[(s.id, day)] = pattern_vars
+
+            for hour in hours:
+                covering = [
+                    x[(s.id, day, p.id)] for p in patterns
+                    if p.start_time <= hour < p.end_time
+                ]
+                if not covering:
+                    continue
+                y_var = model.NewBoolVar(f"y_s{s.id}_d{day}_h{hour}")
+                model.AddMaxEquality(y_var, covering)
+                y[(day, hour)].append(y_var)
+
+    objective_terms = []
+    required = {}
+    shortages = {}
+    for day in days:
+        for hour in hours:
+            staff_vars = y[(day, hour)]
+            required_var = model.NewIntVar(
+                0, len(staffs), f"required_d{day}_h{hour}"
+            )
+            shortage = model.NewIntVar(
+                0, len(staffs), f"shortage_d{day}_h{hour}"
+            )
+            excess = model.NewIntVar(
+                0, max(1, len(staff_vars)), f"excess_d{day}_h{hour}"
+            )
+            model.Add(sum(staff_vars) + shortage - excess == required_var)
+            objective_terms.append(shortage * 20)
+            objective_terms.append(excess * 5)
+            required[(day, hour)] = required_var
+            shortages[(day, hour)] = shortage
+
+    targets = {}
+    max_days = rules.max_consecutive_days
+    for s in staffs:
+        for start_day in range(1, last_day - max_days + 1):
+            window = range(start_day, start_day + max_days + 1)
+            model.Add(
+                sum(v for day in window for v in works[(s.id, day)])
+                <= max_days
+            )
+        cap = rules.weekly_cap(s)
+        if cap is not None:
+            for start_day in range(1, last_day - WEEK_DAYS + 2):
+                window = range(start_day, start_day + WEEK_DAYS)
+                model.Add(
+                    sum(
+                        x[(s.id, day, p.id)] * (p.end_time - p.start_time)
+                        for day in window for p in patterns
+                    ) <= cap
+                )
+
+        # 目標日数を指定しないスタッフは目標変数を自由にして罰則を消す
+        work_vars = [v for day in days for v in works[(s.id, day)]]
+        target = model.NewIntVar(0, last_day, f"target_s{s.id}")
+        deviation = model.NewIntVar(0, last_day, f"fair_dev_s{s.id}")
+        model.AddAbsEquality(deviation, sum(work_vars) - target)
+        objective_terms.append(deviation * 10)
+        targets[s.id] = target
+
+    model.Minimize(sum(objective_terms))
+    return PatternModelTemplate(
+        key=compute_template_key(store, staffs, patterns, last_day, rules),
+        model=model,
+        x={key: var.Index() for key, var in x.items()},
+        required={key: var.Index() for key, var in required.items()},
+        shortages={key: var.Index() for key, var in shortages.items()},
+        targets={key: var.Index() for key, var in targets.items()},
+        build_seconds=time.perf_counter() - started
+    )
+
+
+def template_paths(key: str) -> Tuple[str, str]:
+    """テンプレートのモデル（テキスト形式）と変数の対応表のパス"""
+    return (
+        os.path.join(TEMPLATE_DIR, f"{key}.pbtxt"),
+        os.path.join(TEMPLATE_DIR, f"{key}.json"),
+    )
+
+
+def save_template_file(template: PatternModelTemplate) -> None:
+    """テンプレートをファイルに保存し、古いファイルを消す
+
+    別の子プロセスが読みかけのファイルを壊さないよう、一時ファイルに
+    書いてから置き換える。対応表を最後に置くため、対応表があれば
+    モデルも揃っている。
+    """
+    os.makedirs(TEMPLATE_DIR, exist_ok=True)
+    model_path, index_path = template_paths(template.key)
+    suffix = f".{os.getpid()}.tmp"
+    # ExportToFile は拡張子が .pbtxt ならテキスト形式で書く
+    template.model.ExportToFile(model_path + suffix + ".pbtxt")
+    os.replace(model_path + suffix + ".pbtxt", model_path)
+    with open(index_path + suffix, "w", encoding="utf-8") as f:
+        json.dump({
+            "x": [[*key, index] for key, index in template.x.items()],
+            "required": [
+                [*key, index] for key, index in template.required.items()
+            ],
+            "shortages": [
+                [*key, index] for key, index in template.shortages.items()
+            ],
+            "targets": [[key, index] for key, index in template.targets.items()],
+            "build_seconds": template.build_seconds,
+        }, f)
+    os.replace(index_path + suffix, index_path)
+
+    index_files = sorted(
+        (
+            os.path.join(TEMPLATE_DIR, name)
+            for name in os.listdir(TEMPLATE_DIR) if name.endswith(".json")
+        ),
+        key=os.path.getmtime, reverse=True
+    )
+    for stale in index_files[MAX_TEMPLATE_FILES:]:
+        for path in (stale, stale[:-len(".json")] + ".pbtxt"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+
+def load_template_file(key: str) -> PatternModelTemplate:
+    """保存したテンプレートを読み込む（なければNone）"""
+    model_path, index_path = template_paths(key)
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        with open(model_path, encoding="utf-8") as f:
+            text = f.read()
+    except (FileNotFoundError, ValueError):
+        return None
+    model = cp_model.CpModel()
+    try:
+        model.Proto().parse_text_format(text)
+    except Exception as e:
+        print(f"保存したテンプレートを読み込めませんでした: {e}")
+        return None
+    # 最後に使った日時として更新する
+    with contextlib.suppress(FileNotFoundError):
+        os.utime(index_path)
+    return PatternModelTemplate(
+        key=key,
+        model=model,
+        x={tuple(row[:3]): row[3] for row in index["x"]},
+        required={tuple(row[:2]): row[2] for row in index["required"]},
+        shortages={tuple(row[:2]): row[2] for row in index["shortages"]},
+        targets={row[0]: row[1] for row in index["targets"]},
+        build_seconds=index["build_seconds"]
+    )
+
+
+def remember_template(template: PatternModelTemplate) -> None:
+    """テンプレートをプロセス内に保持する（上限を超えたら古い順に捨てる）"""
+    with _templates_lock:
+        _templates[template.key] = template
+        _templates.move_to_end(template.key)
+        while len(_templates) > MAX_TEMPLATES:
+            _templates.popitem(last=False)
+
+
+def get_pattern_template(
+    store: Store,
+    staffs: List[Staff],
+    patterns: List[ShiftPattern],
+    last_day: int,
+    rules: LaborRules = DEFAULT_LABOR_RULES
+) -> Tuple[PatternModelTemplate, bool]:
+    """店舗構成に対応するテンプレートを返す（なければコンパイルする）
+
+    プロセス内に保持したもの、ファイルに保存したものの順に探し、
+    どちらにもなければコンパイルして両方に保存する。
+
+    Returns:
+        template: テンプレート
+        hit: 既存のテンプレートを使った場合はTrue
+    """
+    key = compute_template_key(store, staffs, patterns, last_day, rules)
+    with _templates_lock:
+        template = _templates.get(key)
+        if template is not None:
+            _templates.move_to_end(key)
+            return template, True
+
+    template = load_template_file(key)
+    if template is not None:
+        remember_template(template)
+        return template, True
+
+    template = compile_pattern_template(
+        store, staffs, patterns, last_day, rules
+    )
+    remember_template(template)
+    try:
+        save_template_file(template)
+    except OSError as e:
+        print(f"テンプレートを保存できませんでした: {e}")
+    return template, False
+
+
+def clear_templates(files: bool = False) -> None:
+    """保持しているテンプレートをすべて捨てる
+
+    Args:
+        files: ファイルに保存したテンプレートも消す場合はTrue
+    """
+    with _templates_lock:
+        _templates.clear()
+    if files and os.path.isdir(TEMPLATE_DIR):
+        for name in os.listdir(TEMPLATE_DIR):
+            if name.endswith((".json", ".pbtxt")):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(TEMPLATE_DIR, name))
+
+
+def set_domain(model: cp_model.CpModel, index: int, lower: int, upper: int):
+    """変数の上下限を書き換える"""
+    domain = model.Proto().variables[index].domain
+    domain[0] = lower
+    domain[1] = upper
+
+
+def solve_shift_patterns_from_template(
+    store: Store,
+    staffs: List[Staff],
+    patterns: List[ShiftPattern],
+    requests: Dict[Tuple[int, int], ShiftRequest],
+    required_staff: Dict[Tuple[int, int], int],
+    last_day: int,
+    target_days: Dict[int, int] = None,
+    time_limit: float = 30.0,
+    num_workers: int = 8,
+    carry_in: Dict[int, int] = None,
+    hints: Dict[Tuple[int, int], Tuple[int, int]] = None,
+    rules: LaborRules = DEFAULT_LABOR_RULES,
+    fixed: Dict[Tuple[int, int], Tuple[int, int]] = None
+) -> Dict[Tuple[int, int], ShiftPattern]:
+    """テンプレートを複製し、今月の条件を上下限として与えて解く
+
+    solve_shift_patterns（月一括）と同じ問題を解く。月初の連勤
+    （carry_in）は月初の窓の制約として、固定したシフトがあるスタッフの
+    連勤と週の勤務時間はそれを数えた制約として複製に追加する。
+
+    Args:
+        store: 店舗情報
+        staffs: バイトスタッフリスト
+        patterns: シフトパターンリスト
+        requests: (staff_id, day) → ShiftRequest
+        required_staff: (day, hour) → 必要なバイトの人数
+        last_day: 月末日
+        target_days: staff_id → 採用目標日数（公平性）
+        time_limit: 探索時間の上限（秒）
+        num_workers: CP-SATの探索スレッド数
+        carry_in: staff_id → 前月末日までの連続勤務日数
+        hints: (staff_id, day) → (開始時間, 終了時間) 解のヒント。
+            時間帯の重なりが最も大きいパターンをヒントにする
+        rules: 労務ルール（未成年の終業時刻は上下限として与える）
+        fixed: (staff_id, day) → (開始時間, 終了時間) 固定したシフト。
+            requests と required_staff からは除いておく
+
+    Returns:
+        assignments: (staff_id, day) → ShiftPattern（解なしの場合はNone）
+    """
+    print("\n=== シフトパターンの割り当て（テンプレート） ===")
+    template, hit = get_pattern_template(
+        store, staffs, patterns, last_day, rules
+    )
+    if hit:
+        print("テンプレートを再利用します")
+        report_phase("template", "コンパイル済みのモデルを再利用します", hit=True)
+    else:
+        print(f"テンプレートをコンパイルしました "
+              f"({template.build_seconds:.2f}秒)")
+        report_phase("template", "モデルをコンパイルしました", hit=False)
+
+    started = time.perf_counter()
+    model = template.model.clone()
+    pattern_by_id = {p.id: p for p in patterns}
+    end_hour_limits = {s.id: rules.end_hour_limit(s) for s in staffs}
+    feasible = 0
+    for (staff_id, day, pattern_id), index in template.x.items():
+        if can_work_pattern(
+            requests.get((staff_id, day)), pattern_by_id[pattern_id], store,
+            end_hour_limits[staff_id]
+        ):
+            feasible += 1
+        else:
+            set_domain(model, index, 0, 0)
+    for key, index in template.required.items():
+        required = required_staff.get(key, 0)
+        set_domain(model, index, required, required)
+    for staff_id, target in (target_days or {}).items():
+        if staff_id in template.targets:
+            set_domain(model, template.targets[staff_id], target, target)
+    if carry_in:
+        # 月内の窓はテンプレートにあるため、前月にはみ出す窓だけを加える
+        works = defaultdict(list)
+        for (staff_id, day, _), index in template.x.items():
+            if day <= rules.max_consecutive_days:
+                works[(staff_id, day)].append(
+                    model.GetBoolVarFromProtoIndex(index)
+                )
+        add_consecutive_days_constraint(
+            model, {key: sum(v) for key, v in works.items()},
+            [s for s in staffs if carry_in.get(s.id)],
+            1, min(rules.max_consecutive_days, last_day), carry_in=carry_in,
+            max_consecutive_days=rules.max_consecutive_days
+        )
+    if fixed:
+        # 固定したシフトの日は変数がないため、そのスタッフの窓を数え直す
+        pinned_ids = {staff_id for staff_id, _ in fixed}
+        works = defaultdict(list)
+        hours = defaultdict(list)
+        for (staff_id, day, pattern_id), index in template.x.items():
+            if staff_id not in pinned_ids:
+                continue
+            var = model.GetBoolVarFromProtoIndex(index)
+            p = pattern_by_id[pattern_id]
+            works[(staff_id, day)].append(var)
+            hours[(staff_id, day)].append(var * (p.end_time - p.start_time))
+        pinned_staffs = [s for s in staffs if s.id in pinned_ids]
+        add_consecutive_days_constraint(
+            model, {key: sum(v) for key, v in works.items()},
+            pinned_staffs, 1, last_day, carry_in=carry_in,
+            max_consecutive_days=rules.max_consecutive_days,
+            fixed_days=set(fixed)
+        )
+        add_weekly_hours_constraint(
+            model, {key: sum(v) for key, v in hours.items()},
+            pinned_staffs, 1, last_day, rules,
+            fixed_hours={
+                key: end - start for key, (start, end) in fixed.items()
+            }
+        )
+    if hints:
+        for (staff_id, day), (start, end) in hints.items():
+            overlaps = {
+                pattern_id: min(end, p.end_time) - max(start, p.start_time)
+                for pattern_id, p in pattern_by_id.items()
+                if (staff_id, day, pattern_id) in template.x
+            }
+            if not overlaps:
+                continue
+            best = max(overlaps, key=overlaps.get)
+            if overlaps[best] > 0:
+                model.AddHint(
+                    model.GetBoolVarFromProtoIndex(
+                        template.x[(staff_id, day, best)]
+                    ), 1
+                )
+    print(f"上下限の書き換え: {time.perf_counter() - started:.2f}秒 "
+          f"(勤務可能な組 {feasible} / {len(template.x)})")
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = time_limit
+    solver.parameters.num_workers = num_workers
+    status = solve_with_progress(
+        solver, model, f"1日～{last_day}日 (テンプレート)",
+        demand_hours=sum(required_staff.values()),
+        shortage_terms=[
+            (model.GetIntVarFromProtoIndex(index), 1)
+            for index in template.shortages.values()
+        ]
+    )
+    print(f"1日～{last_day}日: {solver.StatusName(status)} "
+          f"(目的関数値: {solver.ObjectiveValue()})")
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return None
+
+    assignments = {}
+    for (staff_id, day, pattern_id), index in template.x.items():
+        if solver.Value(model.GetBoolVarFromProtoIndex(index)):
+            assignments[(staff_id, day)] = pattern_by_id[pattern_id]
+    return assignments
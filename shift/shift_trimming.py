@@ -0,0 +1,219 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Set, Tuple
+from ortools.sat.python import cp_model
+from models import Shiftresult, Staff, Store, ShiftRequest
+from .shift_lns import SHORTAGE_WEIGHT, EXCESS_WEIGHT
+from .shift_optimizer import get_request_window
+from .shift_rules import DEFAULT_LABOR_RULES, LaborRules
+from .shift_validator import get_hourly_demand
+
+
+# 希望時間を1時間削るごとのペナルティ（過不足より優先度は低い）
+TRIM_WEIGHT = 1
+
+
+def get_shift_options(
+    window: Tuple[int, int],
+    min_hours: int = 4,
+    max_hours: int = 5
+) -> List[Tuple[int, int]]:
+    """希望時間帯の中で取り得る (開始時間, 終了時間) を列挙する
+
+    希望時間帯が最低勤務時間より短い場合は、希望時間帯そのものだけを返す。
+    """
+    start, end = window
+    if end - start <= min_hours:
+        return [(start, end)]
+    options = []
+    for length in range(min_hours, min(max_hours, end - start) + 1):
+        for s in range(start, end - length + 1):
+            options.append((s, s + length))
+    return options
+
+
+def trim_day(
+    windows: Dict[int, Tuple[int, int]],
+    required: Dict[int, int],
+    min_hours: int = 4,
+    max_hours: int = 5,
+    time_limit: float = 5.0
+) -> Tuple[Dict[int, Tuple[int, int]], int]:
+    """1日分の採用スタッフの開始・終了時間を厳密に決める
+
+    採用スタッフは必ず1つの時間帯に入れ、時間帯ごとの過不足と
+    希望時間から削った時間の重み付き和を最小にする。
+
+    Args:
+        windows: staff_id → 勤務可能な時間帯 (開始時間, 終了時間)
+        required: hour → バイトの必要人数
+        min_hours: 最低勤務時間
+        max_hours: 最長勤務時間
+        time_limit: 探索時間の上限（秒）
+
+    Returns:
+        shifts: staff_id → (開始時間, 終了時間)
+        cost: 目的関数値
+    """
+    model = cp_model.CpModel()
+    choices = {}
+    coverage = defaultdict(list)
+    objective_terms = []
+    for staff_id, window in windows.items():
+        options = get_shift_options(window, min_hours, max_hours)
+        variables = []
+        for option in options:
+            var = model.NewBoolVar(f"x_{staff_id}_{option[0]}_{option[1]}")
+            choices[(staff_id, option)] = var
+            variables.append(var)
+            for hour in range(*option):
+                coverage[hour].append(var)
+            trimmed = (window[1] - window[0]) - (option[1] - option[0])
+            if trimmed:
+                objective_terms.append(TRIM_WEIGHT * trimmed * var)
+        model.AddExactlyOne(variables)
+
+    for hour, needed in required.items():
+        staff_count = len(windows)
+        shortage = model.NewIntVar(0, needed, f"short_{hour}")
+        excess = model.NewIntVar(0, staff_count, f"excess_{hour}")
+        model.Add(sum(coverage[hour]) + shortage - excess == needed)
+        objective_terms.append(SHORTAGE_WEIGHT * shortage)
+        objective_terms.append(EXCESS_WEIGHT * excess)
+
+    if objective_terms:
+        model.Minimize(sum(objective_terms))
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = time_limit
+    solver.parameters.num_workers = 1
+    status = solver.Solve(model)
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        raise ValueError("シフト時間を決定できませんでした")
+
+    shifts = {
+        staff_id: option
+        for (staff_id, option), var in choices.items()
+        if solver.Value(var)
+    }
+    return shifts, int(solver.ObjectiveValue()) if objective_terms else 0
+
+
+def trim_staff_shifts(
+    store: Store,
+    selected_staff_by_day: Dict[int, List[int]],
+    valid_requests: Dict[Tuple[int, int], ShiftRequest],
+    employee_shifts: List[Tuple[int, int, int]],
+    year: int,
+    month: int,
+    last_day: int,
+    holidays: Set[datetime.date],
+    staffs: List[Staff],
+    rules: LaborRules = DEFAULT_LABOR_RULES,
+    max_workers: int = None,
+    fixed: Dict[Tuple[int, int], Tuple[int, int]] = None
+) -> Tuple[List[Shiftresult], Dict[int, List[int]]]:
+    """採用されたバイトスタッフの勤務時間を日ごとに厳密に決める
+
+    日ごとに独立した小さな整数計画を解くため、日をまたいで並列に実行する。
+
+    Args:
+        store: 店舗情報
+        selected_staff_by_day: {day: [staff_id]} 採用されたスタッフ
+        valid_requests: 有効なシフト希望
+        employee_shifts: 社員のシフトリスト (e_id, day, hour)
+        year: 年
+        month: 月
+        last_day: 月末日
+        holidays: 祝日セット
+        staffs: バイトスタッフリスト（未成年バイトの判定用）
+        rules: 労務ルール（勤務時間の範囲・未成年バイトの終業時刻）
+        max_workers: 並列に解く日数（省略時はCPU数）
+        fixed: (staff_id, day) → (開始時間, 終了時間) 固定したシフト。
+            時間は変えず、その分を必要人数から差し引く（結果には含めない）
+
+    Returns:
+        adjusted_shifts: 調整後のシフトリスト
+        rejection_times: {staff_id: [早出時間, 早退時間]} 不採用時間
+    """
+    print("\n=== バイトスタッフのシフト時間決定（日ごとの厳密解） ===")
+    end_hour_limits = {staff.id: rules.end_hour_limit(staff) for staff in staffs}
+    min_hours, max_hours = rules.shift_length_range()
+
+    # 社員の勤務時間帯を希望から復元し、固定したシフトとともに必要人数から差し引く
+    demand = get_hourly_demand(store, holidays, year, month, last_day)
+    employee_count = defaultdict(int)
+    for e_id, day, _ in employee_shifts:
+        window = get_request_window(
+            valid_requests.get((e_id, day)), store, False
+        )
+        if window:
+            for hour in range(*window):
+                employee_count[(day, hour)] += 1
+    for (_, day), (start, end) in (fixed or {}).items():
+        for hour in range(start, end):
+            employee_count[(day, hour)] += 1
+
+    problems = {}
+    for day in range(1, last_day + 1):
+        staff_list = selected_staff_by_day.get(day, [])
+        if not staff_list:
+            continue
+        windows = {}
+        for staff_id in staff_list:
+            window = get_request_window(
+                valid_requests.get((staff_id, day)), store,
+                end_hour_limits.get(staff_id) is not None, rules.minor_end_hour
+            )
+            if window:
+                windows[staff_id] = window
+        if not windows or (day, store.open_hours) not in demand:
+            continue
+        required = {
+            hour: max(0, needed - employee_count[(day, hour)])
+            for (d, hour), needed in demand.items() if d == day
+        }
+        problems[day] = (windows, required)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(problems)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            day: executor.submit(
+                trim_day, windows, required, min_hours, max_hours
+            )
+            for day, (windows, required) in problems.items()
+        }
+        solutions = {day: future.result() for day, future in futures.items()}
+
+    adjusted_shifts = []
+    rejection_times = defaultdict(lambda: [0, 0])  # (早出時間, 早退時間)
+    total_cost = 0
+    for day in sorted(solutions):
+        shifts, cost = solutions[day]
+        windows, _ = problems[day]
+        total_cost += cost
+        print(f"{day}日: {len(shifts)}人 (目的関数値: {cost})")
+        for staff_id in sorted(shifts):
+            start_time, end_time = shifts[staff_id]
+            req_start, req_end = windows[staff_id]
+            rejection_times[staff_id][0] += start_time - req_start
+            rejection_times[staff_id][1] += req_end - end_time
+            adjusted_shifts.append(
+                Shiftresult(
+                    staff_id=staff_id,
+                    year=year,
+                    month=month,
+                    day=day,
+                    start_time=start_time,
+                    end_time=end_time
+                )
+            )
+
+    total_rejection = sum(sum(times) for times in rejection_times.values())
+    print(f"決定したシフト: {len(adjusted_shifts)}件, "
+          f"目的関数値の合計: {total_cost}, "
+          f"希望から削った時間: {total_rejection}時間")
+    return adjusted_shifts, rejection_times
@@ -1,6 +1,22 @@
+import time
+from collections import Counter
 from typing import Dict, List, Tuple, Set
 from datetime import datetime, timedelta
-from models import Staff, Store, ShiftRequest, ShiftPattern
+import numpy as np
+from ortools.graph.python import max_flow
+from models import Staff, Store, ShiftRequest, ShiftPattern, Shiftresult
+from .shift_rules import DEFAULT_LABOR_RULES, LaborRules, check_labor_rules
+
+
+# スキルランクの数値（shift_creator.rank_value と同じ対応）
+SKILL_RANK_VALUES = {"A": 3, "B": 2, "C": 1}
+
+# 時間帯の区分（0=オープン, 1=ピーク, 2=クローズ）ごとの必要人数の設定名
+PERIOD_RULES = ("open_people", "peak_people", "close_people")
+
+# ピーク時間帯に確かめるスキル。kitchen_a/kitchen_b は必要ランク以上の
+# スタッフが1人以上いるか、hall/leadership は勤務者の合計で判定する
+SKILL_RULES = ("kitchen_a", "kitchen_b", "hall", "leadership")
 
 
 def validate_shift_requests(
@@ -127,11 +143,7 @@ def validate_staffing_requirements(
     
     for day in range(1, last_day + 1):
         day_type = get_day_type(year, month, day, holidays)
-        skill_req = next(
-            (r for r in store.default_skill_requirements 
-             if r.day_type == day_type),
-            None
-        )
+        skill_req = store.get_skill_requirement(day_type)
         if not skill_req:
             raise ValueError(f"{day_type}のスキル設定が見つかりません")
         
@@ -160,6 +172,168 @@ def validate_staffing_requirements(
             )
 
 
+def get_hourly_demand(
+    store: Store,
+    holidays: Set[datetime.date],
+    year: int,
+    month: int,
+    last_day: int
+) -> Dict[Tuple[int, int], int]:
+    """店舗設定から時間帯ごとの必要人数（社員を含む）を求める
+    
+    Returns:
+        demand: (day, hour) → 必要人数
+    """
+    demand = {}
+    for day in range(1, last_day + 1):
+        skill_req = store.get_skill_requirement(
+            get_day_type(year, month, day, holidays)
+        )
+        if not skill_req:
+            continue
+        for hour in range(store.open_hours, store.close_hours):
+            if hour < skill_req.peak_start_hour:
+                demand[(day, hour)] = skill_req.open_people
+            elif hour < skill_req.peak_end_hour:
+                demand[(day, hour)] = skill_req.peak_people
+            else:
+                demand[(day, hour)] = skill_req.close_people
+    return demand
+
+
+def check_staffing_capacity(
+    store: Store,
+    employees: List[Staff],
+    staffs: List[Staff],
+    valid_requests: Dict[Tuple[int, int], ShiftRequest],
+    holidays: Set[datetime.date],
+    year: int,
+    month: int,
+    last_day: int,
+    max_shift_hours: int = None,
+    minor_end_hour: int = DEFAULT_LABOR_RULES.minor_end_hour
+) -> Dict:
+    """シフト希望から見た供給で必要人数を満たせるかを最大流で判定する
+    
+    日ごとに「始点→スタッフ→時間帯→終点」の2部グラフを作る。
+    スタッフ→時間帯の辺は希望時間内（未成年は終了時刻の上限を適用）
+    のみ容量1で張り、時間帯→終点の容量を必要人数、始点→スタッフの
+    容量を1日の最大勤務時間とする。最大流が必要人数の合計に届かない
+    日は、どのように割り当てても必要人数を満たせない。
+    
+    Args:
+        store: 店舗情報
+        employees: 社員リスト
+        staffs: バイトスタッフリスト
+        valid_requests: 有効なシフト希望
+        holidays: 祝日セット
+        year: 年
+        month: 月
+        last_day: 月末日
+        max_shift_hours: バイトの1日の最大勤務時間（Noneなら希望時間まで）
+        minor_end_hour: 未成年バイトの終了時刻の上限
+    
+    Returns:
+        report: 判定結果
+            feasible: 全日で必要人数を満たせるか
+            short_hours: [(day, hour, 必要人数, 勤務可能人数)]
+                勤務可能な人数自体が足りない時間帯
+            short_days: [(day, 必要人時, 最大流, [不足が残る時間帯])]
+                最大流が必要人時に届かない日
+    """
+    print("\n=== 必要人数の充足可能性チェック ===")
+    started = time.perf_counter()
+    demand = get_hourly_demand(store, holidays, year, month, last_day)
+    members = [(s, True) for s in employees] + [(s, False) for s in staffs]
+
+    short_hours = []
+    short_days = []
+    for day in range(1, last_day + 1):
+        hours = [
+            h for h in range(store.open_hours, store.close_hours)
+            if demand.get((day, h), 0) > 0
+        ]
+        if not hours:
+            continue
+
+        windows = []
+        for s, is_employee in members:
+            req = valid_requests.get((s.id, day))
+            if req is None or req.status not in ("O", "time"):
+                continue
+            if req.status == "O":
+                start, end = store.open_hours, store.close_hours
+            else:
+                start, end = req.start_time, req.end_time
+            if s.employment_type == "未成年バイト":
+                end = min(end, minor_end_hour)
+            if start >= end:
+                continue
+            # 社員は希望時間をそのまま勤務するため上限を設けない
+            if is_employee or max_shift_hours is None:
+                capacity = end - start
+            else:
+                capacity = min(end - start, max_shift_hours)
+            windows.append((start, end, capacity))
+
+        # ノード番号: 0=始点, 1=終点, 2..=スタッフ, その後に時間帯
+        source, sink = 0, 1
+        hour_node = {h: 2 + len(windows) + i for i, h in enumerate(hours)}
+        flow = max_flow.SimpleMaxFlow()
+        for i, (start, end, capacity) in enumerate(windows):
+            flow.add_arc_with_capacity(source, 2 + i, capacity)
+            for h in range(start, end):
+                if h in hour_node:
+                    flow.add_arc_with_capacity(2 + i, hour_node[h], 1)
+        sink_arcs = {
+            h: flow.add_arc_with_capacity(
+                hour_node[h], sink, demand[(day, h)]
+            )
+            for h in hours
+        }
+
+        for h in hours:
+            available = sum(1 for start, end, _ in windows if start <= h < end)
+            if available < demand[(day, h)]:
+                short_hours.append((day, h, demand[(day, h)], available))
+
+        total_demand = sum(demand[(day, h)] for h in hours)
+        if not windows:
+            short_days.append((day, total_demand, 0, hours))
+            continue
+        if flow.solve(source, sink) != flow.OPTIMAL:
+            raise ValueError(f"{day}日の最大流を計算できません")
+        if flow.optimal_flow() < total_demand:
+            unsaturated = [
+                h for h in hours
+                if flow.flow(sink_arcs[h]) < demand[(day, h)]
+            ]
+            short_days.append(
+                (day, total_demand, flow.optimal_flow(), unsaturated)
+            )
+
+    elapsed = (time.perf_counter() - started) * 1000
+    for day, hour, required, available in short_hours:
+        print(
+            f"警告: {day}日 {hour}時台の勤務可能人数({available}人)が"
+            f"必要人数({required}人)に足りません"
+        )
+    for day, required, supplied, hours in short_days:
+        print(
+            f"警告: {day}日は最大{supplied}人時しか割り当てられません"
+            f"(必要: {required}人時, 不足が残る時間帯: {hours})"
+        )
+    print(
+        f"充足できない日: {len(short_days)}日, "
+        f"時間帯: {len(short_hours)}件 ({elapsed:.1f}ms)"
+    )
+    return {
+        "feasible": not short_days,
+        "short_hours": short_hours,
+        "short_days": short_days,
+    }
+
+
 def get_day_type(
     year: int,
     month: int,
@@ -199,4 +373,182 @@ def get_day_type(
     elif weekday == 6:
         return "日曜日"
     else:
-        return "平日" 
\ No newline at end of file
+        return "平日" 
+
+
+def validate_schedule(
+    results: List[Shiftresult],
+    store: Store,
+    members: List[Staff],
+    valid_requests: Dict[Tuple[int, int], ShiftRequest],
+    holidays: Set[datetime.date],
+    year: int,
+    month: int,
+    last_day: int,
+    rules: LaborRules = DEFAULT_LABOR_RULES,
+    carry_in: Dict[int, int] = None
+) -> List[Dict]:
+    """1か月分のシフトが必要人数・スキル・労務ルール・希望を守っているかを調べる
+
+    シフトを (勤務, 時間帯) の真偽行列に展開し、日×時間帯の人数と
+    スキルの合計を numpy の集計でまとめて求める。労務ルールは
+    check_labor_rules でバイトだけを調べる。
+
+    Args:
+        results: シフト結果（社員を含む）
+        store: 店舗情報
+        members: 社員とバイトスタッフのリスト
+        valid_requests: 有効なシフト希望
+        holidays: 祝日セット
+        year: 年
+        month: 月
+        last_day: 月末日
+        rules: 労務ルール
+        carry_in: staff_id → 前月末日までの連続勤務日数
+
+    Returns:
+        violations: {"rule", "staff_id", "day", "hour", "value", "limit"} のリスト
+            （日・時間帯・ルール名の順）。rule は違反した設定の名前:
+            open_people / peak_people / close_people: 時間帯の人数不足
+            kitchen_a / kitchen_b: ピーク時間帯に必要ランクのスタッフがいない
+            hall / leadership: ピーク時間帯のスキル合計の不足
+            LaborRules の項目名: 労務ルール違反（hour は None）
+            request_day_off: 希望のない日・勤務不可の日の勤務
+            request_hours: 希望時間外の勤務（value は希望外の時間数）
+    """
+    started = time.perf_counter()
+    member_by_id = {s.id: s for s in members}
+    rows = [
+        r for r in results
+        if r.staff_id in member_by_id and 1 <= r.day <= last_day
+    ]
+    hours = np.arange(store.open_hours, store.close_hours)
+    violations = []
+
+    # 日×時間帯の区分と必要人数、日ごとのピーク時間帯のスキル要件
+    period = np.full((last_day, len(hours)), -1, dtype=np.int8)
+    demand = np.zeros((last_day, len(hours)), dtype=np.int32)
+    skill_limits = np.zeros((len(SKILL_RULES), last_day), dtype=np.int32)
+    for day in range(1, last_day + 1):
+        skill_req = store.get_skill_requirement(
+            get_day_type(year, month, day, holidays)
+        )
+        if not skill_req:
+            continue
+        period[day - 1] = np.where(
+            hours < skill_req.peak_start_hour, 0,
+            np.where(hours < skill_req.peak_end_hour, 1, 2)
+        )
+        demand[day - 1] = np.array([
+            skill_req.open_people, skill_req.peak_people,
+            skill_req.close_people
+        ])[period[day - 1]]
+        skill_limits[:, day - 1] = (
+            SKILL_RANK_VALUES.get(skill_req.kitchen_a, 0),
+            SKILL_RANK_VALUES.get(skill_req.kitchen_b, 0),
+            skill_req.hall,
+            skill_req.leadership
+        )
+
+    # 勤務ごとの (日, 開始, 終了, スキル) を配列にし、日×時間帯へ集計する
+    headcount = np.zeros((last_day, len(hours)), dtype=np.int32)
+    skill_values = np.zeros(
+        (len(SKILL_RULES), last_day, len(hours)), dtype=np.int32
+    )
+    if rows:
+        days = np.array([r.day for r in rows]) - 1
+        starts = np.array([r.start_time for r in rows])
+        ends = np.array([r.end_time for r in rows])
+        on_shift = ((starts[:, None] <= hours) & (hours < ends[:, None]))
+        on_shift = on_shift.astype(np.int32)
+        np.add.at(headcount, days, on_shift)
+        skills = np.array([
+            (
+                SKILL_RANK_VALUES.get(member_by_id[r.staff_id].kitchen_a, 0),
+                SKILL_RANK_VALUES.get(member_by_id[r.staff_id].kitchen_b, 0),
+                member_by_id[r.staff_id].hall or 0,
+                member_by_id[r.staff_id].leadership or 0,
+            )
+            for r in rows
+        ], dtype=np.int32)
+        for i, rule in enumerate(SKILL_RULES):
+            values = on_shift * skills[:, i][:, None]
+            if rule in ("kitchen_a", "kitchen_b"):
+                np.maximum.at(skill_values[i], days, values)
+            else:
+                np.add.at(skill_values[i], days, values)
+
+    for d, h in zip(*np.nonzero((period >= 0) & (headcount < demand))):
+        violations.append({
+            "rule": PERIOD_RULES[period[d, h]], "staff_id": None,
+            "day": int(d) + 1, "hour": int(hours[h]),
+            "value": int(headcount[d, h]), "limit": int(demand[d, h]),
+        })
+    short_skills = (period == 1)[None] & (skill_values < skill_limits[:, :, None])
+    for i, d, h in zip(*np.nonzero(short_skills)):
+        violations.append({
+            "rule": SKILL_RULES[i], "staff_id": None,
+            "day": int(d) + 1, "hour": int(hours[h]),
+            "value": int(skill_values[i, d, h]),
+            "limit": int(skill_limits[i, d]),
+        })
+
+    # 希望との突き合わせ（手動で固定したセルも希望と違えば報告する）
+    request_windows = np.full((len(rows), 2), -1, dtype=np.int32)
+    available = {}
+    for i, r in enumerate(rows):
+        req = valid_requests.get((r.staff_id, r.day))
+        if req is None or req.status not in ("O", "time"):
+            continue
+        if req.status == "O":
+            start, end = store.open_hours, store.close_hours
+        else:
+            start, end = req.start_time, req.end_time
+        request_windows[i] = (start, end)
+        limit = rules.end_hour_limit(member_by_id[r.staff_id])
+        available[(r.staff_id, r.day)] = (
+            start, end if limit is None else min(end, limit)
+        )
+    if rows:
+        day_off = request_windows[:, 0] < 0
+        outside = (
+            np.maximum(0, request_windows[:, 0] - starts) +
+            np.maximum(0, ends - request_windows[:, 1])
+        )
+        outside_hours = ~day_off & (outside > 0)
+        for i in np.flatnonzero(day_off):
+            violations.append({
+                "rule": "request_day_off", "staff_id": rows[i].staff_id,
+                "day": rows[i].day, "hour": None,
+                "value": int(ends[i] - starts[i]), "limit": 0,
+            })
+        for i in np.flatnonzero(outside_hours):
+            violations.append({
+                "rule": "request_hours", "staff_id": rows[i].staff_id,
+                "day": rows[i].day, "hour": None,
+                "value": int(outside[i]), "limit": 0,
+            })
+
+    # 労務ルール（社員は希望通りに勤務するため対象外）
+    part_timers = [s for s in members if s.employment_type != "社員"]
+    part_timer_ids = {s.id for s in part_timers}
+    intervals = {
+        (r.staff_id, r.day): (r.start_time, r.end_time)
+        for r in rows if r.staff_id in part_timer_ids
+    }
+    for violation in check_labor_rules(
+        intervals, part_timers, rules, last_day, windows=available,
+        carry_in=carry_in
+    ):
+        violation["hour"] = None
+        violations.append(violation)
+
+    violations.sort(key=lambda v: (
+        v["day"], -1 if v["hour"] is None else v["hour"], v["rule"],
+        v["staff_id"] or 0
+    ))
+    elapsed = (time.perf_counter() - started) * 1000
+    counts = Counter(v["rule"] for v in violations)
+    print(f"シフトの検証: 違反 {len(violations)}件 {dict(counts)} "
+          f"({elapsed:.1f}ms)")
+    return violations
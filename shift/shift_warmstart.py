@@ -0,0 +1,121 @@
+import calendar
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, List, Set, Tuple
+from .shift_creator import get_holidays
+from .shift_rules import DEFAULT_LABOR_RULES
+from .shift_validator import get_day_type
+
+
+@dataclass(frozen=True)
+class WarmStart:
+    """前月の確定シフトから作った解のヒントと月初の連勤状態"""
+    # (staff_id, 日) → (開始時間, 終了時間)
+    hints: Dict[Tuple[int, int], Tuple[int, int]] = field(default_factory=dict)
+    # staff_id → 前月末日までの連続勤務日数
+    carry_in: Dict[int, int] = field(default_factory=dict)
+
+
+def align_previous_days(
+    year: int,
+    month: int,
+    holidays: Set[datetime.date]
+) -> Dict[int, int]:
+    """今月の各日に対応する前月の日を求める
+
+    曜日と曜日区分が同じ前月の日のうち、日付が最も近い日を対応させる。
+    祝日などで同じ組み合わせがない場合は曜日区分だけで合わせる。
+
+    Returns:
+        source_days: 今月の日 → 前月の日
+    """
+    prev_year, prev_month = (year - 1, 12) if month == 1 else (year, month - 1)
+    prev_last_day = calendar.monthrange(prev_year, prev_month)[1]
+    prev_holidays = get_holidays(prev_year, prev_month)
+
+    by_weekday_type = defaultdict(list)
+    by_type = defaultdict(list)
+    for day in range(1, prev_last_day + 1):
+        weekday = datetime(prev_year, prev_month, day).weekday()
+        day_type = get_day_type(prev_year, prev_month, day, prev_holidays)
+        by_weekday_type[(weekday, day_type)].append(day)
+        by_type[day_type].append(day)
+
+    source_days = {}
+    for day in range(1, calendar.monthrange(year, month)[1] + 1):
+        weekday = datetime(year, month, day).weekday()
+        day_type = get_day_type(year, month, day, holidays)
+        candidates = (
+            by_weekday_type.get((weekday, day_type)) or by_type.get(day_type)
+        )
+        if candidates:
+            source_days[day] = min(candidates, key=lambda d: abs(d - day))
+    return source_days
+
+
+def count_carry_in(
+    previous_shifts: Iterable[Tuple[int, int, int, int]],
+    prev_last_day: int,
+    max_consecutive_days: int = DEFAULT_LABOR_RULES.max_consecutive_days
+) -> Dict[int, int]:
+    """前月末日まで続いている連勤日数をスタッフごとに数える"""
+    work_days = defaultdict(set)
+    for staff_id, day, _, _ in previous_shifts:
+        work_days[staff_id].add(day)
+    carry_in = {}
+    for staff_id, days in work_days.items():
+        run = 0
+        while prev_last_day - run in days and run < max_consecutive_days:
+            run += 1
+        if run:
+            carry_in[staff_id] = run
+    return carry_in
+
+
+def build_warm_start(
+    previous_shifts: Iterable[Tuple[int, int, int, int]],
+    staff_ids: List[int],
+    year: int,
+    month: int,
+    holidays: Set[datetime.date],
+    max_consecutive_days: int = DEFAULT_LABOR_RULES.max_consecutive_days
+) -> WarmStart:
+    """前月の確定シフトを曜日・曜日区分で今月に写し、ヒントを作る
+
+    Args:
+        previous_shifts: 前月の確定シフト (staff_id, 日, 開始時間, 終了時間)
+        staff_ids: ヒントを作るスタッフID（今月の生成対象）
+        year: 年
+        month: 月
+        holidays: 今月の祝日
+        max_consecutive_days: 連続勤務日数の上限（月初の連勤はここまで数える）
+
+    Returns:
+        warm_start: 解のヒントと月初の連勤状態
+    """
+    previous_shifts = list(previous_shifts)
+    if not previous_shifts:
+        return WarmStart()
+    prev_year, prev_month = (year - 1, 12) if month == 1 else (year, month - 1)
+    prev_last_day = calendar.monthrange(prev_year, prev_month)[1]
+
+    staff_ids = set(staff_ids)
+    previous = {
+        (staff_id, day): (start, end)
+        for staff_id, day, start, end in previous_shifts
+        if staff_id in staff_ids
+    }
+    hints = {}
+    for day, source_day in align_previous_days(year, month, holidays).items():
+        for staff_id in staff_ids:
+            shift = previous.get((staff_id, source_day))
+            if shift:
+                hints[(staff_id, day)] = shift
+    carry_in = count_carry_in(
+        [s for s in previous_shifts if s[0] in staff_ids], prev_last_day,
+        max_consecutive_days
+    )
+    print(f"前月のシフトからのヒント: {len(hints)}件, "
+          f"月初に連勤が続くスタッフ: {len(carry_in)}名")
+    return WarmStart(hints=hints, carry_in=carry_in)
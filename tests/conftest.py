@@ -0,0 +1,129 @@
+import calendar
+import os
+import random
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import (  # noqa: E402
+    Base,
+    ShiftPattern,
+    ShiftRequest,
+    Staff,
+    Store,
+    StoreDefaultSkillRequirement
+)
+from shift.shift_creator import get_holidays  # noqa: E402
+from shift.shift_snapshot import build_snapshot  # noqa: E402
+
+
+YEAR = 2025
+MONTH = 6
+
+
+def build_shift_input(n_staff=12, n_employees=2, seed=0, year=YEAR, month=MONTH):
+    """4時～12時営業の店舗とスタッフ・ランダムなシフト希望を作る
+
+    Returns:
+        (store, employees, staffs, requests, patterns)
+    """
+    rnd = random.Random(seed)
+    store = Store(id=1, name="テスト店", open_hours=4, close_hours=12)
+    store.default_skill_requirements = [
+        StoreDefaultSkillRequirement(
+            store_id=1, day_type=day_type, peak_start_hour=6,
+            peak_end_hour=9, kitchen_a="B", kitchen_b="C", hall=2,
+            leadership=2, peak_people=peak, open_people=2, close_people=2
+        )
+        for day_type, peak in [
+            ("平日", 4), ("金曜日", 5), ("土曜日", 6), ("日曜日", 6)
+        ]
+    ]
+    patterns = [
+        ShiftPattern(
+            id=i + 1, store_id=1, name=f"P{i + 1}",
+            start_time=start, end_time=end
+        )
+        for i, (start, end) in enumerate(
+            [(4, 9), (5, 10), (6, 11), (7, 12), (4, 12)]
+        )
+    ]
+    store.shift_patterns = patterns
+
+    employees, staffs = [], []
+    for i in range(n_employees + n_staff):
+        if i < n_employees:
+            employment_type = "社員"
+        else:
+            employment_type = rnd.choice(["バイト", "バイト", "未成年バイト"])
+        staff = Staff(
+            id=i + 1, name=f"スタッフ{i + 1}",
+            kitchen_a=rnd.choice("ABC"), kitchen_b=rnd.choice("ABC"),
+            hall=rnd.randint(0, 5), leadership=rnd.randint(0, 5),
+            employment_type=employment_type, login_code=f"code{i + 1}",
+            password="x", store_id=1
+        )
+        (employees if i < n_employees else staffs).append(staff)
+
+    requests = []
+    last_day = calendar.monthrange(year, month)[1]
+    for staff in employees + staffs:
+        for day in range(1, last_day + 1):
+            r = rnd.random()
+            if r < 0.35:
+                continue
+            request = ShiftRequest(
+                id=len(requests) + 1, staff_id=staff.id,
+                year=year, month=month, day=day
+            )
+            if r < 0.45:
+                request.status = "X"
+            elif r < 0.75:
+                request.status = "O"
+                request.start_time, request.end_time = 4, 12
+            else:
+                start = rnd.randint(4, 8)
+                request.status = "time"
+                request.start_time = start
+                request.end_time = min(rnd.randint(start + 3, 12), 12)
+            requests.append(request)
+    return store, employees, staffs, requests, patterns
+
+
+@pytest.fixture
+def shift_input():
+    """build_shift_input を引数付きで呼ぶファクトリ"""
+    return build_shift_input
+
+
+@pytest.fixture
+def make_snapshot():
+    """生成入力のスナップショットを作るファクトリ"""
+    def make(n_staff=12, n_employees=2, seed=0, **kwargs):
+        store, employees, staffs, requests, patterns = build_shift_input(
+            n_staff, n_employees, seed
+        )
+        return build_snapshot(
+            store, employees, staffs, requests, patterns,
+            get_holidays(YEAR, MONTH), YEAR, MONTH, **kwargs
+        )
+    return make
+
+
+@pytest.fixture
+def db():
+    """テスト用の店舗データを入れたSQLiteのインメモリDB"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    store, employees, staffs, requests, _ = build_shift_input()
+    session.add(store)
+    session.add_all(employees + staffs + requests)
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
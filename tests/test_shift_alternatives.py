@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+from shift.shift_alternatives import MAX_ALTERNATIVES, generate_alternatives
+from shift.shift_supervisor import (
+    GenerationCancelled,
+    _running,
+    cancel_generation
+)
+
+
+def test_alternatives_differ_and_respect_bounds(make_snapshot):
+    """監視付きの子プロセスで生成した案は互いに異なり、案の数は上限まで"""
+    snapshot = make_snapshot(n_staff=8)
+    alternatives = generate_alternatives(
+        snapshot, k=2, time_limit=5, job_key="test-alt"
+    )
+    assert [a["rank"] for a in alternatives] == [1, 2]
+    assert alternatives[0]["results"] != alternatives[1]["results"]
+    assert not any(key.startswith("test-alt") for key in _running)
+
+    with pytest.raises(ValueError):
+        generate_alternatives(snapshot, k=MAX_ALTERNATIVES + 1)
+    with pytest.raises(ValueError):
+        generate_alternatives(snapshot, k=0)
+
+
+def test_cancel_stops_all_candidates(make_snapshot):
+    """店舗・年月のキーで中止すると実行中・未着手の候補がまとめて止まる"""
+    snapshot = make_snapshot(n_staff=8)
+    outcome = []
+
+    def run():
+        try:
+            generate_alternatives(
+                snapshot, k=2, strategy="cpsat", time_limit=60,
+                max_workers=1, job_key="test-cancel-alt.alternatives"
+            )
+        except Exception as e:
+            outcome.append(e)
+
+    worker = threading.Thread(target=run)
+    worker.start()
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        job = _running.get("test-cancel-alt.alternatives.0")
+        if job and job["process"].pid:
+            break
+        time.sleep(0.05)
+    started = time.time()
+    assert cancel_generation("test-cancel-alt")
+    worker.join(timeout=30)
+
+    assert not worker.is_alive()
+    assert time.time() - started < 10
+    assert isinstance(outcome[0], GenerationCancelled)
+    assert not any(key.startswith("test-cancel-alt") for key in _running)
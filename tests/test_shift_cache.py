@@ -0,0 +1,86 @@
+from models import ShiftSolutionCache, Shiftresult
+from shift.shift_cache import (
+    compute_snapshot_hash,
+    load_cached_results,
+    store_cached_results
+)
+from shift.shift_generator import generate_shift_results_with_ortools
+from shift.shift_snapshot import PinSnapshot
+
+from conftest import MONTH, YEAR
+
+
+def make_results(staff_id, days):
+    return [
+        Shiftresult(
+            staff_id=staff_id, year=YEAR, month=MONTH, day=day,
+            start_time=4, end_time=9
+        )
+        for day in days
+    ]
+
+
+def test_cache_miss_then_hit(db):
+    """未登録の入力はNone、保存後は同じシフトを返して利用回数を数える"""
+    assert load_cached_results(db, "a" * 64, YEAR, MONTH) is None
+
+    store_cached_results(db, 1, "a" * 64, YEAR, MONTH, make_results(3, [1, 2]))
+    cached = load_cached_results(db, "a" * 64, YEAR, MONTH)
+    assert [(r.staff_id, r.day, r.start_time, r.end_time) for r in cached] == [
+        (3, 1, 4, 9), (3, 2, 4, 9)
+    ]
+    load_cached_results(db, "a" * 64, YEAR, MONTH)
+    entry = db.query(ShiftSolutionCache).one()
+    assert entry.hit_count == 2
+
+
+def test_cache_evicts_least_recently_used(db):
+    """上限を超えると最終利用日時が最も古いエントリから削除する"""
+    store_cached_results(
+        db, 1, "a" * 64, YEAR, MONTH, make_results(3, [1]), max_entries=2
+    )
+    store_cached_results(
+        db, 1, "b" * 64, YEAR, MONTH, make_results(3, [2]), max_entries=2
+    )
+    # a を使うと b の方が古くなる
+    assert load_cached_results(db, "a" * 64, YEAR, MONTH)
+    store_cached_results(
+        db, 1, "c" * 64, YEAR, MONTH, make_results(3, [3]), max_entries=2
+    )
+
+    hashes = {e.input_hash for e in db.query(ShiftSolutionCache).all()}
+    assert hashes == {"a" * 64, "c" * 64}
+    assert load_cached_results(db, "b" * 64, YEAR, MONTH) is None
+
+
+def test_snapshot_hash_depends_on_inputs(make_snapshot):
+    """固定したセル・方式・探索時間が変わるとハッシュも変わる"""
+    snapshot = make_snapshot()
+    base = compute_snapshot_hash(snapshot, "greedy", 30.0)
+    assert base == compute_snapshot_hash(make_snapshot(), "greedy", 30.0)
+    assert base != compute_snapshot_hash(snapshot, "cpsat", 30.0)
+    assert base != compute_snapshot_hash(snapshot, "greedy", 10.0)
+    pinned = make_snapshot(pins=[PinSnapshot(staff_id=3, day=1)])
+    assert base != compute_snapshot_hash(pinned, "greedy", 30.0)
+
+
+def test_generator_reuses_cached_results(db, make_snapshot):
+    """親プロセスで求めたハッシュで生成器が保存した結果を引き当てる"""
+    snapshot = make_snapshot()
+    args = (
+        snapshot.store, snapshot.employees, snapshot.staffs,
+        snapshot.requests, snapshot.patterns, snapshot.holidays,
+        snapshot.year, snapshot.month
+    )
+    first = generate_shift_results_with_ortools(*args, db=db, time_limit=5)
+    entry = db.query(ShiftSolutionCache).one()
+    assert entry.input_hash == compute_snapshot_hash(snapshot, "greedy", 5)
+    assert entry.hit_count == 0
+
+    second = generate_shift_results_with_ortools(*args, db=db, time_limit=5)
+    assert sorted(
+        (r.staff_id, r.day, r.start_time, r.end_time) for r in second
+    ) == sorted(
+        (r.staff_id, r.day, r.start_time, r.end_time) for r in first
+    )
+    assert db.query(ShiftSolutionCache).one().hit_count == 1
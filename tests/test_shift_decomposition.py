@@ -0,0 +1,43 @@
+from shift import shift_decomposition
+from shift.shift_decomposition import repair_week_boundaries, split_into_weeks
+from shift.shift_rules import LaborRules, check_labor_rules
+
+from conftest import MONTH, YEAR, build_shift_input
+
+
+def test_boundary_repair_falls_back_to_dropping_days(monkeypatch):
+    """境界の再最適化が解を返さなくても、連勤を上限以内に収める"""
+    monkeypatch.setattr(
+        shift_decomposition, "solve_shift_patterns", lambda *a, **k: None
+    )
+    store, _, staffs, _, patterns = build_shift_input(n_staff=4)
+    weeks = split_into_weeks(YEAR, MONTH, 30)
+    # 2025年6月は1日（日）、2日～8日、9日～15日…の週に分かれる
+    assert weeks[:3] == [(1, 1), (2, 8), (9, 15)]
+    long_run, carried, pinned = staffs[0].id, staffs[1].id, staffs[2].id
+    assignments = {(long_run, day): patterns[0] for day in range(5, 13)}
+    assignments.update({(carried, day): patterns[1] for day in range(1, 4)})
+    assignments.update({
+        (pinned, day): patterns[0] for day in range(6, 12) if day != 9
+    })
+    fixed = {(pinned, 9): (4, 9)}
+    required_staff = {(day, hour): 1 for day in range(1, 31)
+                      for hour in range(4, 12)}
+
+    repaired = repair_week_boundaries(
+        store, staffs, patterns, {}, required_staff, weeks,
+        assignments, fixed=fixed, carry_in={carried: 4}
+    )
+
+    assert set(repaired) <= set(assignments)
+    intervals = {
+        key: (p.start_time, p.end_time) for key, p in repaired.items()
+    }
+    intervals.update(fixed)
+    violations = check_labor_rules(
+        intervals, staffs, LaborRules(), 30, carry_in={carried: 4}
+    )
+    assert [v for v in violations if v["rule"] == "max_consecutive_days"] == []
+    # 固定したシフトは残し、取り消しは必要な分だけにする
+    assert (pinned, 9) not in repaired
+    assert len(assignments) - len(repaired) == 3
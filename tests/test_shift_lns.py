@@ -0,0 +1,30 @@
+from shift.shift_lns import LABOR_RULE_WEIGHT, score_schedule
+from shift.shift_rules import LaborRules
+
+from conftest import build_shift_input
+
+
+def score(intervals, staffs, **kwargs):
+    return score_schedule(intervals, {}, {}, 30, staffs, **kwargs)
+
+
+def test_score_counts_carry_in_runs():
+    """前月末日から続く連勤で上限を超える候補はペナルティを受ける"""
+    _, _, staffs, _, _ = build_shift_input(n_staff=4)
+    staff_id = staffs[0].id
+    intervals = {(staff_id, day): (4, 9) for day in (1, 2)}
+    assert score(intervals, staffs) == 0
+    assert score(intervals, staffs, carry_in={staff_id: 4}) == \
+        LABOR_RULE_WEIGHT
+    assert score(intervals, staffs, carry_in={staff_id: 3}) == 0
+
+
+def test_score_counts_weekly_hour_caps():
+    """週の勤務時間の上限を超える候補はペナルティを受ける"""
+    _, _, staffs, _, _ = build_shift_input(n_staff=4)
+    staff_id = staffs[0].id
+    intervals = {(staff_id, day): (4, 9) for day in (1, 2, 3, 5, 6)}
+    assert score(intervals, staffs, rules=LaborRules(weekly_max_hours=25)) == 0
+    assert score(
+        intervals, staffs, rules=LaborRules(weekly_max_hours=20)
+    ) == LABOR_RULE_WEIGHT
@@ -0,0 +1,47 @@
+import pytest
+
+from shift.shift_snapshot import PinSnapshot
+from shift.shift_supervisor import generate_in_child
+
+from conftest import build_shift_input
+
+
+def choose_pins():
+    """希望のある日を選び、バイトの固定シフト・勤務させない日・社員の休みを作る"""
+    _, employees, staffs, requests, _ = build_shift_input(n_staff=8)
+    available = {
+        (r.staff_id, r.day) for r in requests if r.status in ("O", "time")
+    }
+    part_timer, other = staffs[0].id, staffs[1].id
+    employee = employees[0].id
+    shift_day = next(d for d in range(1, 31) if (part_timer, d) not in available)
+    excluded_day = next(d for d in range(1, 31) if (other, d) in available)
+    day_off = next(d for d in range(1, 31) if (employee, d) in available)
+    return [
+        PinSnapshot(staff_id=part_timer, day=shift_day, start_time=5,
+                    end_time=10),
+        PinSnapshot(staff_id=other, day=excluded_day),
+        PinSnapshot(staff_id=employee, day=day_off),
+    ]
+
+
+@pytest.mark.parametrize(
+    "strategy", ["greedy", "cpsat", "weekly", "interval", "flow", "lns"]
+)
+def test_pins_are_fixed_in_every_strategy(make_snapshot, strategy):
+    """どの方式でも固定したシフトは時間どおりに1件だけ入り、勤務させない日は空く"""
+    pins = choose_pins()
+    snapshot = make_snapshot(n_staff=8, pins=pins)
+    results = generate_in_child(snapshot, strategy, time_limit=3)
+
+    for pin in pins:
+        rows = [
+            r for r in results
+            if (r.staff_id, r.day) == (pin.staff_id, pin.day)
+        ]
+        if pin.is_exclusion:
+            assert rows == []
+        else:
+            assert [(r.start_time, r.end_time, r.pinned) for r in rows] == [
+                (pin.start_time, pin.end_time, True)
+            ]
@@ -0,0 +1,112 @@
+from models import Shiftresult
+from shift.shift_rules import LaborRules, check_labor_rules
+from shift.shift_validator import validate_schedule, validate_shift_requests
+
+from conftest import MONTH, YEAR, build_shift_input
+
+
+LAST_DAY = 30
+
+
+def find_staff(staffs, employment_type):
+    return next(s for s in staffs if s.employment_type == employment_type)
+
+
+def rules_broken(violations, staff_id):
+    return {(v["rule"], v["day"]) for v in violations if v["staff_id"] == staff_id}
+
+
+def test_consecutive_days_over_limit():
+    """上限を1日超える連勤は最終日の違反になる"""
+    _, _, staffs, _, _ = build_shift_input()
+    staff = find_staff(staffs, "バイト")
+    intervals = {(staff.id, day): (4, 9) for day in range(1, 7)}
+    violations = check_labor_rules(intervals, staffs, LaborRules(), LAST_DAY)
+    assert rules_broken(violations, staff.id) == {("max_consecutive_days", 6)}
+
+    intervals.pop((staff.id, 6))
+    assert check_labor_rules(intervals, staffs, LaborRules(), LAST_DAY) == []
+
+
+def test_consecutive_days_counts_carry_in():
+    """前月末日からの連勤も数える"""
+    _, _, staffs, _, _ = build_shift_input()
+    staff = find_staff(staffs, "バイト")
+    intervals = {(staff.id, day): (4, 9) for day in range(1, 3)}
+    violations = check_labor_rules(
+        intervals, staffs, LaborRules(), LAST_DAY, carry_in={staff.id: 4}
+    )
+    assert rules_broken(violations, staff.id) == {("max_consecutive_days", 2)}
+
+
+def test_shift_length_and_minor_end_hour():
+    """長すぎる勤務・希望が足りるのに短い勤務・未成年の遅い終業を検出する"""
+    _, _, staffs, _, _ = build_shift_input()
+    adult = find_staff(staffs, "バイト")
+    minor = find_staff(staffs, "未成年バイト")
+    rules = LaborRules(max_shift_hours=6)
+    intervals = {
+        (adult.id, 1): (4, 12),
+        (adult.id, 3): (4, 6),
+        (adult.id, 5): (4, 6),
+        (minor.id, 1): (6, 11),
+    }
+    windows = {(adult.id, 3): (4, 12), (adult.id, 5): (4, 6)}
+    violations = check_labor_rules(
+        intervals, staffs, rules, LAST_DAY, windows=windows
+    )
+    assert rules_broken(violations, adult.id) == {
+        ("max_shift_hours", 1), ("min_shift_hours", 3)
+    }
+    assert rules_broken(violations, minor.id) == {("minor_end_hour", 1)}
+
+
+def test_weekly_hours_over_cap():
+    """連続7日間の勤務時間が上限を超えると違反になる"""
+    _, _, staffs, _, _ = build_shift_input()
+    staff = find_staff(staffs, "バイト")
+    intervals = {(staff.id, day): (4, 9) for day in [1, 2, 3, 5, 6, 7]}
+    violations = check_labor_rules(
+        intervals, staffs, LaborRules(weekly_max_hours=25), LAST_DAY
+    )
+    assert rules_broken(violations, staff.id) == {("weekly_max_hours", 7)}
+
+
+def test_validate_schedule_reports_bad_schedule(make_snapshot):
+    """人数不足・希望外の日と時間の勤務をまとめて報告する"""
+    snapshot = make_snapshot()
+    store = snapshot.store
+    members = list(snapshot.employees + snapshot.staffs)
+    valid_requests = validate_shift_requests(
+        snapshot.requests, members, store
+    )
+    staff = snapshot.staffs[0]
+    day_off = next(
+        d for d in range(1, LAST_DAY + 1)
+        if (staff.id, d) not in valid_requests
+        or valid_requests[(staff.id, d)].status == "X"
+    )
+    narrow = next(
+        key for key, req in valid_requests.items()
+        if key[0] != staff.id and req.status == "time"
+        and req.end_time < store.close_hours
+    )
+    results = [
+        Shiftresult(staff_id=staff.id, year=YEAR, month=MONTH, day=day_off,
+                    start_time=4, end_time=9),
+        Shiftresult(staff_id=narrow[0], year=YEAR, month=MONTH, day=narrow[1],
+                    start_time=valid_requests[narrow].start_time,
+                    end_time=store.close_hours),
+    ]
+    violations = validate_schedule(
+        results, store, members, valid_requests, snapshot.holidays,
+        YEAR, MONTH, LAST_DAY
+    )
+    rules = {v["rule"] for v in violations}
+    assert {"open_people", "peak_people", "close_people"} <= rules
+    assert ("request_day_off", day_off) in rules_broken(violations, staff.id)
+    assert ("request_hours", narrow[1]) in rules_broken(violations, narrow[0])
+    # 空の日は毎日人数不足になる
+    assert {
+        v["day"] for v in violations if v["rule"] == "open_people"
+    } == set(range(1, LAST_DAY + 1))
@@ -0,0 +1,20 @@
+from shift.shift_scenario import BASELINE_NAME, run_scenarios
+from shift.shift_supervisor import _running
+
+
+def test_scenarios_run_under_supervisor(make_snapshot):
+    """現状と各シナリオを監視付きの子プロセスで生成し、差分を並べる"""
+    snapshot = make_snapshot(n_staff=8)
+    comparisons = run_scenarios(
+        snapshot,
+        [
+            {"name": "増員", "headcounts": {"平日": {"peak_people": 6}}},
+            {"name": "除外", "removed_staff_ids": [snapshot.staffs[0].id]},
+        ],
+        time_limit=3, job_key="test-scenarios"
+    )
+    assert [c["name"] for c in comparisons] == [BASELINE_NAME, "増員", "除外"]
+    assert all(v == 0 for v in comparisons[0]["diff"].values())
+    # 必要人数を増やすと不足が増える
+    assert comparisons[1]["diff"]["shortage_hours"] > 0
+    assert not any(key.startswith("test-scenarios") for key in _running)
@@ -0,0 +1,112 @@
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from shift import shift_supervisor
+from shift.shift_supervisor import (
+    _running,
+    cancel_generation,
+    job_file,
+    read_job_pids,
+    run_supervised_generation,
+    stop_generation
+)
+
+
+def generate_in_other_worker(snapshot, job_key, run_dir, outcome):
+    """別のWebワーカーの代わりに監視付きの生成を実行する"""
+    shift_supervisor.RUN_DIR = run_dir
+    try:
+        run_supervised_generation(
+            snapshot, job_key, strategy="cpsat", time_limit=60
+        )
+        outcome.put("done")
+    except ValueError as e:
+        outcome.put(str(e))
+
+
+def test_portfolio_runs_under_supervisor(make_snapshot):
+    """監視付きの子プロセスの中でもポートフォリオが方式ごとのプロセスを起動できる"""
+    snapshot = make_snapshot(n_staff=8)
+    events = []
+    results = run_supervised_generation(
+        snapshot, "test-portfolio", strategy="portfolio", time_limit=20,
+        on_progress=events.append
+    )
+    assert results
+    staff_ids = {s.id for s in snapshot.employees + snapshot.staffs}
+    assert {r.staff_id for r in results} <= staff_ids
+    assert all(r.start_time < r.end_time for r in results)
+    # 進捗は監視付きの子プロセス自身の段階だけが届く
+    assert all(event["type"] == "phase" for event in events)
+
+
+def test_cancel_stops_portfolio_processes(make_snapshot):
+    """中止するとポートフォリオの方式ごとのプロセスも含めて止まる"""
+    snapshot = make_snapshot(n_staff=8)
+    job_key = "test-cancel"
+    pids = []
+
+    def cancel_when_started():
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            job = _running.get(job_key)
+            if job and job["process"].pid:
+                pids.append(job["process"].pid)
+                time.sleep(3)
+                cancel_generation(job_key)
+                return
+            time.sleep(0.05)
+
+    canceller = threading.Thread(target=cancel_when_started)
+    canceller.start()
+    with pytest.raises(ValueError, match="中止"):
+        run_supervised_generation(
+            snapshot, job_key, strategy="portfolio", time_limit=60
+        )
+    canceller.join()
+
+    assert pids
+    # 親を失ったプロセスが回収されるまで少し待つ
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            os.killpg(pids[0], 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.1)
+    with pytest.raises(ProcessLookupError):
+        os.killpg(pids[0], 0)
+
+
+def test_cancel_reaches_other_worker(make_snapshot, tmp_path, monkeypatch):
+    """別のワーカーで実行中の生成も記録したプロセスグループごと中止できる"""
+    monkeypatch.setattr(shift_supervisor, "RUN_DIR", str(tmp_path))
+    job_key = "test-other-worker"
+    assert not cancel_generation(job_key)
+    assert not stop_generation(job_key)
+
+    context = multiprocessing.get_context("spawn")
+    outcome = context.Queue()
+    worker = context.Process(
+        target=generate_in_other_worker,
+        args=(make_snapshot(n_staff=8), job_key, str(tmp_path), outcome)
+    )
+    worker.start()
+    deadline = time.time() + 30
+    while time.time() < deadline and read_job_pids(job_key)[1] is None:
+        time.sleep(0.05)
+    _, child = read_job_pids(job_key)
+    assert child is not None
+    # このプロセスの登録にはない
+    assert job_key not in _running
+
+    assert cancel_generation("test-other-worker")
+    assert "中止" in outcome.get(timeout=30)
+    worker.join(timeout=10)
+    assert not os.path.exists(job_file(job_key, "pid"))
+    with pytest.raises(ProcessLookupError):
+        os.killpg(child, 0)
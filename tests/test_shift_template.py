@@ -0,0 +1,47 @@
+from shift import shift_template
+from shift.shift_supervisor import run_supervised_generation
+from shift.shift_template import get_pattern_template
+
+from conftest import build_shift_input
+
+
+def template_events(events):
+    return [e["hit"] for e in events if e.get("phase") == "template"]
+
+
+def test_second_supervised_run_reuses_template(
+    make_snapshot, tmp_path, monkeypatch
+):
+    """子プロセスが保存したテンプレートを次の子プロセスが読み込んで使う"""
+    # 子プロセスは起動時の環境変数から保存先を読む
+    monkeypatch.setenv("SHIFT_TEMPLATE_DIR", str(tmp_path))
+    snapshot = make_snapshot(n_staff=8)
+    runs = []
+    for _ in range(2):
+        events = []
+        results = run_supervised_generation(
+            snapshot, "test-template", strategy="cpsat", time_limit=3,
+            on_progress=events.append
+        )
+        assert results
+        runs.append(template_events(events))
+    assert runs == [[False], [True]]
+    assert sorted(p.suffix for p in tmp_path.iterdir()) == [".json", ".pbtxt"]
+
+
+def test_loaded_template_matches_compiled(tmp_path, monkeypatch):
+    """ファイルから読み込んだテンプレートはコンパイルしたものと同じモデル"""
+    monkeypatch.setattr(shift_template, "TEMPLATE_DIR", str(tmp_path))
+    store, _, staffs, _, patterns = build_shift_input(n_staff=4)
+    shift_template.clear_templates()
+    compiled, hit = get_pattern_template(store, staffs, patterns, 30)
+    assert not hit
+
+    shift_template.clear_templates()
+    loaded, hit = get_pattern_template(store, staffs, patterns, 30)
+    assert hit
+    assert loaded is not compiled
+    assert loaded.x == compiled.x
+    assert loaded.targets == compiled.targets
+    assert str(loaded.model.Proto()) == str(compiled.model.Proto())
+    shift_template.clear_templates()
@@ -0,0 +1,64 @@
+import pytest
+
+from shift.shift_creator import get_holidays
+from shift.shift_decomposition import count_days_before
+from shift.shift_rules import check_labor_rules
+from shift.shift_supervisor import generate_in_child
+from shift.shift_warmstart import build_warm_start, count_carry_in
+
+from conftest import MONTH, YEAR, build_shift_input
+
+
+def previous_month_shifts(staff_ids, days=range(27, 32)):
+    """前月（5月）の指定日に全員が勤務したシフト"""
+    return [(staff_id, day, 4, 9) for staff_id in staff_ids for day in days]
+
+
+def test_count_carry_in_stops_at_gap_and_limit():
+    """前月末日から途切れるまで数え、上限で打ち切る"""
+    shifts = previous_month_shifts([1], range(20, 32)) + \
+        previous_month_shifts([2], [28, 29, 31]) + \
+        previous_month_shifts([3], [30])
+    assert count_carry_in(shifts, 31, 5) == {1: 5, 2: 1}
+
+
+def test_build_warm_start_maps_weekdays():
+    """前月の勤務を同じ曜日の日に写し、月初の連勤を引き継ぐ"""
+    # 2025年5月30日（金）→ 6月の金曜日
+    warm_start = build_warm_start(
+        previous_month_shifts([1, 2], [30, 31]), [1], YEAR, MONTH,
+        get_holidays(YEAR, MONTH)
+    )
+    assert warm_start.carry_in == {1: 2}
+    assert warm_start.hints[(1, 27)] == (4, 9)
+    assert all(staff_id == 1 for staff_id, _ in warm_start.hints)
+
+
+def test_count_days_before_adds_carry_in_only_from_day_one():
+    """月初まで続く連勤にだけ前月の連勤を足す"""
+    assert count_days_before({1, 2, 3}, 4, carry_in=2) == 5
+    assert count_days_before({2, 3}, 4, carry_in=2) == 2
+    assert count_days_before(set(), 1, carry_in=3) == 3
+
+
+@pytest.mark.parametrize(
+    "strategy", ["cpsat", "weekly", "interval", "flow", "lns"]
+)
+def test_carry_in_blocks_first_day(make_snapshot, strategy):
+    """前月末に上限まで連勤したスタッフは月初に勤務させない"""
+    _, _, staffs, _, _ = build_shift_input(n_staff=8)
+    carried = [s.id for s in staffs[:4]]
+    snapshot = make_snapshot(
+        n_staff=8, previous_shifts=previous_month_shifts(carried)
+    )
+    results = generate_in_child(snapshot, strategy, time_limit=3)
+
+    assert not [r for r in results if r.staff_id in carried and r.day == 1]
+    intervals = {
+        (r.staff_id, r.day): (r.start_time, r.end_time) for r in results
+    }
+    violations = check_labor_rules(
+        intervals, list(snapshot.staffs), snapshot.rules, snapshot.last_day,
+        carry_in={staff_id: 5 for staff_id in carried}
+    )
+    assert not [v for v in violations if v["rule"] == "max_consecutive_days"]
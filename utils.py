@@ -9,6 +9,7 @@ from models import (
     StaffRejectionHistory
 )
 from database import SessionLocal
+from shift.shift_rules import DEFAULT_LABOR_RULES
 
 def get_common_context(request: Request):
     user_logged_in = request.session.get('user_logged_in', False)
@@ -54,12 +55,15 @@ def get_current_staff(request: Request, db: Session = Depends(get_db)):
     return staff
 
 
-def generate_time_options(request, open_time, close_time):
+def generate_time_options(
+    request, open_time, close_time,
+    minor_end_hour=DEFAULT_LABOR_RULES.minor_end_hour
+):
     options = []
     user_logged_in = request.session.get('user_logged_in', False)
     employment_type = request.session.get('employment_type') if user_logged_in else None
     if employment_type == "未成年バイト":
-        for hour in range(open_time, 11):
+        for hour in range(open_time, min(minor_end_hour, close_time) + 1):
             options.append(hour)
     else:
         for hour in range(open_time, close_time + 1):